@@ -0,0 +1,164 @@
+# ai_client.py
+"""
+Llamadas al servicio de IA (OpenAI) protegidas con la política de resilience.py:
+circuit breaker con llamada de prueba (half-open), bulkhead que limita las
+llamadas concurrentes y una respuesta de "no disponible" cacheada mientras el
+circuito está abierto, para no ocupar todos los hilos durante un incidente.
+"""
+import logging
+import os
+import threading
+import time
+
+import metrics
+import resilience
+import tracing
+
+log = logging.getLogger(__name__)
+
+AI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+# Tiempo máximo de complete() contando los reintentos: cada intento recibe como
+# timeout lo que queda del plazo. Por debajo del timeout de 30 s de los workers
+# de gunicorn. El cliente de OpenAI no reintenta por su cuenta (max_retries=0).
+AI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '25'))
+
+AI_POLICY = resilience.RetryPolicy(
+    attempts=int(os.getenv('OPENAI_RETRY_ATTEMPTS', '2')),
+    base_delay=0.5,
+    max_delay=2.0,
+    max_elapsed=AI_TIMEOUT,
+)
+AI_BREAKER = resilience.register_breaker(resilience.CircuitBreaker(
+    'openai',
+    failure_threshold=int(os.getenv('OPENAI_BREAKER_THRESHOLD', '3')),
+    reset_timeout=float(os.getenv('OPENAI_BREAKER_RESET', '30')),
+))
+AI_BULKHEAD = resilience.Bulkhead(
+    'openai',
+    max_concurrent=int(os.getenv('OPENAI_MAX_CONCURRENCY', '4')),
+    max_wait=float(os.getenv('OPENAI_BULKHEAD_WAIT', '0.5')),
+)
+
+# El cliente se construye en el primer uso de cada proceso (importar openai es lento
+# y su pool HTTP no debe cruzar un fork de gunicorn --preload)
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+_fast_fail = {'times_opened': None, 'response': None}
+_fast_fail_lock = threading.Lock()
+
+
+class AIUnavailable(Exception):
+    """El servicio de IA no está disponible ahora (circuito abierto, saturado o sin respuesta)."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _api_key() -> str:
+    return (os.getenv('OPENAI_API_KEY') or '').strip()
+
+
+def is_configured() -> bool:
+    """True si hay clave de API (sin construir el cliente)."""
+    return bool(_api_key())
+
+
+def get_client():
+    """Cliente de OpenAI de este proceso, o None si no hay clave o no se pudo crear."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    api_key = _api_key()
+    if not api_key:
+        return None
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            try:
+                from openai import OpenAI
+                _client = OpenAI(api_key=api_key, timeout=AI_TIMEOUT, max_retries=0)
+                _client_pid = pid
+                log.info(f"Cliente de OpenAI configurado (clave {api_key[:4]}..., pid {pid}).")
+            except Exception as e:
+                log.error(f"No se pudo configurar el cliente de OpenAI: {e}")
+                _client = None
+    return _client
+
+
+def classify_ai_error(e: Exception) -> str | None:
+    """Errores de red/timeout y 5xx cuentan como caída; el rate limit se reintenta sin abrir el circuito."""
+    import openai  # Ya importado por get_client
+    if isinstance(e, (openai.APIConnectionError, openai.InternalServerError)):
+        return resilience.TRANSIENT
+    if isinstance(e, openai.RateLimitError):
+        return resilience.CONTENTION
+    return None
+
+
+def fast_fail_response() -> dict | None:
+    """
+    Mientras el circuito está abierto devuelve la respuesta de error lista para
+    enviar (una por apertura del circuito); None si se puede intentar la llamada.
+    """
+    if AI_BREAKER.state != 'open':
+        return None
+    with _fast_fail_lock:
+        if _fast_fail['times_opened'] != AI_BREAKER.times_opened:
+            _fast_fail['times_opened'] = AI_BREAKER.times_opened
+            _fast_fail['response'] = {
+                'error': 'El servicio de IA no está disponible en este momento. Inténtalo en unos segundos.',
+                'ai_status': 'open',
+            }
+        response = dict(_fast_fail['response'])
+    response['retry_after'] = max(1, int(AI_BREAKER.retry_after()))
+    return response
+
+
+def _attempt_timeout(started: float) -> float:
+    """Timeout de un intento: lo que queda de AI_POLICY.max_elapsed y del plazo de la petición."""
+    left = AI_POLICY.max_elapsed - (time.monotonic() - started)
+    budget = resilience.remaining()
+    if budget is not None:
+        left = min(left, budget)
+    return max(0.1, min(AI_TIMEOUT, left))
+
+
+def complete(client, messages: list[dict], model: str | None = None) -> str:
+    """
+    Devuelve el texto de la respuesta del modelo.
+    Lanza AIUnavailable si el circuito está abierto, no hay plaza en el bulkhead
+    o la llamada falla tras los reintentos; el resto de errores se propaga.
+    """
+    model = model or AI_MODEL
+    try:
+        with metrics.ai_call(model) as call, tracing.span('openai.chat', model=model), AI_BULKHEAD.slot():
+            started = time.monotonic()
+
+            def attempt():
+                return client.chat.completions.create(
+                    model=model, messages=messages, timeout=_attempt_timeout(started)
+                )
+
+            response = resilience.call_with_retry(attempt, 'openai', AI_POLICY, AI_BREAKER, classify_ai_error)
+            call.usage = getattr(response, 'usage', None)
+    except resilience.CircuitOpenError as e:
+        raise AIUnavailable('El servicio de IA no está disponible en este momento.', e.retry_after) from e
+    except resilience.BulkheadFullError as e:
+        raise AIUnavailable('El servicio de IA está ocupado. Inténtalo en unos segundos.', 5) from e
+    except Exception as e:
+        if classify_ai_error(e) is None:
+            raise
+        raise AIUnavailable(f'Error al contactar el servicio de IA: {e}', AI_BREAKER.retry_after()) from e
+    return response.choices[0].message.content
+
+
+def state() -> dict:
+    """Estado observable: circuito, ocupación del bulkhead y contadores de reintentos."""
+    return {
+        'breaker': AI_BREAKER.snapshot(),
+        'bulkhead': AI_BULKHEAD.snapshot(),
+        'calls': resilience.stats.snapshot().get('openai', dict.fromkeys(resilience.RetryStats.FIELDS, 0)),
+    }
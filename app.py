@@ -3,56 +3,124 @@ import os
 import random
 import secrets
 import time
-import httpx
-import stripe
+_STARTUP_BEGAN = time.perf_counter()
 from datetime import datetime, timedelta
 from flask import session
-from flask import Flask, render_template, jsonify, request, flash, redirect, url_for
+from flask import Flask, render_template, jsonify, request, flash, redirect, url_for, send_from_directory
 from werkzeug.security import check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_wtf.csrf import CSRFProtect
-from openai import OpenAI, APIConnectionError
 from dotenv import load_dotenv
 
+# Antes de importar nuestros módulos: database y ai_client leen su configuración del entorno
+load_dotenv()
+
 # Importamos nuestras funciones de base de datos y cálculos
+import cache
+import resilience
 import database
 import calculations
+import rules
+import scaling
+import substitutes
+import variability
+import subformulas
+import formula_search
+import catalog_import
+import ai_client
+import fast_json
+import compression
+import metrics
+import tracing
+import profiling
+
+_STARTUP_IMPORTS_DONE = time.perf_counter()
 
 # --- 1. CONFIGURACIÓN INICIAL ---
-load_dotenv()
+# Nada de lo que se hace al importar abre sockets (pool de la base de datos,
+# cliente de OpenAI, Stripe): se crean en el primer uso de cada proceso, así que
+# 'gunicorn --preload' puede importar la app en el maestro y compartir su memoria
+# con los workers (copy-on-write) sin compartir conexiones.
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
+# JSON con orjson y compresión brotli/gzip de las respuestas grandes; la compresión
+# se registra antes que el resto de after_request para ejecutarse la última (y las
+# métricas antes que ella, para que su latencia incluya la compresión)
+app.json = fast_json.FastJSONProvider(app)
+metrics.init_app(app)
+compression.init_app(app)
+tracing.init_app(app)
+profiling.init_app(app)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'una-clave-secreta-muy-dificil-de-adivinar')
 app.config['WTF_CSRF_SSL_STRICT'] = False # Para entornos de proxy
 csrf = CSRFProtect(app)
 
 # Configuración de Stripe
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 stripe_price_id = os.getenv('STRIPE_PRICE_ID')
 stripe_webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
 
-# Verificar y sanear la clave de API
-api_key_raw = os.getenv('OPENAI_API_KEY')
-client = None # Inicializar cliente como None
-
-if not api_key_raw:
+def get_stripe():
+    """Módulo stripe configurado; se importa en el primer pago o webhook."""
+    import stripe
+    if stripe.api_key is None:
+        stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+        # Para pruebas de carga contra un servidor falso (benchmarks/stubs.py)
+        if os.getenv('STRIPE_API_BASE'):
+            stripe.api_base = os.getenv('STRIPE_API_BASE')
+    return stripe
+
+if not ai_client.is_configured():
     print("ERROR: No se encontró OPENAI_API_KEY en las variables de entorno")
-else:
-    # Eliminar espacios en blanco y saltos de línea
-    api_key = api_key_raw.strip()
-    if not api_key:
-        print("ERROR: La variable OPENAI_API_KEY está vacía después de sanearla.")
+
+# Presupuesto de tiempo por petición para los reintentos a la base de datos
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', '10'))
+
+@app.before_request
+def _start_request_deadline():
+    resilience.set_deadline(REQUEST_DEADLINE)
+
+@app.teardown_request
+def _clear_request_deadline(exc):
+    resilience.clear_deadline()
+
+# Métodos que no escriben en la base de datos (el resto fuerza lecturas al primario)
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+@app.before_request
+def _route_reads():
+    """
+    Read-your-writes con réplica de lectura: las peticiones que escriben, y las
+    de los READ_YOUR_WRITES_SECONDS siguientes del mismo usuario, leen del primario.
+    La marca va en la sesión (cookie), así que vale para cualquier worker.
+    """
+    if database.replica_pool is None:
+        return
+    recent_write = time.time() - session.get('db_write_at', 0) < database.READ_YOUR_WRITES_SECONDS
+    database.use_primary_for_reads(request.method not in SAFE_METHODS or recent_write)
+
+@app.after_request
+def _remember_write(response):
+    if database.replica_pool is not None and request.method not in SAFE_METHODS and response.status_code < 400:
+        session['db_write_at'] = time.time()
+    return response
+
+@app.errorhandler(database.DatabaseUnavailable)
+def _database_unavailable(e):
+    """La base de datos está caída o no respondió a tiempo: 503 con Retry-After."""
+    retry_after = str(max(1, int(e.retry_after or 5)))
+    if request.path.startswith('/api/'):
+        response = jsonify({'success': False, 'error': 'Servicio temporalmente no disponible. Inténtalo de nuevo.'})
     else:
-        print(f"INFO: Clave de API de OpenAI: {api_key[:4]}... (truncada por seguridad)")
-        # Configurar el cliente de OpenAI
-        try:
-            # Pasando explícitamente la clave saneada
-            client = OpenAI(api_key=api_key, timeout=60.0)
-            print("INFO: Cliente de OpenAI configurado con la clave de API saneada.")
-        except Exception as e:
-            print(f"ERROR: No se pudo configurar el cliente de OpenAI. Error: {e}")
-            client = None
+        response = app.response_class('Servicio temporalmente no disponible. Inténtalo de nuevo en unos segundos.', mimetype='text/plain')
+    return response, 503, {'Retry-After': retry_after}
+
+@app.errorhandler(subformulas.SubFormulaCycleError)
+def _sub_formula_cycle(e):
+    """Dos altas concurrentes dejaron un ciclo de sub-fórmulas: 409 en lugar de 500."""
+    print(f"ERROR en {request.path}: {e}")
+    return jsonify({'success': False, 'error': 'La fórmula se contiene a sí misma a través de sus sub-fórmulas. '
+                                              'Quite una de las sub-fórmulas del ciclo.'}), 409
 
 # --- 2. CONFIGURACIÓN DE FLASK-LOGIN ---
 login_manager = LoginManager()
@@ -155,14 +223,16 @@ def logout():
 @app.route('/create-checkout-session', methods=['POST'])
 @login_required
 def create_checkout_session():
+    stripe = get_stripe()
     try:
-        checkout_session = stripe.checkout.Session.create(
-            line_items=[{'price': stripe_price_id, 'quantity': 1}],
-            mode='subscription',
-            success_url=url_for('pago_exitoso', _external=True),
-            cancel_url=url_for('pago_cancelado', _external=True),
-            client_reference_id=current_user.id
-        )
+        with tracing.span('stripe.checkout_session'):
+            checkout_session = stripe.checkout.Session.create(
+                line_items=[{'price': stripe_price_id, 'quantity': 1}],
+                mode='subscription',
+                success_url=url_for('pago_exitoso', _external=True),
+                cancel_url=url_for('pago_cancelado', _external=True),
+                client_reference_id=current_user.id
+            )
         return jsonify({'url': checkout_session.url})
     except Exception as e:
         return jsonify(error=str(e)), 500
@@ -170,6 +240,7 @@ def create_checkout_session():
 @app.route('/webhook', methods=['POST'])
 @csrf.exempt
 def webhook():
+    stripe = get_stripe()
     event = None
     payload = request.data
     sig_header = request.headers.get('stripe-signature')
@@ -235,6 +306,52 @@ def terms():
 
 # --- 5. RUTAS DE API ---
 
+def _formula_lines(formula_data: dict) -> list[dict]:
+    """Líneas de la fórmula con las sub-fórmulas convertidas en ingredientes equivalentes."""
+    return subformulas.expand_lines(formula_data, current_user.id, database.get_formula_by_id)
+
+def _formulas_lines_bulk(formula_ids) -> dict[int, list[dict]]:
+    """{formula_id: líneas} de varias fórmulas, con las sub-fórmulas expandidas como en _formula_lines."""
+    formulas = database.get_formulas_bulk(list(formula_ids), current_user.id)
+    return subformulas.expand_bulk(formulas, current_user.id, database.get_formula_by_id)
+
+# Respuesta completa de get_formula_details por "<user_id>:<formula_id>". Solo se
+# cachea con un backend compartido: en memoria, la invalidación tras una edición
+# no llegaría a los demás workers.
+FORMULA_DETAILS_NAMESPACE = 'formula_details'
+
+def _formulas_changed(formula_ids: list[int]):
+    """
+    Tras modificar fórmulas: invalida su composición memorizada y la de las
+    fórmulas que las contienen, y actualiza su entrada en el índice de búsqueda.
+    """
+    affected = subformulas.invalidate(current_user.id, formula_ids, database.get_formula_ancestors)
+    for formula_id in affected:
+        cache.invalidate(FORMULA_DETAILS_NAMESPACE, f"{current_user.id}:{formula_id}")
+    _reindex_formulas(affected)
+
+def _reindex_formulas(formula_ids):
+    """Recalcula y guarda la entrada del índice de búsqueda de estas fórmulas."""
+    if not formula_ids:
+        return
+    formulas = database.get_formulas_bulk(list(formula_ids), current_user.id)
+    entries = formula_search.build_entries(formulas, current_user.id, database.get_formula_by_id)
+    database.upsert_formula_search_index(current_user.id, entries)
+
+def _is_paged_request() -> bool:
+    """True si el cliente pidió el listado paginado (limit/after/fields)."""
+    return any(k in request.args for k in ('limit', 'after', 'fields'))
+
+def _page_args() -> dict:
+    """Lee los parámetros de paginación por cursor de la query string."""
+    fields = request.args.get('fields', '')
+    limit = request.args.get('limit', type=int)
+    return {
+        'columns': [f.strip() for f in fields.split(',') if f.strip()] or None,
+        'after': request.args.get('after') or None,
+        'limit': limit,
+    }
+
 @app.route('/api/ingredients', methods=['GET'])
 @login_required
 def get_ingredientes():
@@ -242,6 +359,14 @@ def get_ingredientes():
     Devuelve los ingredientes PERSONALES del usuario actual.
     Esto es para la página de 'Gestión de Ingredientes'.
     """
+    if _is_paged_request():
+        # Paginación por cursor: ?limit=50&after=<cursor>&fields=name,precio_por_kg
+        try:
+            page = database.get_user_ingredients_page(current_user.id, **_page_args())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(page)
+
     # Modificado: Llama a get_user_ingredients en lugar de get_master_ingredients
     user_ingredients = database.get_user_ingredients(current_user.id)
     return jsonify(user_ingredients)
@@ -264,6 +389,7 @@ def add_formula_route():
     formula_id = database.add_formula(product_name, current_user.id, description)
     
     if formula_id:
+        _reindex_formulas([formula_id])
         return jsonify({'success': True, 'formula_id': formula_id})
     else:
         return jsonify({'success': False, 'error': 'Ya existe una fórmula con este nombre.'}), 409
@@ -271,7 +397,21 @@ def add_formula_route():
 @app.route('/api/formulas/<int:formula_id>/delete', methods=['POST'])
 @login_required
 def delete_formula_route(formula_id):
+    # get_formula_ancestors no filtra por usuario: comprobar antes que la fórmula es suya
+    if not database.get_formula_by_id(formula_id, current_user.id):
+        return jsonify({'success': False, 'error': 'Fórmula no encontrada o sin permiso.'}), 404
+    # Una fórmula usada como sub-fórmula no se puede borrar (la FK lo impide)
+    used_by = database.get_formula_ancestors([formula_id])
+    if used_by:
+        names = sorted(f['product_name'] for f in database.get_all_formulas(current_user.id) if f['id'] in used_by)
+        return jsonify({
+            'success': False,
+            'error': f"La fórmula se usa como sub-fórmula en: {', '.join(names)}. Quítela de esas fórmulas antes de eliminarla.",
+            'used_by': names,
+        }), 409
     success = database.delete_formula(formula_id, current_user.id)
+    if success:
+        _formulas_changed([formula_id])
     return jsonify({'success': success})
 
 @app.route('/api/formulas/<int:formula_id>/update', methods=['POST'])
@@ -285,6 +425,9 @@ def update_formula_route(formula_id):
     success = database.update_formula_name(formula_id, new_name, current_user.id)
     
     if success:
+        cache.invalidate(FORMULA_DETAILS_NAMESPACE, f"{current_user.id}:{formula_id}")
+        # Las fórmulas que la usan como sub-fórmula la indexan por su nombre
+        _formulas_changed(list(database.get_formula_ancestors([formula_id])))
         return jsonify({'success': True})
     else:
         return jsonify({'success': False, 'error': 'No se pudo actualizar la fórmula.'}), 500
@@ -319,12 +462,60 @@ def search_ingredientes_api():
         print(f"ERROR en /api/ingredients/search: {e}")
         return jsonify({"error": "No se pudieron buscar los ingredientes"}), 500
 
+@app.route('/api/ingredients/<int:ingredient_id>/substitutes', methods=['GET'])
+@login_required
+def ingredient_substitutes_api(ingredient_id):
+    """
+    Devuelve los k ingredientes (propios o base) más parecidos en composición y precio.
+    ?k=5&same_category=1&formula_id=<id> (con formula_id se proyectan los totales
+    de la fórmula si se sustituyera el ingrediente).
+    """
+    k = max(1, min(request.args.get('k', 5, type=int), 50))
+    same_category = request.args.get('same_category', '0').lower() in ('1', 'true', 'yes')
+    formula_id = request.args.get('formula_id', type=int)
+
+    index = substitutes.get_index(
+        current_user.id,
+        lambda: (database.get_user_ingredients(current_user.id), database.get_master_ingredients())
+    )
+    ingredient = index.get(ingredient_id)
+    if not ingredient:
+        return jsonify({'error': 'Ingrediente no encontrado.'}), 404
+
+    candidates = index.nearest(ingredient_id, k=k, same_category=same_category)
+
+    if formula_id:
+        formula_data = database.get_formula_by_id(formula_id, current_user.id)
+        if not formula_data:
+            return jsonify({'error': 'Fórmula no encontrada.'}), 404
+        lines = _formula_lines(formula_data)
+        for candidate in candidates:
+            swap = {field: candidate.get(field) for field in substitutes.FEATURES + ('categoria',)}
+            swapped = calculations.apply_ingredient_overrides(lines, {ingredient_id: swap})
+            totals = calculations.calculate_formula_totals(calculations.process_ingredients_for_display(swapped))
+            candidate['projected_totals'] = {key: totals.get(key, 0) for key in calculations.COST_SUMMARY_KEYS}
+
+    fields = ('id', 'name', 'categoria', 'source', 'distance', 'projected_totals') + substitutes.FEATURES
+    return jsonify({
+        'ingredient': {key: ingredient.get(key) for key in ('id', 'name', 'categoria') + substitutes.FEATURES},
+        'substitutes': [{key: c[key] for key in fields if key in c} for c in candidates],
+    })
+
 @app.route('/api/bibliografia', methods=['GET'])
 @login_required
 def get_bibliografia_api():
     """
     Ruta de API para obtener todas las entradas de la bibliografía.
     """
+    if _is_paged_request():
+        # Listado ligero: sin 'contenido' salvo que se pida en ?fields=
+        # ?q= filtra en el servidor por título, tipo y contenido
+        try:
+            page = database.get_bibliografia_page(**_page_args(), q=request.args.get('q', '').strip() or None)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(page)
+
     try:
         # Usamos la función que ya existe en tu database.py
         entries = database.get_all_bibliografia()
@@ -334,25 +525,189 @@ def get_bibliografia_api():
         # Manejo de errores por si algo falla en la base de datos
         print(f"ERROR en /api/bibliografia: {e}")
         return jsonify({"error": "No se pudieron cargar los datos de la bibliografía"}), 500
+@app.route('/api/bibliografia/<int:entry_id>', methods=['GET'])
+@login_required
+def get_bibliografia_entry_api(entry_id):
+    """Devuelve una entrada completa; los listados la cargan de forma diferida."""
+    entry = database.get_bibliografia_entry(entry_id)
+    if not entry:
+        return jsonify({"error": "Entrada no encontrada"}), 404
+    return jsonify(entry)
+
 @app.route('/api/formula/<int:formula_id>', methods=['GET'])
 @login_required
 def get_formula_details(formula_id):
+    cache_key = f"{current_user.id}:{formula_id}"
+    use_cache = cache.is_shared()
+    # Usada como sub-fórmula se valida como premezcla; puede cambiar sin editar esta fórmula
+    is_premix = formula_id in database.get_sub_formula_ids(current_user.id)
+    details = cache.get_cache().get(FORMULA_DETAILS_NAMESPACE, cache_key) if use_cache else None
+    if details is not None and details.get('is_premix') == is_premix:
+        return jsonify({"details": details})
+
     formula_data = database.get_formula_by_id(formula_id, current_user.id)
     if not formula_data:
         return jsonify({"error": "Fórmula no encontrada"}), 404
 
-    processed_ingredients = calculations.process_ingredients_for_display(formula_data.get('ingredients', []))
+    lines = _formula_lines(formula_data)
+    processed_ingredients = calculations.process_ingredients_for_display(lines)
     totals = calculations.calculate_formula_totals(processed_ingredients)
 
     # Combinar los datos para la respuesta
     details = {
         **formula_data,
         'ingredients': processed_ingredients,
-        'totals': totals
+        'totals': totals,
+        'is_premix': is_premix,
+        'validation': rules.validate_formula({**formula_data, 'ingredients': lines}, is_premix),
     }
+    if use_cache:
+        cache.get_cache().set(FORMULA_DETAILS_NAMESPACE, cache_key, details)
 
     return jsonify({"details": details})
 
+@app.route('/api/formulas/search', methods=['GET'])
+@login_required
+def search_formulas_route():
+    """
+    Busca fórmulas por rangos de totales y % de ingredientes. Ejemplos:
+      ?protein_perc=12..14&costo_por_kg=..3&sort=costo_por_kg
+      ?ingredient=Carragenina:0.5..&sort=fat_perc&order=desc
+    Solo lee el índice: lo mantienen las rutas que modifican fórmulas, y las
+    fórmulas creadas antes del índice se indexan con reindex_formulas.py.
+    """
+    try:
+        ranges = {
+            attribute: formula_search.parse_range(request.args[attribute])
+            for attribute in database.SEARCH_INDEX_ATTRIBUTES if attribute in request.args
+        }
+        ingredient_filters = [formula_search.parse_ingredient_filter(v) for v in request.args.getlist('ingredient')]
+    except ValueError:
+        return jsonify({'error': 'Filtro no válido. Usa min..max, min.. o ..max.'}), 400
+
+    try:
+        results = database.search_formulas(
+            current_user.id, ranges, ingredient_filters,
+            sort=request.args.get('sort', 'product_name'),
+            descending=request.args.get('order', 'asc').lower() == 'desc',
+            limit=request.args.get('limit', 100, type=int),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(results)
+
+@app.route('/api/formulas/audit', methods=['GET'])
+@login_required
+def audit_formulas_route():
+    """
+    Evalúa las reglas de formulación sobre todas las fórmulas del usuario en un lote.
+    Solo devuelve las fórmulas con incumplimientos.
+    """
+    formulas = database.get_all_formulas(current_user.id)
+    names = {f['id']: f['product_name'] for f in formulas}
+    lines = _formulas_lines_bulk(names)
+    results = rules.evaluate_formulas(lines, names, database.get_sub_formula_ids(current_user.id))
+
+    flagged = [
+        {'formula_id': fid, 'product_name': names[fid], 'violations': found}
+        for fid, found in results.items() if found
+    ]
+    return jsonify({'checked': len(results), 'flagged': len(flagged), 'formulas': flagged})
+
+@app.route('/api/formula/<int:formula_id>/scale', methods=['POST'])
+@login_required
+def scale_formula_route(formula_id):
+    """
+    Escala la fórmula a uno o varios pesos de lote con redondeo por línea.
+    Cuerpo: {"batch_weights_kg": [150, 300], "rounding": {"default": {"unit": "kg", "step": 0.5},
+             "<formula_ingredient_id>": {"unit": "g", "step": 5}}}
+    """
+    formula_data = database.get_formula_by_id(formula_id, current_user.id)
+    if not formula_data:
+        return jsonify({'success': False, 'error': 'Fórmula no encontrada o sin permiso.'}), 404
+
+    data = request.get_json(silent=True) or {}
+    batch_weights = data.get('batch_weights_kg')
+    if batch_weights is None and data.get('batch_kg') is not None:
+        batch_weights = [data.get('batch_kg')]
+    if not isinstance(batch_weights, list):
+        return jsonify({'success': False, 'error': 'Se requiere batch_weights_kg (lista de pesos en kg).'}), 400
+
+    processed_ingredients = calculations.process_ingredients_for_display(_formula_lines(formula_data))
+    try:
+        batches = scaling.scale_formula(processed_ingredients, batch_weights, data.get('rounding'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({'success': True, 'formula_id': formula_id,
+                    'product_name': formula_data['product_name'], 'batches': batches})
+
+MAX_VARIABILITY_BATCH = 200
+
+def _variability_options(data: dict) -> dict:
+    """Opciones de variability.simulate_formula. Lanza ValueError si 'spreads' o 'targets' no son objetos."""
+    spreads, targets = data.get('spreads'), data.get('targets')
+    if spreads is not None and (not isinstance(spreads, dict)
+                                or not all(isinstance(rule, dict) for rule in spreads.values())):
+        raise ValueError("'spreads' debe ser un objeto {formula_ingredient_id | categoría | 'default': {protein_sd, fat_sd, water_sd}}.")
+    if targets is not None and not isinstance(targets, dict):
+        raise ValueError("'targets' debe ser un objeto {protein_min, fat_max, water_protein_max, fat_protein_max}.")
+    return {
+        'spreads': spreads,
+        'targets': targets,
+        'draws': int(data.get('draws', variability.DEFAULT_DRAWS)),
+        'seed': data.get('seed'),
+    }
+
+@app.route('/api/formula/<int:formula_id>/variability', methods=['POST'])
+@login_required
+def formula_variability_route(formula_id):
+    """
+    Simula la variabilidad de composición de las materias primas y devuelve
+    bandas de percentiles y la probabilidad de incumplir los objetivos.
+    Cuerpo: {"draws": 20000, "spreads": {"default": {"protein_sd": 1.0}}, "targets": {"protein_min": 12}}
+    """
+    formula_data = database.get_formula_by_id(formula_id, current_user.id)
+    if not formula_data:
+        return jsonify({'success': False, 'error': 'Fórmula no encontrada o sin permiso.'}), 404
+
+    data = request.get_json(silent=True) or {}
+    try:
+        formula_data = {**formula_data, 'ingredients': _formula_lines(formula_data)}
+        result = variability.simulate_formula(formula_data, **_variability_options(data))
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, **result})
+
+@app.route('/api/formulas/variability', methods=['POST'])
+@login_required
+def formulas_variability_route():
+    """
+    Modo por lotes: simula varias fórmulas (o todas si no se indica 'formula_ids').
+    """
+    data = request.get_json(silent=True) or {}
+    requested = data.get('formula_ids')
+    if requested is not None and (
+            not isinstance(requested, list)
+            or not all(isinstance(fid, int) and not isinstance(fid, bool) for fid in requested)):
+        return jsonify({'success': False, 'error': "'formula_ids' debe ser una lista de enteros."}), 400
+    names = {f['id']: f['product_name'] for f in database.get_all_formulas(current_user.id)}
+    formula_ids = requested or list(names)
+    formula_ids = [fid for fid in formula_ids if fid in names][:MAX_VARIABILITY_BATCH]
+    lines = _formulas_lines_bulk(formula_ids)
+
+    results = []
+    try:
+        options = _variability_options(data)
+        for fid in formula_ids:
+            if not lines.get(fid):
+                continue
+            formula_data = {'id': fid, 'product_name': names[fid], 'ingredients': lines[fid]}
+            results.append(variability.simulate_formula(formula_data, **options))
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'formulas': results})
+
 @app.route('/api/formula/<int:formula_id>/ingredients/add', methods=['POST'])
 @login_required
 def add_ingredient_to_formula_route(formula_id):
@@ -371,10 +726,12 @@ def add_ingredient_to_formula_route(formula_id):
 
     # La función de base de datos se encarga de la lógica de añadir
     database.add_ingredient_to_formula(formula_id, ingredient_name, float(quantity), unit, current_user.id)
+    substitutes.invalidate(current_user.id) # Puede haber copiado un ingrediente base al catálogo
+    _formulas_changed([formula_id])
 
     # Después de añadir, obtenemos y devolvemos el estado actualizado de la fórmula
     updated_formula_data = database.get_formula_by_id(formula_id, current_user.id)
-    processed_ingredients = calculations.process_ingredients_for_display(updated_formula_data.get('ingredients', []))
+    processed_ingredients = calculations.process_ingredients_for_display(_formula_lines(updated_formula_data))
     totals = calculations.calculate_formula_totals(processed_ingredients)
     
     response_data = {
@@ -387,6 +744,95 @@ def add_ingredient_to_formula_route(formula_id):
     }
     return jsonify(response_data)
 
+@app.route('/api/formula/<int:formula_id>/subformulas/add', methods=['POST'])
+@login_required
+def add_sub_formula_route(formula_id):
+    """Añade otra fórmula del usuario (premezcla, salmuera) como línea de esta fórmula."""
+    data = request.get_json(silent=True) or {}
+    sub_formula_id = data.get('sub_formula_id')
+    quantity = data.get('quantity')
+    unit = data.get('unit')
+
+    if not all([sub_formula_id, quantity, unit]):
+        return jsonify({'success': False, 'error': 'Faltan datos de la sub-fórmula.'}), 400
+
+    status = database.add_sub_formula_to_formula(formula_id, int(sub_formula_id), float(quantity), unit, current_user.id)
+    if status == 'not_found':
+        return jsonify({'success': False, 'error': 'Fórmula no encontrada o sin permiso.'}), 404
+    if status == 'cycle':
+        return jsonify({'success': False, 'error': 'La sub-fórmula ya contiene esta fórmula (ciclo).'}), 409
+    if status != 'success':
+        return jsonify({'success': False, 'error': 'No se pudo añadir la sub-fórmula.'}), 500
+
+    _formulas_changed([formula_id])
+    return get_formula_details(formula_id)
+
+# Máximo de operaciones por petición a /api/formula/<id>/lines
+MAX_LINE_OPERATIONS = 500
+LINE_OPERATIONS = ('add', 'update', 'delete')
+
+def _parse_line_operations(raw_operations) -> list[dict]:
+    """Valida y normaliza las operaciones de línea. Lanza ValueError con un mensaje para el cliente."""
+    if not isinstance(raw_operations, list) or not raw_operations:
+        raise ValueError("'operations' debe ser una lista no vacía.")
+    if len(raw_operations) > MAX_LINE_OPERATIONS:
+        raise ValueError(f"Máximo {MAX_LINE_OPERATIONS} operaciones por petición.")
+
+    operations, seen_ids = [], set()
+    for i, raw in enumerate(raw_operations):
+        op = raw.get('op') if isinstance(raw, dict) else None
+        if op not in LINE_OPERATIONS:
+            raise ValueError(f"Operación {i}: 'op' debe ser uno de {', '.join(LINE_OPERATIONS)}.")
+        parsed = {'op': op}
+        if op in ('update', 'delete'):
+            line_id = raw.get('id')
+            if not isinstance(line_id, int) or isinstance(line_id, bool):
+                raise ValueError(f"Operación {i}: falta el 'id' de la línea.")
+            if line_id in seen_ids:
+                raise ValueError(f"Operación {i}: la línea {line_id} aparece más de una vez.")
+            seen_ids.add(line_id)
+            parsed['id'] = line_id
+        if op == 'add' and not all([raw.get('name'), raw.get('quantity'), raw.get('unit')]):
+            raise ValueError(f"Operación {i}: faltan datos del ingrediente.")
+        if op != 'delete':
+            parsed['name'] = (raw.get('name') or '').strip() or None
+            parsed['unit'] = raw.get('unit') or None
+            parsed['quantity'] = float(raw['quantity']) if raw.get('quantity') is not None else None
+        operations.append(parsed)
+    return operations
+
+@app.route('/api/formula/<int:formula_id>/lines', methods=['POST'])
+@login_required
+def apply_formula_lines_route(formula_id):
+    """
+    Aplica en bloque altas, cambios y bajas de líneas y devuelve la fórmula recalculada.
+    Cuerpo: {"revision": 7, "operations": [{"op": "add", "name": "...", "quantity": 1.5, "unit": "kg"},
+    {"op": "update", "id": 12, "quantity": 300, "unit": "g"}, {"op": "delete", "id": 13}]}.
+    Si 'revision' no es la actual (otra sesión editó la fórmula) responde 409 sin aplicar nada.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        operations = _parse_line_operations(data.get('operations'))
+        revision = int(data['revision']) if data.get('revision') is not None else None
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    result = database.apply_formula_line_operations(formula_id, current_user.id, operations, revision)
+    status = result['status']
+    if status == 'not_found':
+        return jsonify({'success': False, 'error': 'Fórmula no encontrada o sin permiso.'}), 404
+    if status == 'conflict':
+        return jsonify({'success': False, 'error': result['error'], 'revision': result['revision']}), 409
+    if status == 'invalid':
+        return jsonify({'success': False, 'error': result['error']}), 400
+    if status != 'success':
+        return jsonify({'success': False, 'error': 'No se pudieron aplicar los cambios.'}), 500
+
+    if any(op.get('name') for op in operations):
+        substitutes.invalidate(current_user.id) # Puede haber copiado ingredientes base al catálogo
+    _formulas_changed([formula_id])
+    return get_formula_details(formula_id)
+
 @app.route('/api/ingredient/<int:formula_ingredient_id>/delete', methods=['POST'])
 @login_required
 def delete_ingredient_route(formula_ingredient_id):
@@ -399,6 +845,7 @@ def delete_ingredient_route(formula_ingredient_id):
         return jsonify({'success': False, 'error': 'No tienes permiso para esta acción.'}), 403
 
     database.delete_ingredient(formula_ingredient_id)
+    _formulas_changed([formula_id])
     
     return get_formula_details(formula_id) # Reutilizamos la función para devolver la fórmula actualizada
 
@@ -432,6 +879,8 @@ def update_ingredient_route(formula_ingredient_id):
             new_unit,
             current_user.id
         )
+        substitutes.invalidate(current_user.id)
+        _formulas_changed([formula_id])
     except Exception as e:
         print(f"Error al actualizar ingrediente: {e}")
         return jsonify({'success': False, 'error': 'Error interno al actualizar.'}), 500
@@ -500,6 +949,7 @@ def add_user_ingredient_route():
         
         new_id = database.add_user_ingredient(details, current_user.id)
         if new_id:
+            substitutes.invalidate(current_user.id)
             return jsonify({'success': True, 'id': new_id})
         else:
             return jsonify({'success': False, 'error': 'El ingrediente ya existe.'}), 409
@@ -508,6 +958,60 @@ def add_user_ingredient_route():
         print(f"Error en add_user_ingredient_route: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Campos de un ingrediente que cambian el costo o la composición de una fórmula
+IMPACT_FIELDS = ('precio_por_kg', 'protein_percent', 'fat_percent', 'water_percent', 'water_retention_factor')
+
+def _ingredient_overrides(details: dict) -> dict:
+    """Extrae de 'details' los campos que afectan al cálculo, como float o None."""
+    overrides = {}
+    for field in IMPACT_FIELDS:
+        if field in details:
+            value = details[field]
+            overrides[field] = float(value) if value not in (None, '') else None
+    return overrides
+
+def _ingredient_impact(ingredient_id: int, overrides: dict) -> list[dict]:
+    """
+    Recalcula, en una pasada, las fórmulas del usuario que usan el ingrediente:
+    totales actuales ('before'), con los cambios propuestos ('after') y la diferencia.
+    """
+    where_used = database.get_formulas_using_ingredients([ingredient_id], current_user.id)
+    formulas = where_used.get(ingredient_id, [])
+    if not formulas:
+        return []
+
+    lines = _formulas_lines_bulk(f['id'] for f in formulas)
+    before = calculations.recost_formulas(lines)
+    after = calculations.recost_formulas(lines, {ingredient_id: overrides})
+
+    impact = []
+    for formula in formulas:
+        b, a = before[formula['id']], after[formula['id']]
+        impact.append({
+            'formula_id': formula['id'],
+            'product_name': formula['product_name'],
+            'before': b,
+            'after': a,
+            'delta': {key: a[key] - b[key] for key in b},
+        })
+    return impact
+
+@app.route('/api/ingredientes/<int:ingredient_id>/impact', methods=['GET', 'POST'])
+@login_required
+def user_ingredient_impact_route(ingredient_id):
+    """
+    Muestra qué fórmulas usan un ingrediente y cómo cambiarían su costo y
+    composición. POST recibe los campos propuestos (p. ej. {"precio_por_kg": 2.4}).
+    """
+    try:
+        details = request.get_json(silent=True) or {}
+        overrides = _ingredient_overrides(details)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Valores numéricos inválidos.'}), 400
+
+    impact = _ingredient_impact(ingredient_id, overrides)
+    return jsonify({'success': True, 'ingredient_id': ingredient_id, 'formulas': impact})
+
 @app.route('/api/ingredientes/<int:ingredient_id>/update', methods=['POST'])
 @login_required
 def update_user_ingredient_route(ingredient_id):
@@ -517,10 +1021,15 @@ def update_user_ingredient_route(ingredient_id):
         if not details.get('name'):
             return jsonify({'success': False, 'error': 'El nombre es requerido.'}), 400
 
+        # Se calcula antes de escribir: 'before' refleja los valores actuales
+        impact = _ingredient_impact(ingredient_id, _ingredient_overrides(details))
+
         success = database.update_user_ingredient(ingredient_id, details, current_user.id)
         
         if success:
-            return jsonify({'success': True})
+            substitutes.invalidate(current_user.id)
+            _formulas_changed([f['formula_id'] for f in impact])
+            return jsonify({'success': True, 'impact': impact})
         else:
             return jsonify({'success': False, 'error': 'No se pudo actualizar o el ingrediente no se encontró.'}), 404
             
@@ -528,6 +1037,51 @@ def update_user_ingredient_route(ingredient_id):
         print(f"Error en update_user_ingredient_route: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/ingredientes/bulk-update', methods=['POST'])
+@login_required
+def bulk_update_user_ingredients_route():
+    """
+    Actualiza el catálogo con una lista de proveedor: archivo CSV/XLSX en 'file'
+    o JSON {"items": [{"name": "...", "precio_por_kg": 2.4}, ...]}.
+    Con ?dry_run=1 (o "dry_run": true) solo devuelve el informe de cambios.
+    """
+    try:
+        if 'file' in request.files:
+            upload = request.files['file']
+            raw_rows = catalog_import.read_file(upload.filename or '', upload.read())
+            dry_run = request.form.get('dry_run', request.args.get('dry_run', '')) in ('1', 'true')
+        else:
+            data = request.get_json(silent=True) or {}
+            raw_rows = data.get('items')
+            if not isinstance(raw_rows, list):
+                return jsonify({'success': False, 'error': "Envíe un archivo o una lista 'items'."}), 400
+            dry_run = bool(data.get('dry_run')) or request.args.get('dry_run') in ('1', 'true')
+        rows, errors = catalog_import.normalize_rows(raw_rows)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error al leer la lista de ingredientes: {e}")
+        return jsonify({'success': False, 'error': 'No se pudo leer el archivo.'}), 400
+
+    report = database.bulk_update_user_ingredients(current_user.id, rows, dry_run=dry_run)
+    if report is None:
+        return jsonify({'success': False, 'error': 'No se pudo aplicar la actualización.'}), 500
+
+    changed_ids = [item['id'] for item in report['updated']]
+    where_used = database.get_formulas_using_ingredients(changed_ids, current_user.id) if changed_ids else {}
+    affected = sorted({f['id'] for formulas in where_used.values() for f in formulas})
+    if changed_ids and not dry_run:
+        substitutes.invalidate(current_user.id)
+        _formulas_changed(affected)
+
+    return jsonify({
+        'success': True,
+        'dry_run': dry_run,
+        **report,
+        'errors': errors,
+        'affected_formulas': affected,
+    })
+
 @app.route('/api/ingredientes/<int:ingredient_id>/delete', methods=['POST'])
 @login_required
 def delete_user_ingredient_route(ingredient_id):
@@ -536,6 +1090,7 @@ def delete_user_ingredient_route(ingredient_id):
         status = database.delete_user_ingredient(ingredient_id, current_user.id)
         
         if status == 'success':
+            substitutes.invalidate(current_user.id)
             return jsonify({'success': True})
         elif status == 'in_use':
             return jsonify({'success': False, 'error': 'El ingrediente está en uso en una fórmula y no se puede eliminar.'}), 409
@@ -566,9 +1121,14 @@ def delete_bibliografia_route(entry_id):
 @app.route("/api/chat", methods=['POST'])
 @login_required
 def chat_with_ai():
+    client = ai_client.get_client()
     if not client:
         return jsonify({'answer': 'Error: La API de IA no está configurada.'}), 500
 
+    fast_fail = ai_client.fast_fail_response()
+    if fast_fail:
+        return jsonify({'answer': fast_fail['error'], **fast_fail}), 503, {'Retry-After': str(fast_fail['retry_after'])}
+
     current_credits = database.check_and_handle_credit_expiration(current_user.id)
     if current_credits <= 0:
         return jsonify({'answer': 'No tienes créditos suficientes. Por favor, recarga para continuar.'}), 402
@@ -619,12 +1179,11 @@ Responde a la pregunta del usuario:
     ]
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages # Enviamos la lista simple
-        )
-        ai_answer = response.choices[0].message.content
+        ai_answer = ai_client.complete(client, messages)
         database.decrement_user_credits(current_user.id, 1)
+    except ai_client.AIUnavailable as e:
+        print(f"AVISO: Servicio de IA no disponible en el chat: {e}")
+        return jsonify({'answer': str(e)}), 503, {'Retry-After': str(max(1, int(e.retry_after)))}
     except Exception as e:
         print(f"ERROR: Error al llamar a la API de OpenAI en el chat: {e}")
         return jsonify({'answer': f'Error al contactar el servicio de IA: {e}'}), 500
@@ -641,9 +1200,14 @@ def test_post_route():
 @app.route("/api/formula/<int:formula_id>/analyze", methods=['POST'])
 @login_required
 def analyze_formula_route(formula_id):
+    client = ai_client.get_client()
     if not client:
         return jsonify({'analysis': 'Error: La API de IA no está configurada.'}), 500
 
+    fast_fail = ai_client.fast_fail_response()
+    if fast_fail:
+        return jsonify({'analysis': fast_fail['error'], **fast_fail}), 503, {'Retry-After': str(fast_fail['retry_after'])}
+
     # Primero, verificar y manejar la expiración de créditos
     current_credits = database.check_and_handle_credit_expiration(current_user.id)
     
@@ -656,7 +1220,7 @@ def analyze_formula_route(formula_id):
     if not formula_data:
         return jsonify({'success': False, 'error': 'Fórmula no encontrada o sin permiso'}), 404
 
-    processed_ingredients = calculations.process_ingredients_for_display(formula_data.get('ingredients', []))
+    processed_ingredients = calculations.process_ingredients_for_display(_formula_lines(formula_data))
     totals = calculations.calculate_formula_totals(processed_ingredients)
 
     system_prompt = "Eres un experto en tecnología de alimentos y formulación de productos. Analiza la siguiente fórmula y proporciona una evaluación y recomendaciones concisas y fáciles de entender en formato Markdown."
@@ -686,30 +1250,77 @@ def analyze_formula_route(formula_id):
 
     print(f"INFO: Tamaño del user_prompt: {len(user_prompt)} caracteres")
 
-    retries = 3
-    for attempt in range(retries):
-        try:
-            print(f"INFO: Intento {attempt + 1}/{retries} de solicitud a OpenAI para formula_id: {formula_id}")
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
-            print(f"INFO: Solicitud a OpenAI exitosa para formula_id: {formula_id}")
-            analysis_text = response.choices[0].message.content
-            database.decrement_user_credits(current_user.id, 5)
-            return jsonify({'analysis': analysis_text})
-        except APIConnectionError as e:
-            print(f"ERROR: Intento {attempt + 1}/{retries} fallido: {e}")
-            if attempt < retries - 1:
-                time.sleep(2 ** attempt)  # Exponential backoff
-                continue
-            else:
-                print(f"ERROR TYPE: {type(e)}")
-                print(f"ERROR ARGS: {e.args}")
-                print(f"ERROR: Error al llamar a la API de OpenAI: {e}")
-                return jsonify({'analysis': f'Error al contactar el servicio de IA: {e}'}), 500
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    try:
+        analysis_text = ai_client.complete(client, messages)
+    except ai_client.AIUnavailable as e:
+        print(f"ERROR: Servicio de IA no disponible para formula_id {formula_id}: {e}")
+        return jsonify({'analysis': str(e)}), 503, {'Retry-After': str(max(1, int(e.retry_after)))}
+    except Exception as e:
+        print(f"ERROR: Error al llamar a la API de OpenAI: {e}")
+        return jsonify({'analysis': f'Error al contactar el servicio de IA: {e}'}), 500
+
+    print(f"INFO: Solicitud a OpenAI exitosa para formula_id: {formula_id}")
+    database.decrement_user_credits(current_user.id, 5)
+    return jsonify({'analysis': analysis_text})
+
+@app.route("/api/ai/status", methods=['GET'])
+@login_required
+def ai_status_route():
+    """Estado del circuito, del bulkhead y de los reintentos del servicio de IA."""
+    return jsonify({'configured': ai_client.is_configured(), **ai_client.state()})
+
+# --- OBSERVABILIDAD ---
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """Métricas en formato Prometheus (ver metrics.py)."""
+    if not metrics.enabled():
+        return jsonify({'error': 'prometheus_client no está instalado'}), 503
+    if not metrics.authorized(request):
+        return jsonify({'error': 'No autorizado'}), 401
+    body, content_type = metrics.render()
+    return body, 200, {'Content-Type': content_type}
+
+@app.route('/healthz', methods=['GET'])
+def healthz_route():
+    """El proceso responde (no comprueba dependencias)."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz_route():
+    """Listo para recibir tráfico: el pool entrega una conexión que responde a SELECT 1."""
+    if not database.check_pool_health():
+        return jsonify({'status': 'unavailable', 'database': 'error'}), 503
+    return jsonify({'status': 'ready', 'database': 'ok'})
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles_route():
+    """Perfiles guardados por profiling.py (solo administradores)."""
+    if not profiling.is_admin(request, current_user):
+        return jsonify({'error': 'No autorizado'}), 403
+    return jsonify({'directory': profiling.PROFILE_DIR, 'profiles': profiling.list_profiles(),
+                    'routes': profiling.PROFILE_ROUTES})
+
+@app.route('/api/admin/profiles/<path:name>', methods=['GET'])
+def download_profile_route(name):
+    if not profiling.is_admin(request, current_user):
+        return jsonify({'error': 'No autorizado'}), 403
+    if name not in profiling.list_profiles():
+        return jsonify({'error': 'Perfil no encontrado'}), 404
+    return send_from_directory(profiling.PROFILE_DIR, name, as_attachment=True)
+
+# --- INFORME DE ARRANQUE ---
+STARTUP_REPORT = {
+    'pid': os.getpid(),
+    'imports_ms': round((_STARTUP_IMPORTS_DONE - _STARTUP_BEGAN) * 1000, 1),
+    'setup_ms': round((time.perf_counter() - _STARTUP_IMPORTS_DONE) * 1000, 1),
+    'total_ms': round((time.perf_counter() - _STARTUP_BEGAN) * 1000, 1),
+    'deferred': ['database_pool', 'openai_client', 'stripe', 'scipy'],
+}
+print(f"INFO: App importada en {STARTUP_REPORT['total_ms']} ms "
+      f"(imports {STARTUP_REPORT['imports_ms']} ms, configuración {STARTUP_REPORT['setup_ms']} ms, pid {STARTUP_REPORT['pid']}).")
 
 # ... (resto del archivo sin cambios)
\ No newline at end of file
@@ -0,0 +1,19 @@
+# benchmarks/__init__.py
+"""
+Benchmarks de los caminos calientes (cálculos, base de datos, JSON).
+
+  python -m benchmarks run [suite ...] [--output resultados.json] [--compare base.json]
+  python -m benchmarks compare base.json resultados.json [--threshold 0.10]
+
+Cada resultado guarda la mediana, el mínimo y la desviación por llamada; la
+comparación marca como regresión lo que empeora más que el umbral.
+
+  python -m benchmarks.dataset --users 50000 [--seed 42]
+
+carga datos sintéticos a escala de producción en la base de DATABASE_URL, y
+
+  python -m benchmarks.loadtest --spawn --workers 4 --concurrency 64
+
+los usa para una prueba de carga HTTP contra gunicorn (con OpenAI y Stripe
+sustituidos por benchmarks/stubs.py).
+"""
@@ -0,0 +1,79 @@
+# benchmarks/__main__.py
+import argparse
+import datetime
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import harness  # noqa: E402
+
+# Suite -> módulo con cases() (se importa solo la que se ejecuta)
+SUITES = {
+    'calculations': 'benchmarks.bench_calculations',
+    'database': 'benchmarks.bench_database',
+    'json': 'benchmarks.bench_json',
+}
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def _run(args) -> int:
+    suites = args.suites or list(SUITES)
+    unknown = [s for s in suites if s not in SUITES]
+    if unknown:
+        print(f"Suites desconocidas: {', '.join(unknown)} (disponibles: {', '.join(SUITES)})")
+        return 2
+
+    results, meta = {}, {'suites': suites}
+    for suite in suites:
+        module = importlib.import_module(SUITES[suite])
+        print(f"[{suite}]")
+        if hasattr(module, 'backend'):
+            meta['database_backend'] = module.backend()
+        results.update(harness.run_cases(module.cases(), only=args.filter))
+
+    data = harness.report(results, meta)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    harness.save(data, output)
+    print(f"\nResultados guardados en {output}")
+
+    if args.compare:
+        summary = harness.compare(harness.load(args.compare), data, args.threshold, args.metric)
+        harness.print_comparison(summary, args.threshold)
+        return 1 if summary['regressions'] else 0
+    return 0
+
+
+def _compare(args) -> int:
+    summary = harness.compare(harness.load(args.baseline), harness.load(args.current), args.threshold, args.metric)
+    harness.print_comparison(summary, args.threshold)
+    return 1 if summary['regressions'] else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Benchmarks de los caminos calientes.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="Ejecuta suites y guarda los resultados en JSON")
+    run.add_argument('suites', nargs='*', help=f"Suites a ejecutar ({', '.join(SUITES)}); por defecto todas")
+    run.add_argument('--filter', help="Solo los casos cuyo nombre contiene este texto")
+    run.add_argument('--output', '-o', help="Archivo de resultados (por defecto benchmarks/results/<fecha>.json)")
+    run.add_argument('--compare', metavar='BASELINE', help="Compara con una línea base al terminar")
+
+    compare = commands.add_parser('compare', help="Compara dos archivos de resultados")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+
+    for command in (run, compare):
+        command.add_argument('--threshold', type=float, default=0.10,
+                             help="Cambio relativo a partir del cual se marca una regresión (0.10 = 10%%)")
+        command.add_argument('--metric', choices=('median_us', 'min_us'), default='median_us')
+
+    args = parser.parse_args()
+    return _run(args) if args.command == 'run' else _compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
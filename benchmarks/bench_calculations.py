@@ -0,0 +1,48 @@
+# benchmarks/bench_calculations.py
+"""Casos de calculations.py (y su versión vectorizada) para fórmulas de 10 a 10.000 líneas y lotes de fórmulas."""
+import random
+
+import calculations
+import records
+from formula_arrays import FormulaArrays
+
+LINE_COUNTS = (10, 100, 1000, 10000)
+# Lotes de fórmulas: (fórmulas, líneas por fórmula), como el recálculo tras un cambio de precios
+BATCHES = ((100, 20), (1000, 20))
+CATEGORIES = list(calculations.CATEGORY_ORDER)
+
+
+def formula_lines(count: int, seed: int = 1, formula_id: int = 1) -> list[records.FormulaLine]:
+    """Líneas con la misma forma que devuelve database.get_formula_by_id."""
+    rng = random.Random(seed)
+    return records.formula_lines(
+        (formula_id * 100000 + i, formula_id, i % 500, round(rng.uniform(0.05, 40), 3), rng.choice(('kg', 'g')),
+         f"Ingrediente {i % 500}", rng.uniform(0, 80), rng.uniform(0, 60), rng.uniform(0, 90), None, None,
+         rng.uniform(0, 2), None, rng.choice((None, 5.0)), rng.uniform(0.5, 40), rng.choice(CATEGORIES))
+        for i in range(count)
+    )
+
+
+def cases() -> dict:
+    rng = random.Random(0)
+    quantities = [(rng.uniform(0, 1000), rng.choice(('kg', 'g', 'KG', None))) for _ in range(1000)]
+    result = {
+        'calculations.convert_to_kg x1000': lambda: [calculations.convert_to_kg(q, u) for q, u in quantities],
+    }
+    for count in LINE_COUNTS:
+        lines = formula_lines(count)
+        processed = calculations.process_ingredients_for_display(lines)
+        result[f'calculations.process_ingredients_for_display[{count}]'] = (
+            lambda lines=lines: calculations.process_ingredients_for_display(lines))
+        result[f'calculations.calculate_formula_totals[{count}]'] = (
+            lambda processed=processed: calculations.calculate_formula_totals(processed))
+
+    for formulas, per_formula in BATCHES:
+        batch = {fid: formula_lines(per_formula, seed=fid, formula_id=fid) for fid in range(1, formulas + 1)}
+        overrides = {i: {'precio_por_kg': 9.99} for i in range(0, 500, 7)}
+        label = f'{formulas}x{per_formula}'
+        result[f'calculations.recost_formulas[{label}]'] = (
+            lambda batch=batch, overrides=overrides: calculations.recost_formulas(batch, overrides))
+        result[f'formula_arrays.FormulaArrays.totals[{label}]'] = (
+            lambda batch=batch: FormulaArrays(batch).totals())
+    return result
@@ -0,0 +1,121 @@
+# benchmarks/bench_database.py
+"""
+Casos de database.py contra la base de DATABASE_URL o, si no está definida,
+contra una base SQLite temporal (sqlite_backend.py) con los mismos datos.
+Contra PostgreSQL usa una base de pruebas: se crean usuarios 'bench-*'.
+"""
+import os
+import random
+import tempfile
+import uuid
+
+FORMULA_LINES = int(os.getenv('BENCH_FORMULA_LINES', '200'))
+BASE_INGREDIENTS = int(os.getenv('BENCH_BASE_INGREDIENTS', '300'))
+INDEXED_FORMULAS = int(os.getenv('BENCH_INDEXED_FORMULAS', '50'))
+
+
+def _use_stand_in():
+    """Sin DATABASE_URL se crea una base SQLite temporal (antes de importar database)."""
+    if not os.getenv('DATABASE_URL'):
+        path = os.path.join(tempfile.mkdtemp(prefix='bench_db_'), 'bench.db')
+        os.environ['DATABASE_URL'] = f"sqlite:///{path}"
+
+
+def _new_user(database) -> int:
+    """Usuario directo por SQL: add_user calcula el hash de la contraseña, que no es lo que se mide."""
+    with database.get_db_connection_context() as conn:
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO users (username, password_hash, full_name, is_verified) VALUES (%s, %s, %s, TRUE) RETURNING id",
+                    (f"bench-{uuid.uuid4().hex[:12]}@local", '-', 'Benchmark'),
+                )
+                return cursor.fetchone()[0]
+
+
+def _ensure_base_ingredients(database, rng: random.Random):
+    import calculations
+    rows = [
+        (f"Bench {i:04d}", rng.uniform(0, 80), rng.uniform(0, 60), rng.uniform(0, 90), rng.uniform(0, 2),
+         rng.uniform(0.5, 40), rng.choice(list(calculations.CATEGORY_ORDER)))
+        for i in range(BASE_INGREDIENTS)
+    ]
+    with database.get_db_connection_context() as conn:
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM base_ingredients WHERE name LIKE 'Bench %%'")
+                if cursor.fetchone()[0] >= BASE_INGREDIENTS:
+                    return
+                cursor.executemany(
+                    """INSERT INTO base_ingredients (name, protein_percent, fat_percent, water_percent,
+                           water_retention_factor, precio_por_kg, categoria)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s) ON CONFLICT (name) DO NOTHING""",
+                    rows,
+                )
+
+
+def _formula(database, user_id: int, rng: random.Random, name: str, lines: int) -> int:
+    formula_id = database.add_formula(name, user_id)
+    operations = [
+        {'op': 'add', 'name': f"Bench {rng.randrange(BASE_INGREDIENTS):04d}",
+         'quantity': round(rng.uniform(0.1, 30), 2), 'unit': rng.choice(('kg', 'g'))}
+        for _ in range(lines)
+    ]
+    result = database.apply_formula_line_operations(formula_id, user_id, operations)
+    if result['status'] != 'success':
+        raise RuntimeError(f"No se pudo crear la fórmula de prueba: {result}")
+    return formula_id
+
+
+def setup() -> dict:
+    """Crea los datos de prueba y devuelve el contexto de los casos."""
+    _use_stand_in()
+    import database
+    import formula_search
+
+    database.initialize_database()
+    rng = random.Random(42)
+    _ensure_base_ingredients(database, rng)
+    user_id = _new_user(database)
+    database.seed_initial_ingredients(user_id)
+    formula_id = _formula(database, user_id, rng, 'Bench principal', FORMULA_LINES)
+    formula_ids = [formula_id] + [
+        _formula(database, user_id, rng, f"Bench {i}", 20) for i in range(INDEXED_FORMULAS - 1)
+    ]
+    formulas = database.get_formulas_bulk(formula_ids, user_id)
+    database.upsert_formula_search_index(
+        user_id, formula_search.build_entries(formulas, user_id, database.get_formula_by_id)
+    )
+    return {'database': database, 'user_id': user_id, 'formula_id': formula_id, 'formula_ids': formula_ids}
+
+
+def backend() -> str:
+    _use_stand_in()
+    import database
+    return database.DB_BACKEND
+
+
+def cases() -> dict:
+    ctx = setup()
+    database, user_id, formula_id = ctx['database'], ctx['user_id'], ctx['formula_id']
+    # Sin la caché de cache.cached: se mide la consulta
+    search_base = getattr(database.search_base_ingredient_names, '__wrapped__', database.search_base_ingredient_names)
+    line_ingredient = database.get_formula_by_id(formula_id, user_id)['ingredients'][0].formula_ingredient_id
+
+    def seed_new_user():
+        database.seed_initial_ingredients(_new_user(database))
+
+    return {
+        'database.get_user_by_id': lambda: database.get_user_by_id(user_id),
+        f'database.get_formula_by_id[{FORMULA_LINES}]': lambda: database.get_formula_by_id(formula_id, user_id),
+        'database.get_formula_id_for_ingredient': lambda: database.get_formula_id_for_ingredient(line_ingredient),
+        f'database.get_formulas_bulk[{INDEXED_FORMULAS}]':
+            lambda: database.get_formulas_bulk(ctx['formula_ids'], user_id),
+        'database.search_user_ingredient_names': lambda: database.search_user_ingredient_names('bench 01', user_id),
+        'database.search_base_ingredient_names (sin caché)': lambda: search_base('bench 02'),
+        'database.search_formulas (rango)':
+            lambda: database.search_formulas(user_id, {'protein_perc': (5, 60)}, sort='costo_por_kg'),
+        'database.search_formulas (ingrediente)':
+            lambda: database.search_formulas(user_id, ingredient_filters=[('Bench 0007', 0.1, None)]),
+        f'database.seed_initial_ingredients[{BASE_INGREDIENTS}+] (usuario nuevo)': seed_new_user,
+    }
@@ -0,0 +1,20 @@
+# benchmarks/bench_json.py
+"""Serialización y compresión de las respuestas más grandes (cargas de json_responses.py)."""
+from flask import Flask
+
+import compression
+import fast_json
+from benchmarks.json_responses import payloads
+
+
+def cases() -> dict:
+    app = Flask(__name__)
+    provider = fast_json.FastJSONProvider(app)
+    result = {}
+    for name, payload in payloads().items():
+        body = provider.dumps(payload).encode()
+        result[f'json.dumps {name}'] = lambda payload=payload: provider.dumps(payload)
+        for encoding in compression.available_encodings():
+            result[f'compress.{encoding} {name}'] = (
+                lambda body=body, encoding=encoding: compression.compress(body, encoding))
+    return result
@@ -0,0 +1,398 @@
+# benchmarks/dataset.py
+"""
+Generador de datos sintéticos a escala de producción.
+
+  python -m benchmarks.dataset --users 50000 --formulas-per-user 10 --lines-per-formula 10
+  python -m benchmarks.dataset --users 200 --reset          # base de desarrollo pequeña
+
+Crea usuarios '<prefijo>NNNNNN@example.test' (todos con la contraseña
+PASSWORD), un catálogo propio por usuario, fórmulas con la mezcla de
+categorías de calculations.CATEGORY_ORDER (cárnicos, agua/hielo,
+retenedores, condimentos y colorantes, con premezclas usadas como
+sub-fórmula), sus líneas y textos de bibliografía.
+
+Es determinista: con la misma semilla, los datos de cada usuario son los
+mismos sea cual sea el número total de usuarios (cada usuario tiene su propio
+generador). Los ids se asignan aquí a partir del máximo existente, de modo
+que las filas se cargan sin ida y vuelta: en PostgreSQL con COPY por lotes de
+usuarios (un lote por transacción) y después se ajustan las secuencias; en
+SQLite con executemany. No debe haber otras escrituras durante la carga.
+Las fórmulas cargadas no entran en el índice de búsqueda por composición;
+para /api/formulas/search, ejecutar después 'python reindex_formulas.py'.
+"""
+import argparse
+import csv
+import datetime
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'synthetic-password'
+DEFAULT_PREFIX = 'synth'
+EMAIL_DOMAIN = 'example.test'
+BASE_DATE = datetime.datetime(2023, 1, 1)
+
+# Plantillas del catálogo por categoría:
+# (nombre, proteína %, grasa %, agua %, factor de retención, precio/kg, uso mín. %, uso máx. %)
+CATALOG = {
+    "Cárnico": [
+        ("Carne de Res 90/10", 20, 10, 69, None, 6.5, None, None),
+        ("Carne de Res 80/20", 18, 20, 61, None, 5.2, None, None),
+        ("Carne de Cerdo", 20, 5, 75, None, 2.0, None, None),
+        ("Carne de Pollo", 20, 3, 73, None, 1.5, None, None),
+        ("Pasta de Pollo (CDM)", 13, 17, 69, None, 0.9, None, 40),
+        ("Grasa de Cerdo", 11, 29, 60, None, 0.5, None, 30),
+        ("Papada de Cerdo", 9, 55, 35, None, 0.8, None, 25),
+        ("Cuero de Cerdo", 35, 8, 57, None, 1.1, None, 15),
+        ("Recorte de Res 65/35", 16, 35, 48, None, 3.1, None, None),
+        ("Corazón de Res", 17, 4, 78, None, 1.9, None, 20),
+        ("Pierna de Pavo", 19, 6, 74, None, 2.4, None, None),
+    ],
+    "Agua/Hielo": [
+        ("Agua", None, None, 100, None, None, None, None),
+        ("Hielo", None, None, 100, None, None, None, None),
+    ],
+    "Retenedor/No Cárnico": [
+        ("Proteína Aislada de Soya", 90, 1, 5, 4, 4.5, 1, 4),
+        ("Proteína Concentrada de Soya", 68, 1, 7, 3, 2.8, 1, 6),
+        ("Almidón de Papa", None, None, 12, 2, 1.4, 2, 8),
+        ("Almidón de Yuca", None, None, 13, 2, 1.1, 2, 8),
+        ("Harina de Trigo", 11, 1, 12, 1.5, 0.7, 2, 10),
+        ("Harina de Arroz", 7, 1, 12, 2, 1.0, 2, 8),
+        ("Carragenina", None, None, 10, 10, 10, 0.2, 1),
+        ("Fibra de Cítricos", 7, 1, 8, 8, 6, 0.3, 1.5),
+        ("Plasma de Cerdo", 70, 2, 8, 5, 3.9, 0.5, 3),
+    ],
+    "Condimento/Aditivo": [
+        ("Sal", None, None, None, None, 0.2, 1.2, 2.5),
+        ("Sal de Cura (Nitrito 6.25%)", None, None, None, None, 1.5, 0.2, 0.4),
+        ("Fosfato de Sodio", None, None, None, 2, 3.2, 0.2, 0.5),
+        ("Eritorbato de Sodio", None, None, None, None, 6.5, 0.03, 0.06),
+        ("Azúcar", None, None, None, None, 0.9, 0.3, 2),
+        ("Ajo en Polvo", 17, 1, 6, None, 2.0, None, None),
+        ("Cebolla en Polvo", 10, 1, 5, None, 3.3, None, None),
+        ("Pimienta Negra", 10, 3, 12, None, 9.0, None, None),
+        ("Comino", 18, 22, 8, None, 8.0, None, None),
+        ("Nuez Moscada", 6, 36, 6, None, 14.0, None, None),
+        ("Humo Líquido", None, None, 80, None, 7.5, None, 0.5),
+        ("Glutamato Monosódico", None, None, None, None, 2.2, None, 0.5),
+    ],
+    "Colorante": [
+        ("Annatto", None, None, None, None, 5.0, None, None),
+        ("Carmín de Cochinilla", None, None, None, None, 12.0, None, None),
+        ("Rojo Allura", None, None, None, None, 15.0, None, None),
+        ("Paprika Oleorresina", None, None, None, None, 18.0, None, None),
+    ],
+}
+SUPPLIERS = ("Proveedor A", "Proveedor B", "Importado", "Nacional", "Lote Económico", "Premium")
+
+# Reparto de líneas por categoría (fracción del total de líneas de una fórmula)
+# y rango de cantidad por línea con su unidad
+LINE_MIX = {
+    "Cárnico": (0.40, (5.0, 60.0), 'kg'),
+    "Agua/Hielo": (0.10, (5.0, 30.0), 'kg'),
+    "Retenedor/No Cárnico": (0.20, (0.5, 8.0), 'kg'),
+    "Condimento/Aditivo": (0.25, (20.0, 900.0), 'g'),
+    "Colorante": (0.05, (1.0, 60.0), 'g'),
+}
+PRODUCTS = ("Salchicha", "Jamón", "Mortadela", "Chorizo", "Longaniza", "Salami", "Pastel de Carne",
+            "Hamburguesa", "Nugget", "Tocino", "Butifarra", "Queso de Puerco")
+VARIANTS = ("Viena", "Frankfurt", "Cocido", "Ahumado", "Económico", "Premium", "de Pavo", "de Pollo",
+            "Picante", "Especial", "Tradicional", "Light")
+PREMIXES = ("Salmuera Base", "Mezcla de Especias", "Emulsión de Cuero")
+PREMIX_RATE = 0.15       # Fracción de fórmulas que son premezclas
+SUB_FORMULA_RATE = 0.30  # Probabilidad de que una fórmula use una premezcla como línea
+FIRST_NAMES = ("Ana", "Luis", "María", "Carlos", "Lucía", "Jorge", "Sofía", "Diego", "Elena", "Pablo",
+               "Carmen", "Andrés", "Valeria", "Miguel", "Paula", "Raúl")
+LAST_NAMES = ("García", "Rodríguez", "López", "Martínez", "Pérez", "Gómez", "Sánchez", "Díaz",
+              "Torres", "Ramírez", "Flores", "Vargas", "Castro", "Rojas")
+
+BIBLIOGRAPHY_TYPES = ("Artículo", "Libro", "Norma", "Nota técnica", "Tesis")
+BIBLIOGRAPHY_TOPICS = ("la retención de agua", "la estabilidad de la emulsión", "el color del curado",
+                       "la textura", "el rendimiento de cocción", "la vida útil", "la reducción de sodio",
+                       "la sustitución de grasa", "el control de costos", "la inocuidad")
+BIBLIOGRAPHY_SENTENCES = (
+    "El {ingrediente} mejora {tema} cuando se dosifica entre {a} y {b} %.",
+    "En ensayos con {producto} se observó que {tema} depende de la relación agua/proteína.",
+    "La temperatura final de la pasta no debe superar los {a} °C durante el cuteado.",
+    "Un exceso de {ingrediente} afecta {tema} y aumenta la purga en el empaque.",
+    "Se recomienda incorporar el {ingrediente} al inicio del mezclado junto con la sal.",
+    "La norma fija un máximo de {a} mg/kg de nitrito residual en {producto}.",
+    "Los resultados muestran diferencias significativas en {tema} entre lotes.",
+    "Para {producto} se sugiere un contenido de grasa inferior al {b} %.",
+)
+
+TABLE_COLUMNS = {
+    'users': ('id', 'username', 'password_hash', 'full_name', 'is_verified', 'credits'),
+    'user_ingredients': ('id', 'name', 'protein_percent', 'fat_percent', 'water_percent', 've_protein_percent',
+                         'notes', 'water_retention_factor', 'min_usage_percent', 'max_usage_percent',
+                         'precio_por_kg', 'categoria', 'user_id'),
+    'formulas': ('id', 'product_name', 'description', 'creation_date', 'user_id', 'revision'),
+    'formula_ingredients': ('id', 'formula_id', 'ingredient_id', 'quantity', 'unit', 'sub_formula_id'),
+    'bibliografia': ('id', 'titulo', 'tipo', 'contenido'),
+}
+# Orden de carga (las claves foráneas apuntan siempre a tablas anteriores)
+LOAD_ORDER = ('users', 'user_ingredients', 'formulas', 'formula_ingredients')
+
+
+class IdAllocator:
+    """Siguiente id libre por tabla, a partir del máximo existente al empezar."""
+
+    def __init__(self, start: dict):
+        self._next = dict(start)
+
+    def take(self, table: str) -> int:
+        value = self._next[table]
+        self._next[table] = value + 1
+        return value
+
+
+def username(prefix: str, index: int) -> str:
+    return f"{prefix}{index:06d}@{EMAIL_DOMAIN}"
+
+
+def _jitter(rng: random.Random, value, spread: float = 0.08):
+    if value is None:
+        return None
+    return round(value * rng.uniform(1 - spread, 1 + spread), 2)
+
+
+def catalog(rng: random.Random, size: int) -> list[tuple]:
+    """Ingredientes de un usuario: todas las plantillas y variantes por proveedor hasta 'size'."""
+    templates = [(categoria, t) for categoria, items in CATALOG.items() for t in items]
+    items = [(t[0], categoria, t) for categoria, t in templates]
+    names = {name for name, _, _ in items}
+    while len(items) < size:
+        categoria, template = rng.choice(templates)
+        name = f"{template[0]} ({rng.choice(SUPPLIERS)})"
+        if name not in names:
+            names.add(name)
+            items.append((name, categoria, template))
+
+    rows = []
+    for name, categoria, (_, protein, fat, water, retention, price, min_use, max_use) in items[:max(size, 1)]:
+        rows.append((name, _jitter(rng, protein), _jitter(rng, fat), _jitter(rng, water, 0.03),
+                     None, None, retention, min_use, max_use, _jitter(rng, price, 0.25), categoria))
+    return rows
+
+
+def _formula_lines(rng: random.Random, by_category: dict, line_count: int) -> list[tuple]:
+    """(índice de ingrediente, cantidad, unidad) con el reparto de LINE_MIX; al menos un cárnico."""
+    categories = list(LINE_MIX)
+    weights = [LINE_MIX[c][0] for c in categories]
+    picks = ["Cárnico"] + rng.choices(categories, weights=weights, k=max(line_count - 1, 0))
+    used, lines = set(), []
+    for categoria in picks:
+        candidates = [i for i in by_category.get(categoria, ()) if i not in used]
+        if not candidates:
+            continue
+        index = rng.choice(candidates)
+        used.add(index)
+        _, (low, high), unit = LINE_MIX[categoria]
+        lines.append((index, round(rng.uniform(low, high), 2), unit))
+    return lines
+
+
+def user_rows(seed: int, index: int, ids: IdAllocator, options, password_hash: str) -> dict:
+    """Filas de todas las tablas para el usuario 'index' (deterministas para seed + index)."""
+    rng = random.Random(f"{seed}:{index}")
+    user_id = ids.take('users')
+    rows = {table: [] for table in LOAD_ORDER}
+    full_name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    rows['users'].append((user_id, username(options.prefix, index), password_hash, full_name, True,
+                          rng.choice((0, 0, 5, 20, 100))))
+
+    ingredient_ids, by_category = [], {}
+    for position, ingredient in enumerate(catalog(rng, options.catalog_size)):
+        ingredient_id = ids.take('user_ingredients')
+        ingredient_ids.append(ingredient_id)
+        by_category.setdefault(ingredient[-1], []).append(position)
+        rows['user_ingredients'].append((ingredient_id, *ingredient, user_id))
+
+    mean_formulas, mean_lines = options.formulas_per_user, options.lines_per_formula
+    formula_count = rng.randint(max(mean_formulas // 2, 1), max(mean_formulas + mean_formulas // 2, 1))
+    premix_count = min(len(PREMIXES), int(formula_count * PREMIX_RATE))
+    premix_ids = []
+    for number in range(formula_count):
+        formula_id = ids.take('formulas')
+        if number < premix_count:
+            name = PREMIXES[number]
+            premix_ids.append(formula_id)
+        else:
+            name = f"{rng.choice(PRODUCTS)} {rng.choice(VARIANTS)} {number + 1:03d}"
+        created = BASE_DATE + datetime.timedelta(seconds=rng.randrange(3 * 365 * 86400))
+        description = f"Formulación sintética {number + 1} de {full_name}" if rng.random() < 0.5 else None
+        rows['formulas'].append((formula_id, name, description, created.isoformat(), user_id,
+                                 rng.randrange(0, 20)))
+
+        line_count = rng.randint(max(mean_lines // 2, 1), max(mean_lines + mean_lines // 2, 1))
+        for position, quantity, unit in _formula_lines(rng, by_category, line_count):
+            rows['formula_ingredients'].append(
+                (ids.take('formula_ingredients'), formula_id, ingredient_ids[position], quantity, unit, None))
+        if premix_ids and number >= premix_count and rng.random() < SUB_FORMULA_RATE:
+            rows['formula_ingredients'].append(
+                (ids.take('formula_ingredients'), formula_id, None, round(rng.uniform(1, 15), 2), 'kg',
+                 rng.choice(premix_ids)))
+    return rows
+
+
+def bibliography_rows(seed: int, count: int, ids: IdAllocator) -> list[tuple]:
+    rng = random.Random(f"{seed}:bibliografia")
+    ingredients = [t[0].lower() for items in CATALOG.values() for t in items]
+    rows = []
+    for number in range(count):
+        topic = rng.choice(BIBLIOGRAPHY_TOPICS)
+        product = rng.choice(PRODUCTS).lower()
+        paragraphs = []
+        for _ in range(rng.randint(2, 6)):
+            sentences = [
+                rng.choice(BIBLIOGRAPHY_SENTENCES).format(
+                    ingrediente=rng.choice(ingredients), tema=rng.choice(BIBLIOGRAPHY_TOPICS), producto=product,
+                    a=rng.randint(1, 15), b=rng.randint(10, 35))
+                for _ in range(rng.randint(3, 8))
+            ]
+            paragraphs.append(' '.join(sentences))
+        title = f"Efecto de {topic} en {product} ({number + 1})"
+        rows.append((ids.take('bibliografia'), title, rng.choice(BIBLIOGRAPHY_TYPES), '\n\n'.join(paragraphs)))
+    return rows
+
+
+def _csv(rows: list[tuple]) -> io.StringIO:
+    """CSV para COPY: None -> campo vacío sin comillas (NULL), booleanos como t/f."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in rows:
+        writer.writerow(['' if v is None else ('t' if v is True else 'f' if v is False else v) for v in row])
+    buffer.seek(0)
+    return buffer
+
+
+def _load(database, conn, table: str, rows: list[tuple]):
+    if not rows:
+        return
+    columns = TABLE_COLUMNS[table]
+    if database.DB_BACKEND == 'sqlite':
+        placeholders = ', '.join('?' * len(columns))
+        conn.raw.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        return
+    with conn.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", _csv(rows))
+
+
+def _start_ids(database, conn) -> dict:
+    start = {}
+    with conn.cursor() as cursor:
+        for table in TABLE_COLUMNS:
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+            start[table] = cursor.fetchone()[0] + 1
+    return start
+
+
+def _reset(database, conn, prefix: str) -> int:
+    """Borra los usuarios sintéticos con este prefijo (y en cascada sus datos)."""
+    pattern = f"{prefix}%@{EMAIL_DOMAIN}"
+    with conn:
+        with conn.cursor() as cursor:
+            # Las líneas van primero: ingredient_id y sub_formula_id son ON DELETE RESTRICT
+            cursor.execute(
+                """DELETE FROM formula_ingredients WHERE formula_id IN (
+                       SELECT f.id FROM formulas f JOIN users u ON u.id = f.user_id WHERE u.username LIKE %s)""",
+                (pattern,),
+            )
+            cursor.execute("DELETE FROM formulas WHERE user_id IN (SELECT id FROM users WHERE username LIKE %s)",
+                           (pattern,))
+            cursor.execute("DELETE FROM users WHERE username LIKE %s", (pattern,))
+            return cursor.rowcount
+
+
+def _finish(database, conn):
+    with conn:
+        with conn.cursor() as cursor:
+            if database.DB_BACKEND == 'postgres':
+                for table in TABLE_COLUMNS:
+                    cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                   f"GREATEST((SELECT MAX(id) FROM {table}), 1))")
+    # ANALYZE fuera de la transacción para que el planificador vea los nuevos volúmenes
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    conn.commit()
+
+
+def generate(options) -> dict:
+    """Genera y carga el conjunto de datos; devuelve los totales por tabla."""
+    import database
+    from werkzeug.security import generate_password_hash
+
+    database.initialize_database()
+    password_hash = generate_password_hash(PASSWORD)
+    totals = {table: 0 for table in TABLE_COLUMNS}
+    started = time.perf_counter()
+
+    with database.get_db_connection_context() as conn:
+        if options.reset:
+            print(f"Usuarios sintéticos borrados: {_reset(database, conn, options.prefix)}")
+        ids = IdAllocator(_start_ids(database, conn))
+        conn.commit()
+
+        for first in range(0, options.users, options.batch_users):
+            batch = {table: [] for table in LOAD_ORDER}
+            for index in range(first, min(first + options.batch_users, options.users)):
+                for table, rows in user_rows(options.seed, index, ids, options, password_hash).items():
+                    batch[table].extend(rows)
+            with conn:
+                if database.DB_BACKEND == 'postgres':
+                    with conn.cursor() as cursor:
+                        cursor.execute("SET LOCAL synchronous_commit = off")
+                for table in LOAD_ORDER:
+                    _load(database, conn, table, batch[table])
+                    totals[table] += len(batch[table])
+            elapsed = time.perf_counter() - started
+            print(f"  {min(first + options.batch_users, options.users)}/{options.users} usuarios, "
+                  f"{totals['formula_ingredients']} líneas ({elapsed:.1f} s)")
+
+        if options.bibliography:
+            # La bibliografía es común: solo se completa hasta el número pedido
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT COUNT(*) FROM bibliografia")
+                    existing = cursor.fetchone()[0]
+                rows = bibliography_rows(options.seed, options.bibliography, ids)[existing:]
+                _load(database, conn, 'bibliografia', rows)
+                totals['bibliografia'] = len(rows)
+        _finish(database, conn)
+
+    totals['seconds'] = round(time.perf_counter() - started, 1)
+    return totals
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.dataset',
+                                     description="Carga datos sintéticos en la base de DATABASE_URL.")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--formulas-per-user', type=int, default=10, help="Media por usuario")
+    parser.add_argument('--lines-per-formula', type=int, default=10, help="Media por fórmula")
+    parser.add_argument('--catalog-size', type=int, default=60, help="Ingredientes por usuario")
+    parser.add_argument('--bibliography', type=int, default=500, help="Entradas de bibliografía en total")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--prefix', default=DEFAULT_PREFIX, help="Prefijo de los correos de los usuarios")
+    parser.add_argument('--batch-users', type=int, default=500, help="Usuarios por transacción de carga")
+    parser.add_argument('--reset', action='store_true', help="Borra antes los usuarios con este prefijo")
+    options = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        print("Defina DATABASE_URL (postgresql://... o sqlite:///ruta.db).")
+        return 2
+    totals = generate(options)
+    print(f"\nCargado en {totals.pop('seconds')} s: "
+          + ', '.join(f"{table}={count}" for table, count in totals.items()))
+    print(f"Usuarios: {username(options.prefix, 0)} ... {username(options.prefix, options.users - 1)}, "
+          f"contraseña '{PASSWORD}'")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
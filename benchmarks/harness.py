@@ -0,0 +1,134 @@
+# benchmarks/harness.py
+"""Medición, formato de resultados (JSON) y comparación con una línea base."""
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+# Cada repetición dura al menos esto: las funciones rápidas se llaman en bucle
+MIN_RUN_SECONDS = float(os.getenv('BENCH_MIN_RUN_SECONDS', '0.05'))
+REPEAT = int(os.getenv('BENCH_REPEAT', '5'))
+
+
+def _loops_for(func) -> int:
+    """Número de llamadas por repetición para que cada una dure al menos MIN_RUN_SECONDS."""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_RUN_SECONDS:
+            return loops
+        loops = max(loops * 2, int(loops * MIN_RUN_SECONDS / max(elapsed, 1e-9)) + 1)
+
+
+def measure(func, repeat: int = REPEAT) -> dict:
+    """Tiempo por llamada de func() en microsegundos: mediana, mínimo y desviación de 'repeat' repeticiones."""
+    loops = _loops_for(func)
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((time.perf_counter() - started) * 1e6 / loops)
+    return {
+        'median_us': statistics.median(samples),
+        'min_us': min(samples),
+        'stdev_us': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'loops': loops,
+        'repeat': repeat,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_cases(cases: dict, only: str | None = None, verbose: bool = True) -> dict:
+    """Mide {nombre: función}; 'only' filtra por subcadena del nombre."""
+    results = {}
+    for name, func in cases.items():
+        if only and only not in name:
+            continue
+        results[name] = measure(func)
+        if verbose:
+            r = results[name]
+            print(f"  {name:58} {format_us(r['median_us']):>10}  (mín {format_us(r['min_us'])}, ±{format_us(r['stdev_us'])})")
+    return results
+
+
+def report(results: dict, meta: dict | None = None) -> dict:
+    return {
+        'meta': {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'machine': f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPU)",
+            **(meta or {}),
+        },
+        'results': results,
+    }
+
+
+def save(data: dict, path: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def format_us(value: float) -> str:
+    if value >= 1e6:
+        return f"{value / 1e6:.2f} s"
+    if value >= 1e3:
+        return f"{value / 1e3:.2f} ms"
+    return f"{value:.1f} µs"
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.10, metric: str = 'median_us') -> dict:
+    """
+    Compara dos informes caso a caso. Devuelve {'regressions', 'improvements',
+    'unchanged', 'missing', 'new'}; cada entrada de las tres primeras es
+    (nombre, antes, después, cambio relativo).
+    """
+    before, after = baseline['results'], current['results']
+    summary = {'regressions': [], 'improvements': [], 'unchanged': [],
+               'missing': sorted(before.keys() - after.keys()), 'new': sorted(after.keys() - before.keys())}
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name][metric], after[name][metric]
+        change = (new - old) / old if old else 0.0
+        if change > threshold:
+            summary['regressions'].append((name, old, new, change))
+        elif change < -threshold:
+            summary['improvements'].append((name, old, new, change))
+        else:
+            summary['unchanged'].append((name, old, new, change))
+    return summary
+
+
+def print_comparison(summary: dict, threshold: float):
+    for title, key in (('REGRESIONES', 'regressions'), ('Mejoras', 'improvements'), ('Sin cambios', 'unchanged')):
+        if not summary[key]:
+            continue
+        print(f"\n{title} (umbral ±{threshold:.0%}):")
+        for name, old, new, change in summary[key]:
+            print(f"  {name:58} {format_us(old):>10} -> {format_us(new):>10}  {change:+.1%}")
+    if summary['missing']:
+        print(f"\nSolo en la línea base: {', '.join(summary['missing'])}")
+    if summary['new']:
+        print(f"\nCasos nuevos: {', '.join(summary['new'])}")
@@ -0,0 +1,126 @@
+# benchmarks/json_responses.py
+"""
+Serialización y compresión de las respuestas JSON más grandes.
+
+Genera cargas con la forma de /api/ingredients (todas las columnas de
+user_ingredients), /api/bibliografia (entradas completas) y el detalle de una
+fórmula, y mide para cada una:
+  - ms por respuesta con el proveedor JSON por defecto de Flask y con fast_json;
+  - tamaño sin comprimir, con gzip y con brotli, y ms de compresión.
+No necesita base de datos.
+
+Uso: python benchmarks/json_responses.py [--iterations 50] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import calculations  # noqa: E402
+import compression  # noqa: E402
+import fast_json  # noqa: E402
+import records  # noqa: E402
+
+CATEGORIES = list(calculations.CATEGORY_ORDER)
+WORDS = ('proteína', 'emulsión', 'retención', 'agua', 'grasa', 'fosfato', 'carragenina', 'almidón',
+         'curado', 'nitrito', 'textura', 'rendimiento', 'cocción', 'salmuera', 'inyección', 'pasta')
+
+
+def _ingredients(rng: random.Random, count: int) -> list[dict]:
+    return [{
+        'id': i, 'name': f"Ingrediente {i} {rng.choice(WORDS)}", 'user_id': 1,
+        'protein_percent': rng.uniform(0, 80), 'fat_percent': rng.uniform(0, 60),
+        'water_percent': rng.uniform(0, 90), 've_protein_percent': rng.choice([None, rng.uniform(0, 20)]),
+        'notes': rng.choice([None, ' '.join(rng.choices(WORDS, k=8))]),
+        'water_retention_factor': rng.uniform(0, 3), 'min_usage_percent': rng.choice([None, 0.1]),
+        'max_usage_percent': rng.choice([None, rng.uniform(1, 30)]),
+        'precio_por_kg': round(rng.uniform(0.5, 40), 2), 'categoria': rng.choice(CATEGORIES),
+    } for i in range(count)]
+
+
+def _bibliografia(rng: random.Random, count: int) -> list[dict]:
+    return [{
+        'id': i, 'titulo': f"Entrada {i}: {' '.join(rng.choices(WORDS, k=4))}", 'tipo': 'articulo',
+        'contenido': ' '.join(rng.choices(WORDS, k=600)),
+    } for i in range(count)]
+
+
+def _formula_details(rng: random.Random, count: int) -> dict:
+    lines = records.formula_lines(
+        (i, 1, i, rng.uniform(0.1, 50), rng.choice(['kg', 'g']), f"Ingrediente {i}",
+         rng.uniform(0, 80), rng.uniform(0, 60), rng.uniform(0, 90), None, None,
+         rng.uniform(0, 3), None, None, rng.uniform(0.5, 40), rng.choice(CATEGORIES))
+        for i in range(count)
+    )
+    processed = calculations.process_ingredients_for_display(lines)
+    return {'details': {'id': 1, 'product_name': 'Salchicha', 'ingredients': processed,
+                        'totals': calculations.calculate_formula_totals(processed)}}
+
+
+def payloads(seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    return {
+        '/api/ingredients (2000)': _ingredients(rng, 2000),
+        '/api/bibliografia (200)': _bibliografia(rng, 200),
+        '/api/formula/<id> (80 líneas)': _formula_details(rng, 80),
+    }
+
+
+def _ms(call, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call()
+    return (time.perf_counter() - started) * 1000 / iterations
+
+
+def run(iterations: int = 50) -> dict:
+    app = Flask(__name__)
+    default_provider, fast_provider = DefaultJSONProvider(app), fast_json.FastJSONProvider(app)
+    results = {}
+    with app.app_context():
+        for name, payload in payloads().items():
+            body = fast_provider.response(payload).get_data()
+            result = {
+                'default_ms': _ms(lambda: default_provider.response(payload).get_data(), iterations),
+                'fast_ms': _ms(lambda: fast_provider.response(payload).get_data(), iterations),
+                'default_bytes': len(default_provider.response(payload).get_data()),
+                'bytes': len(body),
+            }
+            for encoding in compression.available_encodings():
+                result[f'{encoding}_bytes'] = len(compression.compress(body, encoding))
+                result[f'{encoding}_ms'] = _ms(lambda: compression.compress(body, encoding), iterations)
+            results[name] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--json', action='store_true', help="Imprime los resultados en JSON")
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    if fast_json.orjson is None:
+        print("AVISO: orjson no está instalado; fast_json usa el proveedor por defecto.\n")
+    for name, r in results.items():
+        print(name)
+        print(f"  serialización: {r['default_ms']:.2f} ms -> {r['fast_ms']:.2f} ms "
+              f"({r['default_ms'] / r['fast_ms']:.1f}x)")
+        print(f"  tamaño: {r['default_bytes'] / 1024:.1f} KiB (antes) / {r['bytes'] / 1024:.1f} KiB (orjson, sin escapes \\u)")
+        for encoding in compression.available_encodings():
+            print(f"  {encoding}: {r[f'{encoding}_bytes'] / 1024:.1f} KiB "
+                  f"({100 * r[f'{encoding}_bytes'] / r['bytes']:.0f}%) en {r[f'{encoding}_ms']:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
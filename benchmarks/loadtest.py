@@ -0,0 +1,344 @@
+# benchmarks/loadtest.py
+"""
+Prueba de carga HTTP de las rutas de la API.
+
+  python -m benchmarks.loadtest --url http://127.0.0.1:8000 --concurrency 32 --duration 60
+  python -m benchmarks.loadtest --spawn --workers 4 --threads 8 --concurrency 64
+
+Cada usuario virtual (un hilo con su propia sesión) inicia sesión con un
+usuario sintético de benchmarks/dataset.py y repite escenarios elegidos por
+peso (--mix):
+
+  formula   GET /api/formula/<id> de una de sus fórmulas
+  lines     añade, modifica y borra una línea (la fórmula queda como estaba)
+  search    ráfaga de /api/ingredients/search como al teclear un nombre
+  formulas  GET /api/formulas
+
+Al final informa, por ruta, el rendimiento (peticiones/s), los percentiles
+p50/p95/p99 de latencia y la tasa de errores (respuestas >= 400 o fallos de
+conexión), y guarda el resultado en JSON como el resto de benchmarks.
+
+Con --spawn arranca gunicorn con la base de DATABASE_URL y con OpenAI y
+Stripe apuntando a los stubs locales (benchmarks/stubs.py).
+"""
+import argparse
+import datetime
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+from benchmarks import dataset, harness, stubs  # noqa: E402
+
+DEFAULT_MIX = 'formula=50,search=25,lines=15,formulas=10'
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+_CSRF_INPUT = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+_CSRF_META = re.compile(r'name="csrf-token"[^>]*content="([^"]+)"')
+
+INGREDIENT_NAMES = [template[0] for items in dataset.CATALOG.values() for template in items]
+# Ingredientes para el escenario 'lines': están en todos los catálogos sintéticos
+LINE_INGREDIENTS = [(template[0], dataset.LINE_MIX[categoria][2])
+                    for categoria, items in dataset.CATALOG.items() for template in items]
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class RouteStats:
+    """Latencias y códigos de estado por ruta, compartidos por todos los hilos."""
+
+    def __init__(self, warmup_until: float = 0.0):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._statuses = {}
+        self._errors = {}
+        self.warmup_until = warmup_until
+
+    def record(self, route: str, started: float, elapsed: float, status: int | None, error: bool):
+        if started < self.warmup_until:
+            return
+        with self._lock:
+            self._latencies.setdefault(route, []).append(elapsed)
+            statuses = self._statuses.setdefault(route, {})
+            key = str(status) if status is not None else 'conexión'
+            statuses[key] = statuses.get(key, 0) + 1
+            if error:
+                self._errors[route] = self._errors.get(route, 0) + 1
+
+    def summary(self, seconds: float) -> dict:
+        with self._lock:
+            routes = {route: sorted(values) for route, values in self._latencies.items()}
+            statuses = {route: dict(counts) for route, counts in self._statuses.items()}
+            errors = dict(self._errors)
+        results = {}
+        for route, values in sorted(routes.items()):
+            count = len(values)
+            results[route] = {
+                'requests': count,
+                'throughput_rps': round(count / seconds, 2) if seconds > 0 else 0.0,
+                'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+                'max_ms': round(values[-1] * 1000, 2),
+                'errors': errors.get(route, 0),
+                'error_rate': round(errors.get(route, 0) / count, 4) if count else 0.0,
+                'statuses': statuses.get(route, {}),
+            }
+        return results
+
+
+class VirtualUser:
+    """Sesión HTTP de un usuario sintético."""
+
+    def __init__(self, base_url: str, username: str, stats: RouteStats, rng: random.Random, timeout: float):
+        self.client = httpx.Client(base_url=base_url, timeout=timeout, follow_redirects=False)
+        self.username = username
+        self.stats = stats
+        self.rng = rng
+        self.csrf_token = None
+        self.formula_ids = []
+
+    def close(self):
+        self.client.close()
+
+    def request(self, route: str, method: str, path: str, **kwargs) -> httpx.Response | None:
+        headers = kwargs.pop('headers', {})
+        if method == 'POST' and self.csrf_token:
+            headers['X-CSRFToken'] = self.csrf_token
+        started = time.perf_counter()
+        try:
+            response = self.client.request(method, path, headers=headers, **kwargs)
+        except httpx.HTTPError:
+            self.stats.record(route, started, time.perf_counter() - started, None, True)
+            return None
+        self.stats.record(route, started, time.perf_counter() - started, response.status_code,
+                          response.status_code >= 400)
+        return response
+
+    def login(self) -> bool:
+        page = self.request('GET /login', 'GET', '/login')
+        match = _CSRF_INPUT.search(page.text) if page is not None else None
+        if not match:
+            return False
+        response = self.request('POST /login', 'POST', '/login', data={
+            'csrf_token': match.group(1), 'username': self.username, 'password': dataset.PASSWORD,
+        })
+        if response is None or response.status_code != 302:
+            return False
+        # El token CSRF de las llamadas a la API es el de la página principal, como en el navegador
+        index = self.request('GET /', 'GET', '/')
+        match = _CSRF_META.search(index.text) if index is not None and index.status_code == 200 else None
+        if not match:
+            return False
+        self.csrf_token = match.group(1)
+        return self.formulas()
+
+    def formulas(self) -> bool:
+        response = self.request('GET /api/formulas', 'GET', '/api/formulas')
+        if response is None or response.status_code != 200:
+            return False
+        self.formula_ids = [formula['id'] for formula in response.json()]
+        return True
+
+    def formula(self):
+        if self.formula_ids:
+            self.request('GET /api/formula/<id>', 'GET', f"/api/formula/{self.rng.choice(self.formula_ids)}")
+
+    def search(self):
+        """Una petición por tecla a partir de la segunda letra, con el ritmo de alguien escribiendo."""
+        word = self.rng.choice(INGREDIENT_NAMES).lower()
+        for end in range(2, min(len(word), 12) + 1):
+            self.request('GET /api/ingredients/search', 'GET', '/api/ingredients/search',
+                         params={'q': word[:end]})
+            time.sleep(self.rng.uniform(0.03, 0.12))
+
+    def lines(self):
+        if not self.formula_ids:
+            return
+        formula_id = self.rng.choice(self.formula_ids)
+        name, unit = self.rng.choice(LINE_INGREDIENTS)
+        response = self.request('POST /api/formula/<id>/ingredients/add', 'POST',
+                                f"/api/formula/{formula_id}/ingredients/add",
+                                json={'name': name, 'quantity': round(self.rng.uniform(0.1, 5), 2), 'unit': unit})
+        if response is None or response.status_code != 200:
+            return
+        added = [line['formula_ingredient_id'] for line in response.json()['details']['ingredients']
+                 if line['ingredient_name'] == name]
+        if not added:
+            return
+        line_id = max(added)
+        self.request('POST /api/ingredient/<id>/update', 'POST', f"/api/ingredient/{line_id}/update",
+                     json={'name': name, 'quantity': round(self.rng.uniform(0.1, 5), 2), 'unit': unit})
+        self.request('POST /api/ingredient/<id>/delete', 'POST', f"/api/ingredient/{line_id}/delete")
+
+
+SCENARIOS = {
+    'formula': VirtualUser.formula,
+    'lines': VirtualUser.lines,
+    'search': VirtualUser.search,
+    'formulas': VirtualUser.formulas,
+}
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Escenario desconocido: {name} (disponibles: {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _worker(number: int, options, mix: dict, stats: RouteStats, stop: threading.Event, failures: list):
+    rng = random.Random(f"{options.seed}:{number}")
+    user = VirtualUser(options.url, dataset.username(options.prefix, number % options.users),
+                       stats, rng, options.timeout)
+    try:
+        if not user.login():
+            failures.append(user.username)
+            return
+        names, weights = list(mix), list(mix.values())
+        while not stop.is_set():
+            SCENARIOS[rng.choices(names, weights=weights)[0]](user)
+            if options.think_ms:
+                stop.wait(rng.uniform(0, options.think_ms) / 1000.0)
+    finally:
+        user.close()
+
+
+def run(options) -> dict:
+    mix = parse_mix(options.mix)
+    started = time.perf_counter()
+    stats = RouteStats(warmup_until=started + options.warmup)
+    stop = threading.Event()
+    failures = []
+    threads = []
+    for number in range(options.concurrency):
+        thread = threading.Thread(target=_worker, args=(number, options, mix, stats, stop, failures),
+                                  name=f"vu-{number}", daemon=True)
+        thread.start()
+        threads.append(thread)
+        if options.ramp_up:
+            time.sleep(options.ramp_up / options.concurrency)
+
+    stop.wait(max(0.0, started + options.warmup + options.duration - time.perf_counter()))
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=options.timeout + 5)
+    measured = time.perf_counter() - (started + options.warmup)
+    results = stats.summary(measured)
+    return {'results': results, 'seconds': round(measured, 1), 'login_failures': failures}
+
+
+def print_summary(results: dict, seconds: float):
+    print(f"\n{'ruta':<42} {'peticiones':>10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errores':>8}")
+    total = errors = 0
+    for route, row in results.items():
+        total += row['requests']
+        errors += row['errors']
+        print(f"{route:<42} {row['requests']:>10} {row['throughput_rps']:>8.1f} {row['p50_ms']:>8.1f} "
+              f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['error_rate']:>7.1%}")
+    if total:
+        print(f"\nTotal: {total} peticiones en {seconds} s ({total / seconds:.1f} req/s), "
+              f"errores {errors / total:.1%}")
+
+
+def _spawn(options, env: dict) -> subprocess.Popen:
+    """Arranca gunicorn con la aplicación y espera a que responda."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', options.bind,
+               '--workers', str(options.workers), '--threads', str(options.threads),
+               '--access-logfile', '-' if options.access_log else '/dev/null']
+    process = subprocess.Popen(command, cwd=root, env={**os.environ, **env})
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn terminó con código {process.returncode}")
+        try:
+            httpx.get(f"{options.url}/login", timeout=2)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("gunicorn no respondió en 60 s")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest',
+                                     description="Prueba de carga HTTP con usuarios sintéticos.")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', '-c', type=int, default=16, help="Usuarios virtuales simultáneos")
+    parser.add_argument('--duration', '-d', type=float, default=30, help="Segundos medidos")
+    parser.add_argument('--warmup', type=float, default=5, help="Segundos iniciales que no se miden")
+    parser.add_argument('--ramp-up', type=float, default=0, help="Segundos para arrancar todos los usuarios")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Pesos de los escenarios (por defecto {DEFAULT_MIX})")
+    parser.add_argument('--think-ms', type=float, default=0, help="Pausa máxima aleatoria entre escenarios")
+    parser.add_argument('--users', type=int, default=1000, help="Usuarios sintéticos disponibles")
+    parser.add_argument('--prefix', default=dataset.DEFAULT_PREFIX)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', '-o', help="Archivo de resultados (por defecto benchmarks/results/load-<fecha>.json)")
+
+    spawn = parser.add_argument_group('servidor (--spawn)')
+    spawn.add_argument('--spawn', action='store_true', help="Arranca gunicorn con stubs de OpenAI/Stripe")
+    spawn.add_argument('--bind', default='127.0.0.1:8000')
+    spawn.add_argument('--workers', type=int, default=2)
+    spawn.add_argument('--threads', type=int, default=4)
+    spawn.add_argument('--access-log', action='store_true')
+    options = parser.parse_args()
+
+    server = stub_server = None
+    meta = {'url': options.url, 'concurrency': options.concurrency, 'mix': options.mix,
+            'duration': options.duration, 'think_ms': options.think_ms}
+    try:
+        if options.spawn:
+            if not os.getenv('DATABASE_URL'):
+                print("Defina DATABASE_URL para arrancar la aplicación.")
+                return 2
+            options.url = f"http://{options.bind}"
+            stub_server = stubs.serve()
+            env = stubs.env_for(f"http://127.0.0.1:{stub_server.server_port}")
+            server = _spawn(options, env)
+            meta.update(url=options.url, workers=options.workers, threads=options.threads,
+                        database_backend='sqlite' if os.environ['DATABASE_URL'].startswith('sqlite') else 'postgres')
+
+        print(f"{options.concurrency} usuarios virtuales contra {options.url} durante "
+              f"{options.warmup:g}+{options.duration:g} s ({options.mix})")
+        outcome = run(options)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if stub_server is not None:
+            stub_server.shutdown()
+
+    if outcome['login_failures']:
+        print(f"Fallaron {len(outcome['login_failures'])} inicios de sesión "
+              f"(¿se cargaron los usuarios con python -m benchmarks.dataset?): {outcome['login_failures'][:3]}")
+    print_summary(outcome['results'], outcome['seconds'])
+
+    data = harness.report(outcome['results'], {**meta, 'seconds': outcome['seconds'],
+                                               'login_failures': len(outcome['login_failures'])})
+    output = options.output or os.path.join(
+        RESULTS_DIR, f"load-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    harness.save(data, output)
+    print(f"\nResultados guardados en {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
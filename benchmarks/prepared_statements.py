@@ -0,0 +1,122 @@
+# benchmarks/prepared_statements.py
+"""
+Microbenchmark de las sentencias preparadas de database.py (solo PostgreSQL).
+
+Para cada sentencia registrada en database.PREPARED_STATEMENTS compara, en la
+misma conexión, la consulta normal con su EXECUTE por nombre:
+  - tiempo de cliente por llamada (ida y vuelta completa);
+  - "Planning Time" del servidor según EXPLAIN (ANALYZE).
+Al final suma el ahorro de planificación de una petición típica de detalle
+de fórmula (usuario + fórmula + líneas + sub-fórmulas).
+
+Uso: DATABASE_URL=... python benchmarks/prepared_statements.py [--iterations 500]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+# Sentencias que ejecuta GET /formula/<id> (más la carga del usuario por Flask-Login)
+FORMULA_REQUEST = ('get_user_by_id', 'formula_by_id', 'formula_ingredient_lines', 'formula_sub_formula_lines')
+
+
+def _sample_params(cursor) -> dict:
+    """Parámetros reales para cada sentencia (la primera fórmula con líneas, o ids inexistentes)."""
+    cursor.execute("""
+        SELECT f.id, f.user_id, fi.id FROM formulas f
+        LEFT JOIN formula_ingredients fi ON fi.formula_id = f.id
+        ORDER BY fi.id IS NULL, f.id LIMIT 1
+    """)
+    row = cursor.fetchone() or (0, 0, 0)
+    formula_id, user_id, line_id = row[0], row[1], row[2] or 0
+    return {
+        'get_user_by_id': (user_id,),
+        'formula_by_id': (formula_id, user_id),
+        'formula_ingredient_lines': (formula_id, user_id),
+        'formula_sub_formula_lines': (formula_id, user_id),
+        'formula_id_for_ingredient': (line_id,),
+        'search_user_ingredient_names': ('%sal%', user_id),
+        'search_base_ingredient_names': ('%sal%',),
+    }
+
+
+def _planning_ms(cursor, sql: str, params: tuple) -> float:
+    cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", params)
+    plan = cursor.fetchone()[0]
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return plan[0]['Planning Time']
+
+
+def _per_call_ms(call, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call()
+    return (time.perf_counter() - started) * 1000 / iterations
+
+
+def run(iterations: int = 500) -> dict:
+    """Devuelve {sentencia: {'plain_ms', 'prepared_ms', 'plain_planning_ms', 'prepared_planning_ms'}}."""
+    if database.DB_BACKEND != 'postgres':
+        raise SystemExit("Este benchmark necesita una DATABASE_URL de PostgreSQL.")
+    registry = database.PREPARED_STATEMENTS
+    results = {}
+    conn = database.get_db_connection()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            params = _sample_params(cursor)
+            for name in registry.names():
+                sql, args = registry.sql(name), params[name]
+
+                def plain():
+                    cursor.execute(sql, args)
+                    cursor.fetchall()
+
+                def prepared():
+                    registry.execute(cursor, name, args)
+                    cursor.fetchall()
+
+                for _ in range(10):  # Calienta la caché y deja que el servidor fije el plan genérico
+                    plain()
+                    prepared()
+                placeholders = ', '.join(['%s'] * len(args))
+                results[name] = {
+                    'plain_ms': _per_call_ms(plain, iterations),
+                    'prepared_ms': _per_call_ms(prepared, iterations),
+                    'plain_planning_ms': _planning_ms(cursor, sql, args),
+                    'prepared_planning_ms': _planning_ms(cursor, f"EXECUTE {name} ({placeholders})", args),
+                }
+    finally:
+        conn.autocommit = False
+        database.release_db_connection(conn)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--json', action='store_true', help="Imprime los resultados en JSON")
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'sentencia':32} {'normal ms':>10} {'preparada ms':>13} {'plan normal':>12} {'plan prep.':>11}")
+    for name, r in results.items():
+        print(f"{name:32} {r['plain_ms']:10.3f} {r['prepared_ms']:13.3f} "
+              f"{r['plain_planning_ms']:12.3f} {r['prepared_planning_ms']:11.3f}")
+    saved = sum(results[n]['plain_planning_ms'] - results[n]['prepared_planning_ms'] for n in FORMULA_REQUEST)
+    client = sum(results[n]['plain_ms'] - results[n]['prepared_ms'] for n in FORMULA_REQUEST)
+    print(f"\nPetición de detalle de fórmula ({len(FORMULA_REQUEST)} sentencias): "
+          f"{saved:.3f} ms de planificación ahorrados en el servidor, {client:.3f} ms medidos en el cliente.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# benchmarks/stubs.py
+"""
+Servidor HTTP local que sustituye a OpenAI y Stripe en las pruebas de carga.
+
+Responde con datos fijos (y una latencia configurable) a las llamadas que hace
+la aplicación, para que no salgan peticiones a servicios reales ni se
+consuman créditos. La aplicación lo usa con:
+
+  OPENAI_BASE_URL=http://127.0.0.1:<puerto>/v1   OPENAI_API_KEY=sk-stub
+  STRIPE_API_BASE=http://127.0.0.1:<puerto>      STRIPE_SECRET_KEY=sk_test_stub
+
+  python -m benchmarks.stubs --port 8099
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_MS = float(os.getenv('STUB_LATENCY_MS', '200'))
+
+
+def env_for(url: str) -> dict:
+    """Variables de entorno que apuntan la aplicación a los stubs de 'url'."""
+    return {
+        'OPENAI_BASE_URL': f"{url}/v1",
+        'OPENAI_API_KEY': 'sk-stub',
+        'STRIPE_API_BASE': url,
+        'STRIPE_SECRET_KEY': 'sk_test_stub',
+    }
+
+
+def _chat_completion(body: dict) -> dict:
+    return {
+        'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'stub'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': "**Respuesta de prueba.** La fórmula está balanceada."},
+            'finish_reason': 'stop',
+        }],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+    }
+
+
+def _checkout_session() -> dict:
+    session_id = f"cs_test_{uuid.uuid4().hex[:24]}"
+    return {'id': session_id, 'object': 'checkout.session', 'url': f"https://checkout.invalid/{session_id}"}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency_ms = LATENCY_MS
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        if self.path.endswith('/chat/completions'):
+            return self._reply(200, _chat_completion(json.loads(raw or b'{}')))
+        if self.path.startswith('/v1/checkout/sessions'):
+            return self._reply(200, _checkout_session())
+        return self._reply(404, {'error': {'message': f"Ruta sin stub: {self.path}"}})
+
+
+def serve(port: int = 0, latency_ms: float = LATENCY_MS) -> ThreadingHTTPServer:
+    """Arranca el servidor en un hilo; port=0 elige un puerto libre (server.server_port)."""
+    handler = type('Handler', (StubHandler,), {'latency_ms': latency_ms})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stubs', daemon=True).start()
+    return server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.stubs', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=LATENCY_MS)
+    args = parser.parse_args()
+    server = serve(args.port, args.latency_ms)
+    url = f"http://127.0.0.1:{server.server_port}"
+    print(f"Stubs de OpenAI/Stripe en {url}")
+    for name, value in env_for(url).items():
+        print(f"  export {name}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+# cache.py
+"""
+Capa de caché compartida por database.py y app.py.
+
+Backends (según CACHE_URL):
+  - memory://         (por defecto) caché en el proceso, con TTL y tamaño máximo.
+  - redis://host:port/db  caché compartida entre workers de gunicorn (Redis o
+    cualquier servidor compatible: KeyDB, Valkey, Dragonfly...). Es el único
+    backend compartido; para un solo servidor basta un Redis local.
+
+Con memory:// la invalidación solo llega al worker que hizo la escritura: lo
+que la aplicación modifica (bibliografía, detalles de fórmula) solo se cachea
+con un backend compartido (is_shared()).
+
+Cada espacio de nombres tiene un número de versión; invalidar un espacio solo
+incrementa su versión, así que todos los workers dejan de ver las claves viejas
+a la vez y estas expiran solas por TTL.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TTL = int(os.getenv('CACHE_TTL', '3600'))
+
+
+def _json_default(value):
+    """Registros de records.py (y cualquier objeto con to_dict) como dicts; el resto como texto."""
+    to_dict = getattr(value, 'to_dict', None)
+    return to_dict() if callable(to_dict) else str(value)
+
+
+class CacheStats:
+    """Contadores de aciertos/fallos por espacio de nombres."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def record(self, namespace: str, hit: bool):
+        with self._lock:
+            counter = self.hits if hit else self.misses
+            counter[namespace] = counter.get(namespace, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            namespaces = set(self.hits) | set(self.misses)
+            return {
+                ns: {'hits': self.hits.get(ns, 0), 'misses': self.misses.get(ns, 0)}
+                for ns in sorted(namespaces)
+            }
+
+
+class InProcessCache:
+    """Caché LRU en memoria del proceso. No se comparte entre workers."""
+
+    name = 'memory'
+    shared = False
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+
+    def _key(self, namespace: str, key: str) -> tuple:
+        return (namespace, self._versions.get(namespace, 0), key)
+
+    def get(self, namespace: str, key: str):
+        now = time.monotonic()
+        with self._lock:
+            full_key = self._key(namespace, key)
+            item = self._data.get(full_key)
+            if item is not None and item[0] > now:
+                self._data.move_to_end(full_key)
+                self.stats.record(namespace, True)
+                return item[1]
+            if item is not None:
+                del self._data[full_key]
+        self.stats.record(namespace, False)
+        return None
+
+    def set(self, namespace: str, key: str, value, ttl: int | None = None):
+        expires = time.monotonic() + (ttl or DEFAULT_TTL)
+        with self._lock:
+            full_key = self._key(namespace, key)
+            self._data[full_key] = (expires, value)
+            self._data.move_to_end(full_key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._data.pop(self._key(namespace, key), None)
+
+    def version(self, namespace: str) -> int:
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    def invalidate_namespace(self, namespace: str):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            stale = [k for k in self._data if k[0] == namespace]
+            for k in stale:
+                del self._data[k]
+
+
+class RedisCache:
+    """Caché compartida en un servidor compatible con Redis. Valores serializados en JSON."""
+
+    name = 'redis'
+    shared = True
+
+    def __init__(self, url: str, prefix: str = 'formulador'):
+        import redis  # Dependencia opcional: solo si CACHE_URL apunta a Redis
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    def _version(self, namespace: str) -> int:
+        return int(self._client.get(f"{self.prefix}:v:{namespace}") or 0)
+
+    def version(self, namespace: str) -> int | None:
+        try:
+            return self._version(namespace)
+        except Exception as e:
+            log.warning(f"Caché Redis no disponible (version {namespace}): {e}")
+            return None
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{self._version(namespace)}:{key}"
+
+    def get(self, namespace: str, key: str):
+        try:
+            raw = self._client.get(self._key(namespace, key))
+        except Exception as e:
+            log.warning(f"Caché Redis no disponible (get {namespace}): {e}")
+            raw = None
+        self.stats.record(namespace, raw is not None)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, namespace: str, key: str, value, ttl: int | None = None):
+        try:
+            self._client.set(self._key(namespace, key), json.dumps(value, default=_json_default), ex=ttl or DEFAULT_TTL)
+        except Exception as e:
+            log.warning(f"Caché Redis no disponible (set {namespace}): {e}")
+
+    def delete(self, namespace: str, key: str):
+        try:
+            self._client.delete(self._key(namespace, key))
+        except Exception as e:
+            log.warning(f"Caché Redis no disponible (delete {namespace}): {e}")
+
+    def invalidate_namespace(self, namespace: str):
+        try:
+            self._client.incr(f"{self.prefix}:v:{namespace}")
+        except Exception as e:
+            log.error(f"No se pudo invalidar el espacio de caché '{namespace}': {e}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Devuelve el backend configurado en CACHE_URL (se crea en el primer uso)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = _create_backend(os.getenv('CACHE_URL', 'memory://'))
+    return _cache
+
+
+def _create_backend(url: str):
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            backend = RedisCache(url)
+            log.info("Caché compartida Redis configurada.")
+            return backend
+        except Exception as e:
+            log.error(f"No se pudo configurar la caché Redis ({e}). Usando caché en memoria.")
+    return InProcessCache(int(os.getenv('CACHE_MAX_ENTRIES', '10000')))
+
+
+def _is_empty(value) -> bool:
+    """None, [], {} o una página sin elementos ({'items': [], ...})."""
+    if isinstance(value, dict) and 'items' in value:
+        return not value['items']
+    return not value
+
+
+def cached(namespace: str, key_func=None, ttl: int | None = None, shared_only: bool = False):
+    """
+    Decorador que cachea el resultado de la función en 'namespace'.
+    Los resultados vacíos (None, [], {} o una página con 'items' vacío) no se
+    guardan: en database.py suelen indicar un error.
+    Con shared_only=True solo se cachea si el backend es compartido (datos que la
+    aplicación modifica y que otros workers no deben seguir sirviendo tras invalidar).
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            backend = get_cache()
+            if shared_only and not backend.shared:
+                return f(*args, **kwargs)
+            key = key_func(*args, **kwargs) if key_func else json.dumps([args, kwargs], sort_keys=True, default=str)
+            value = backend.get(namespace, key)
+            if value is not None:
+                return value
+            value = f(*args, **kwargs)
+            if not _is_empty(value):
+                backend.set(namespace, key, value, ttl)
+            return value
+        return wrapper
+    return decorator
+
+
+def is_shared() -> bool:
+    """
+    True si el backend se comparte entre workers, de modo que invalidate() llega a
+    todos. Los datos que cambian con cada edición del usuario solo deben cachearse así.
+    """
+    return get_cache().shared
+
+
+def version(namespace: str) -> int | None:
+    """
+    Versión actual del espacio de nombres (None si el backend no responde).
+    Sirve para validar objetos que cada proceso guarda por su cuenta: si la
+    versión cambió desde que se construyeron, otro worker invalidó el espacio.
+    """
+    return get_cache().version(namespace)
+
+
+def invalidate(namespace: str, key: str | None = None):
+    """Invalida una clave o todo el espacio de nombres (en todos los workers si es compartida)."""
+    if key is None:
+        get_cache().invalidate_namespace(namespace)
+    else:
+        get_cache().delete(namespace, key)
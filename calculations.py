@@ -1,6 +1,18 @@
 # core/calculations.py
 import math
 
+import tracing
+from records import FormulaTotals, ProcessedLine
+
+CATEGORY_ORDER = {
+    "Cárnico": 1,
+    "Agua/Hielo": 2,
+    "Retenedor/No Cárnico": 3,
+    "Condimento/Aditivo": 4,
+    "Colorante": 5
+}
+DEFAULT_CATEGORY = "Retenedor/No Cárnico"
+
 def convert_to_kg(quantity, unit):
     """Convierte cantidad a Kg basado en la unidad."""
     kg_total = 0.0
@@ -10,67 +22,59 @@ def convert_to_kg(quantity, unit):
     else: kg_total = quantity
     return kg_total
 
-def process_ingredients_for_display(ingredients_data: list[dict]) -> list[dict]:
+@tracing.traced('calc.process_ingredients')
+def process_ingredients_for_display(ingredients_data: list[dict]) -> list[ProcessedLine]:
     """
     Procesa y ORDENA los ingredientes usando la columna 'categoria' de la base de datos.
+    Acepta líneas FormulaLine o dicts con los mismos campos.
     """
     processed_data = []
     if not ingredients_data: return processed_data
 
     # First, calculate the total weight to be able to calculate percentages
-    total_kg = sum(convert_to_kg(ing.get('quantity', 0), ing.get('unit', '')) for ing in ingredients_data)
+    line_kg = [convert_to_kg(ing.get('quantity', 0), ing.get('unit', '')) for ing in ingredients_data]
+    total_kg = sum(line_kg)
 
-    CATEGORY_ORDER = {
-        "Cárnico": 1,
-        "Agua/Hielo": 2,
-        "Retenedor/No Cárnico": 3,
-        "Condimento/Aditivo": 4,
-        "Colorante": 5
-    }
-    
-    for ing in ingredients_data:
-        kg_total = convert_to_kg(ing.get('quantity', 0), ing.get('unit', ''))
+    for ing, kg_total in zip(ingredients_data, line_kg):
         percentage = (kg_total / total_kg * 100.0) if total_kg > 0 else 0
         precio_por_kg = ing.get('precio_por_kg', 0) or 0
-        categoria = ing.get('categoria', 'Retenedor/No Cárnico')
-        
-        processed_data.append({            
-            'formula_ingredient_id': ing.get('formula_ingredient_id', -1),
-            'ingredient_name': ing.get('ingredient_name', 'ErrorNombre'),
-            'original_qty_display': f"{ing.get('quantity', 0):.2f}",
-            'original_unit': ing.get('unit', ''),
-            'kg_total': kg_total,
-            'percentage': percentage, # Add the percentage here
-            'kg_protein': kg_total * ((ing.get('protein_percent', 0) or 0) / 100.0),
-            'kg_fat': kg_total * ((ing.get('fat_percent', 0) or 0) / 100.0),
-            'kg_water': kg_total * ((ing.get('water_percent', 0) or 0) / 100.0),
-            'water_retention_factor': ing.get('water_retention_factor', 0) or 0,
-            'costo_linea': kg_total * precio_por_kg,
-            'sort_order': CATEGORY_ORDER.get(categoria, 3)
-        })
-        
-    processed_data.sort(key=lambda x: (x['sort_order'], -x['kg_total']))
+        categoria = ing.get('categoria', DEFAULT_CATEGORY)
+
+        processed_data.append(ProcessedLine(
+            formula_ingredient_id=ing.get('formula_ingredient_id', -1),
+            sub_formula_id=ing.get('sub_formula_id'),
+            ingredient_name=ing.get('ingredient_name', 'ErrorNombre'),
+            original_qty_display=f"{ing.get('quantity', 0):.2f}",
+            original_unit=ing.get('unit', ''),
+            kg_total=kg_total,
+            percentage=percentage,
+            kg_protein=kg_total * ((ing.get('protein_percent', 0) or 0) / 100.0),
+            kg_fat=kg_total * ((ing.get('fat_percent', 0) or 0) / 100.0),
+            kg_water=kg_total * ((ing.get('water_percent', 0) or 0) / 100.0),
+            water_retention_factor=ing.get('water_retention_factor', 0) or 0,
+            costo_linea=kg_total * precio_por_kg,
+            sort_order=CATEGORY_ORDER.get(categoria, 3),
+        ))
+
+    processed_data.sort(key=lambda x: (x.sort_order, -x.kg_total))
 
     return processed_data
 
-def calculate_formula_totals(processed_ingredients: list[dict]) -> dict:
+@tracing.traced('calc.formula_totals')
+def calculate_formula_totals(processed_ingredients: list[ProcessedLine]) -> FormulaTotals:
     """
     Calcula todos los totales de la fórmula con la lógica de humedad corregida.
     """
     if not processed_ingredients:
-        return {
-            'total_kg': 0, 'protein_perc': 0, 'fat_perc': 0, 'water_perc': 0,
-            'costo_total': 0, 'costo_por_kg': 0,
-            'aw_fp_ratio_str': 'N/A', 'af_fp_ratio_str': 'N/A'
-        }
+        return FormulaTotals()
 
     # --- CÁLCULO DE TOTALES EN KG ---
-    total_kg = sum(item.get('kg_total', 0) for item in processed_ingredients)
-    total_protein_kg = sum(item.get('kg_protein', 0) for item in processed_ingredients)
-    total_fat_kg = sum(item.get('kg_fat', 0) for item in processed_ingredients)
-    total_water_kg = sum(item.get('kg_water', 0) for item in processed_ingredients) # Esta es el agua total REAL
-    total_retained_water_kg = sum(item.get('kg_total', 0) * item.get('water_retention_factor', 0) for item in processed_ingredients)
-    costo_total = sum(item.get('costo_linea', 0) for item in processed_ingredients)
+    total_kg = sum(item.kg_total for item in processed_ingredients)
+    total_protein_kg = sum(item.kg_protein for item in processed_ingredients)
+    total_fat_kg = sum(item.kg_fat for item in processed_ingredients)
+    total_water_kg = sum(item.kg_water for item in processed_ingredients) # Esta es el agua total REAL
+    total_retained_water_kg = sum(item.kg_total * item.water_retention_factor for item in processed_ingredients)
+    costo_total = sum(item.costo_linea for item in processed_ingredients)
     
     # --- CÁLCULO DE VALORES FINALES ---
     costo_por_kg = costo_total / total_kg if total_kg > 0 else 0
@@ -87,17 +91,43 @@ def calculate_formula_totals(processed_ingredients: list[dict]) -> dict:
     aw_fp_ratio_str = f"{aw_fp_ratio:.2f}" if not math.isinf(aw_fp_ratio) else "N/A"
     af_fp_ratio_str = f"{af_fp_ratio:.2f}" if not math.isinf(af_fp_ratio) else "N/A"
 
-    return {
-        'total_kg': total_kg,
-        'total_protein_kg': total_protein_kg,
-        'total_fat_kg': total_fat_kg,
-        'total_water_kg': total_water_kg,
-        'total_retained_water_kg': total_retained_water_kg, # Lo mantenemos como dato informativo
-        'protein_perc': protein_perc,
-        'fat_perc': fat_perc,
-        'water_perc': water_perc, # Porcentaje de humedad corregido
-        'costo_total': costo_total,
-        'costo_por_kg': costo_por_kg,
-        'aw_fp_ratio_str': aw_fp_ratio_str,
-        'af_fp_ratio_str': af_fp_ratio_str
-    }
\ No newline at end of file
+    return FormulaTotals(
+        total_kg=total_kg,
+        total_protein_kg=total_protein_kg,
+        total_fat_kg=total_fat_kg,
+        total_water_kg=total_water_kg,
+        total_retained_water_kg=total_retained_water_kg, # Lo mantenemos como dato informativo
+        protein_perc=protein_perc,
+        fat_perc=fat_perc,
+        water_perc=water_perc, # Porcentaje de humedad corregido
+        costo_total=costo_total,
+        costo_por_kg=costo_por_kg,
+        aw_fp_ratio_str=aw_fp_ratio_str,
+        af_fp_ratio_str=af_fp_ratio_str,
+    )
+
+COST_SUMMARY_KEYS = ('total_kg', 'costo_total', 'costo_por_kg', 'protein_perc', 'fat_perc', 'water_perc')
+
+def apply_ingredient_overrides(ingredients_data: list[dict], overrides: dict[int, dict]) -> list[dict]:
+    """
+    Devuelve una copia de las líneas de la fórmula con los campos de los
+    ingredientes sustituidos por 'overrides' ({ingredient_id: {campo: valor}}).
+    """
+    if not overrides:
+        return ingredients_data
+    return [
+        {**ing, **overrides[ing.get('ingredient_id')]} if ing.get('ingredient_id') in overrides else ing
+        for ing in ingredients_data
+    ]
+
+def recost_formulas(lines_by_formula: dict[int, list[dict]], overrides: dict[int, dict] | None = None) -> dict[int, dict]:
+    """
+    Recalcula los totales de varias fórmulas en una pasada, opcionalmente
+    aplicando cambios propuestos a ingredientes. Devuelve {formula_id: totales}.
+    """
+    results = {}
+    for formula_id, ingredients_data in lines_by_formula.items():
+        lines = apply_ingredient_overrides(ingredients_data, overrides or {})
+        totals = calculate_formula_totals(process_ingredients_for_display(lines))
+        results[formula_id] = {key: totals.get(key, 0) for key in COST_SUMMARY_KEYS}
+    return results
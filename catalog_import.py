@@ -0,0 +1,128 @@
+# catalog_import.py
+"""
+Lectura de listas de precios/especificaciones de proveedores (CSV, XLSX o JSON)
+para la actualización masiva del catálogo de ingredientes del usuario.
+Solo se interpretan y validan las filas; el cruce con el catálogo lo hace
+database.bulk_update_user_ingredients en una sola sentencia.
+"""
+import csv
+import io
+import unicodedata
+
+# Campos que se pueden actualizar desde una lista (además de 'name', que identifica la fila)
+NUMERIC_FIELDS = (
+    'precio_por_kg', 'protein_percent', 'fat_percent', 'water_percent',
+    'water_retention_factor', 'min_usage_percent', 'max_usage_percent',
+)
+TEXT_FIELDS = ('categoria',)
+UPDATE_FIELDS = NUMERIC_FIELDS + TEXT_FIELDS
+MAX_ROWS = 5000
+
+# Encabezados habituales en las listas de proveedores -> columna del catálogo
+HEADER_ALIASES = {
+    'nombre': 'name', 'ingrediente': 'name', 'producto': 'name',
+    'precio': 'precio_por_kg', 'precio kg': 'precio_por_kg', 'precio/kg': 'precio_por_kg',
+    'proteina': 'protein_percent', 'proteina %': 'protein_percent',
+    'grasa': 'fat_percent', 'grasa %': 'fat_percent',
+    'agua': 'water_percent', 'humedad': 'water_percent', 'agua %': 'water_percent',
+    'retencion': 'water_retention_factor', 'retencion agua': 'water_retention_factor',
+    'uso minimo': 'min_usage_percent', 'uso maximo': 'max_usage_percent',
+}
+
+
+def _normalize_header(header) -> str:
+    text = unicodedata.normalize('NFKD', str(header or '')).encode('ascii', 'ignore').decode()
+    text = ' '.join(text.strip().lower().replace('_', ' ').split())
+    if text.replace(' ', '_') in UPDATE_FIELDS + ('name',):
+        return text.replace(' ', '_')
+    return HEADER_ALIASES.get(text, text)
+
+
+def _parse_number(value) -> float | None:
+    """Acepta números, '2.45', '2,45', '1.234,5' y '1,234.5'. Vacío = sin cambio."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace('$', '').replace('%', '').strip()
+    if not text:
+        return None
+    if ',' in text and '.' in text:
+        # El separador que aparece último es el decimal
+        if text.rfind(',') > text.rfind('.'):
+            text = text.replace('.', '').replace(',', '.')
+        else:
+            text = text.replace(',', '')
+    elif ',' in text:
+        text = text.replace(',', '.')
+    return float(text)
+
+
+def _read_csv(content: bytes) -> list[dict]:
+    text = content.decode('utf-8-sig', errors='replace')
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return list(csv.DictReader(io.StringIO(text), dialect=dialect))
+
+
+def _read_xlsx(content: bytes) -> list[dict]:
+    import openpyxl  # Solo hace falta para listas en Excel
+    workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = next(rows, None) or ()
+        return [dict(zip(headers, row)) for row in rows if any(cell is not None for cell in row)]
+    finally:
+        workbook.close()
+
+
+def read_file(filename: str, content: bytes) -> list[dict]:
+    """Filas crudas de un archivo .csv, .txt o .xlsx. Lanza ValueError si el formato no se admite."""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('csv', 'txt'):
+        return _read_csv(content)
+    if extension in ('xlsx', 'xlsm'):
+        return _read_xlsx(content)
+    raise ValueError(f"Formato no admitido: '{filename}'. Use CSV, XLSX o JSON.")
+
+
+def normalize_rows(raw_rows: list[dict]) -> tuple[list[dict], list[dict]]:
+    """
+    Convierte las filas crudas en {'name', <campos a cambiar>}.
+    Devuelve (filas, errores); si un nombre se repite gana la última fila.
+    """
+    if len(raw_rows) > MAX_ROWS:
+        raise ValueError(f"La lista tiene {len(raw_rows)} filas; el máximo es {MAX_ROWS}.")
+
+    rows, errors = {}, []
+    for line_number, raw in enumerate(raw_rows, start=2):  # la fila 1 son los encabezados
+        if not isinstance(raw, dict):
+            errors.append({'row': line_number, 'error': 'Fila no válida.'})
+            continue
+        record = {_normalize_header(k): v for k, v in raw.items() if k is not None}
+        name = str(record.get('name') or '').strip()
+        if not name:
+            errors.append({'row': line_number, 'error': 'Falta el nombre del ingrediente.'})
+            continue
+
+        row = {'name': name}
+        try:
+            for field in NUMERIC_FIELDS:
+                value = _parse_number(record.get(field))
+                if value is not None:
+                    row[field] = value
+        except ValueError:
+            errors.append({'row': line_number, 'name': name, 'error': f"Valor numérico inválido en '{field}'."})
+            continue
+        for field in TEXT_FIELDS:
+            value = str(record.get(field) or '').strip()
+            if value:
+                row[field] = value
+
+        if len(row) == 1:
+            errors.append({'row': line_number, 'name': name, 'error': 'La fila no trae ningún campo a actualizar.'})
+            continue
+        rows[name.lower()] = row
+    return list(rows.values()), errors
@@ -0,0 +1,93 @@
+# compression.py
+"""
+Compresión de respuestas (brotli o gzip) según Accept-Encoding.
+
+Solo se comprimen los tipos de texto (JSON, HTML, CSS, JS, CSV, SVG) a
+partir de COMPRESS_MIN_SIZE bytes: por debajo, la cabecera y el coste de CPU
+no compensan. Brotli se usa si el módulo 'brotli' está instalado y el
+cliente lo acepta; si no, gzip.
+"""
+import gzip
+import os
+import threading
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Dependencia opcional: sin ella solo se ofrece gzip
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+# Calidad 4-5 es el punto habitual para contenido dinámico: casi la tasa de gzip -9 a la velocidad de gzip -6
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'text/html', 'text/plain',
+    'text/css', 'text/javascript', 'text/csv', 'image/svg+xml',
+}
+
+
+class CompressionStats:
+    """Respuestas comprimidas y bytes antes/después, por codificación."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def add(self, encoding: str, size_in: int, size_out: int):
+        with self._lock:
+            counts = self._counts.setdefault(encoding, {'responses': 0, 'bytes_in': 0, 'bytes_out': 0})
+            counts['responses'] += 1
+            counts['bytes_in'] += size_in
+            counts['bytes_out'] += size_out
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {encoding: dict(counts) for encoding, counts in self._counts.items()}
+
+
+stats = CompressionStats()
+
+
+def available_encodings() -> list[str]:
+    """Codificaciones que ofrece el servidor, por orden de preferencia."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def _compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or request.method == 'HEAD'
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    compressed = compress(data, encoding)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # El cuerpo ya no es byte a byte el original
+        response.set_etag(etag, weak=True)
+    stats.add(encoding, len(data), len(compressed))
+    return response
+
+
+def init_app(app):
+    """Registra la compresión; conviene llamarla antes que otros after_request para que se ejecute la última."""
+    app.after_request(_compress_response)
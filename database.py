@@ -5,13 +5,25 @@ import psycopg2.pool
 import datetime
 import decimal
 import logging 
-import time
 import atexit
+import threading
+import time
+import weakref
 import re
+import json
+import base64
 from functools import wraps
 from contextlib import contextmanager 
+from contextvars import ContextVar
 from werkzeug.security import generate_password_hash, check_password_hash
 
+import cache
+import metrics
+import records
+import resilience
+import sqlite_backend
+import tracing
+
 # --- Configuración de Logging ---
 logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -48,120 +60,400 @@ def convert_row_to_dict(row):
 # --- Configuración para PostgreSQL ---
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Con DATABASE_URL=sqlite:///ruta.db se usa una base SQLite embebida (ver sqlite_backend.py)
+DB_BACKEND = 'sqlite' if sqlite_backend.is_sqlite_url(DATABASE_URL) else 'postgres'
+
 # --- Forzar SSL para entornos de producción como Render ---
-if DATABASE_URL and 'sslmode' not in DATABASE_URL and 'localhost' not in DATABASE_URL:
+if DB_BACKEND == 'postgres' and DATABASE_URL and 'sslmode' not in DATABASE_URL and 'localhost' not in DATABASE_URL:
     DATABASE_URL += "?sslmode=require"
     log.info("Añadiendo '?sslmode=require' a la DATABASE_URL para conexión de producción.")
 
-log.info(f"Conectando a la URL de la base de datos: {DATABASE_URL[:30]}...") 
+# --- Réplica de lectura (opcional) ---
+# Las funciones marcadas con @read_only leen de READ_DATABASE_URL si está definida.
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+if READ_DATABASE_URL and 'sslmode' not in READ_DATABASE_URL and 'localhost' not in READ_DATABASE_URL:
+    READ_DATABASE_URL += "?sslmode=require"
 
 # --- CREACIÓN DEL POOL DE CONEXIONES ---
-try:
-    db_pool = psycopg2.pool.SimpleConnectionPool(
-        1,  # minconn
-        10, # maxconn
-        dsn=DATABASE_URL
-    )
-    log.info("Pool de conexiones de base de datos creado exitosamente.")
-except Exception as e:
-    log.error(f"FATAL: No se pudo crear el pool de conexiones. {e}")
-    db_pool = None
+# El pool se crea en la primera consulta de cada proceso, no al importar: con
+# 'gunicorn --preload' el proceso maestro importa la app y los workers nacen
+# por fork, y un socket abierto antes del fork acabaría compartido entre ellos.
+# Sin límite, un servidor que no responde bloquea la conexión hasta el timeout TCP del sistema
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '5'))
+# Pools heredados del proceso padre: se conservan sin usarlos ni cerrarlos, porque
+# al liberarlos libpq enviaría el cierre de sesión por sockets que aún usa el padre.
+_inherited_pools = []
+
+def _masked_url(url: str | None) -> str:
+    return re.sub(r'//[^@/]*@', '//***@', url or '(URL no definida)')
+
+class PoolExhausted(psycopg2.OperationalError):
+    """
+    Todas las conexiones del pool de este proceso están en uso. Es saturación
+    local, no un fallo de la base: se reintenta como contención y no cuenta
+    para el circuit breaker.
+    """
+
+class _ProcessPool:
+    """Pool de conexiones propio de cada proceso (se recrea tras un fork)."""
+
+    def __init__(self, name: str, dsn: str | None):
+        self.name = name
+        self.dsn = dsn
+        self.pool = None
+        self.pid = None
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        pid = os.getpid()
+        if self.pool is not None and self.pid == pid:
+            return
+        with self._lock:
+            if self.pool is not None and self.pid == pid:
+                return
+            if self.pool is not None:
+                log.info(f"Proceso {pid} creado por fork: se abre un pool '{self.name}' propio.")
+                _inherited_pools.append(self.pool)
+                self.pool = None
+            log.info(f"Creando pool '{self.name}' (pid {pid}) hacia {_masked_url(self.dsn)}")
+            try:
+                self.pool = psycopg2.pool.SimpleConnectionPool(
+                    1,  # minconn
+                    10, # maxconn
+                    dsn=self.dsn,
+                    connect_timeout=DB_CONNECT_TIMEOUT
+                )
+                self.pid = pid
+                log.info(f"Pool de conexiones '{self.name}' creado exitosamente.")
+            except Exception as e:
+                log.error(f"ERROR CRÍTICO: No se pudo crear el pool '{self.name}'. {e}")
+                raise psycopg2.OperationalError(f"No se pudo crear el pool '{self.name}': {e}")
+
+    def getconn(self):
+        self.ensure()
+        try:
+            conn = self.pool.getconn()
+            log.debug(f"Conexión obtenida del pool '{self.name}'.")
+            return conn
+        except psycopg2.pool.PoolError as e:
+            if 'exhausted' not in str(e):
+                raise psycopg2.OperationalError(f"No se pudo obtener conexión del pool: {e}")
+            log.warning(f"Pool '{self.name}' agotado ({self.pool.maxconn} conexiones en uso).")
+            raise PoolExhausted(f"Pool '{self.name}' agotado: {e}")
+        except Exception as e:
+            log.error(f"ERROR: No se pudo obtener conexión del pool '{self.name}'. {e}")
+            raise psycopg2.OperationalError(f"No se pudo obtener conexión del pool: {e}")
+
+    def putconn(self, conn):
+        if self.pool and conn:
+            log.debug(f"Devolviendo conexión al pool '{self.name}'.")
+            self.pool.putconn(conn, close=bool(conn.closed))
+
+    def stats(self) -> dict:
+        """Conexiones en uso, libres y máximo del pool de este proceso."""
+        pool = self.pool if self.pid == os.getpid() else None
+        if pool is None:
+            return {'in_use': 0, 'idle': 0, 'max': 10}
+        return {'in_use': len(pool._used), 'idle': len(pool._pool), 'max': pool.maxconn}
+
+    def close(self):
+        if self.pool and self.pid == os.getpid():
+            log.info(f"Cerrando el pool de conexiones '{self.name}'...")
+            self.pool.closeall()
+        elif self.pool:
+            _inherited_pools.append(self.pool)
+        self.pool = None
+
+def _sqlite_error(e: Exception) -> Exception:
+    """Traduce un error de sqlite3 a la excepción de psycopg2 que esperan las funciones del módulo."""
+    message = str(e)
+    if isinstance(e, sqlite_backend.sqlite3.IntegrityError):
+        return psycopg2.IntegrityError(message)
+    if 'locked' in message or 'busy' in message:
+        return psycopg2.extensions.TransactionRollbackError(message) # Se reintenta como contención
+    if 'duplicate column' in message:
+        return psycopg2.errors.DuplicateColumn(message)
+    if 'no such column' in message:
+        return psycopg2.errors.UndefinedColumn(message)
+    if 'no such table' in message:
+        return psycopg2.errors.UndefinedTable(message)
+    if 'pool exhausted' in message:
+        return PoolExhausted(message)
+    if 'unable to open' in message:
+        return psycopg2.OperationalError(message)
+    return psycopg2.ProgrammingError(message)
+
+if DB_BACKEND == 'sqlite':
+    primary_pool = sqlite_backend.SQLitePool(DATABASE_URL, maxconn=10, translate_error=_sqlite_error)
+    replica_pool = None
+else:
+    primary_pool = _ProcessPool('primary', DATABASE_URL)
+    replica_pool = _ProcessPool('replica', READ_DATABASE_URL) if READ_DATABASE_URL else None
+
+def pools() -> list:
+    """Pools configurados (primario y, si hay, réplica)."""
+    return [primary_pool] + ([replica_pool] if replica_pool is not None else [])
+
+def _execute_values(cursor, sql: str, rows: list, template: str | None = None):
+    """INSERT/UPDATE con 'VALUES %s' para varias filas en una sentencia, en ambos backends."""
+    if DB_BACKEND == 'sqlite':
+        cursor.execute_values(sql, rows, template=template)
+    else:
+        psycopg2.extras.execute_values(cursor, sql, rows, template=template)
 
 def get_db_connection():
     """
-    Obtiene una conexión del POOL.
+    Obtiene una conexión del POOL principal (creándolo en el primer uso del proceso).
     Lanza una excepción si el pool no está disponible.
     """
-    global db_pool
-    if db_pool is None:
-        log.error("El pool de conexiones no está inicializado. Intentando recrear...")
-        try:
-            db_pool = psycopg2.pool.SimpleConnectionPool(1, 10, dsn=DATABASE_URL)
-            log.info("Pool de conexiones recreado exitosamente.")
-        except Exception as e:
-            log.error(f"ERROR CRÍTICO: No se pudo recrear el pool de conexiones. {e}")
-            raise psycopg2.OperationalError(f"No se pudo recrear el pool: {e}")
-            
-    try:
-        conn = db_pool.getconn()
-        log.debug("Conexión obtenida del pool.")
-        return conn
-    except Exception as e:
-        log.error(f"ERROR: No se pudo obtener conexión del pool. {e}")
-        raise psycopg2.OperationalError(f"No se pudo obtener conexión del pool: {e}")
+    return primary_pool.getconn()
 
 
 def release_db_connection(conn):
     """
-    Devuelve una conexión al POOL.
+    Devuelve una conexión al POOL principal.
     """
-    global db_pool
-    if db_pool and conn:
-        log.debug("Devolviendo conexión al pool.")
-        db_pool.putconn(conn)
+    primary_pool.putconn(conn)
+
+# --- Enrutado de lecturas a la réplica ---
+# Ventana en la que un usuario que acaba de escribir lee del primario (la réplica va con retraso)
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+_read_intent = ContextVar('db_read_intent', default=False)
+_force_primary = ContextVar('db_force_primary', default=False)
+# Un fallo de la réplica la deja fuera unos segundos; mientras tanto se lee del primario
+REPLICA_BREAKER = resilience.register_breaker(resilience.CircuitBreaker(
+    'postgres_replica', failure_threshold=1, reset_timeout=float(os.getenv('DB_REPLICA_RETRY_AFTER', '10'))
+))
+
+def read_only(f):
+    """Marca una función que solo lee: puede servirse desde la réplica de lectura."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        token = _read_intent.set(True)
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _read_intent.reset(token)
+    return wrapper
+
+def use_primary_for_reads(value: bool = True):
+    """Fuerza (o deja de forzar) las lecturas de la petición actual al primario (read-your-writes)."""
+    _force_primary.set(value)
 
-# --- ¡NUEVO! DECORADOR DE REINTENTO ---
-def retry_on_connection_error(retries=3, delay=1):
+def _replica_for_this_call():
+    if replica_pool is None or not _read_intent.get() or _force_primary.get():
+        return None
+    if REPLICA_BREAKER.state == 'open':
+        return None
+    return replica_pool
+
+# --- POLÍTICA DE REINTENTOS (ver resilience.py) ---
+# Un único nivel de reintentos con presupuesto de tiempo: antes el decorador
+# y el gestor de contexto reintentaban cada uno 3 veces (hasta 9 intentos y
+# decenas de segundos con la base caída).
+DB_RETRY_POLICY = resilience.RetryPolicy(
+    attempts=int(os.getenv('DB_RETRY_ATTEMPTS', '3')),
+    base_delay=float(os.getenv('DB_RETRY_BASE_DELAY', '0.1')),
+    max_delay=float(os.getenv('DB_RETRY_MAX_DELAY', '1.0')),
+    max_elapsed=float(os.getenv('DB_RETRY_MAX_ELAPSED', '5.0')),
+)
+DB_BREAKER = resilience.register_breaker(resilience.CircuitBreaker(
+    'postgres',
+    failure_threshold=int(os.getenv('DB_BREAKER_THRESHOLD', '5')),
+    reset_timeout=float(os.getenv('DB_BREAKER_RESET', '15')),
+))
+
+class DatabaseUnavailable(Exception):
+    """La base de datos no respondió dentro de la política de reintentos (o el circuito está abierto)."""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# Errores que las funciones de este módulo NO deben tragarse: los gestiona retry_on_connection_error
+PASSTHROUGH_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, DatabaseUnavailable)
+
+def classify_db_error(e: Exception) -> str | None:
+    """TRANSIENT (conexión), CONTENTION (deadlock/serialización/pool agotado) o None (no reintentable)."""
+    if isinstance(e, psycopg2.errors.QueryCanceled):
+        return None # statement_timeout: reintentar solo repetiría la consulta lenta
+    if isinstance(e, (psycopg2.extensions.TransactionRollbackError, PoolExhausted)):
+        return resilience.CONTENTION
+    if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+        return resilience.TRANSIENT
+    return None
+
+def retry_on_connection_error(retries=None, delay=None):
     """
-    Decorador que reintenta una función si falla con un error de conexión.
-    Maneja errores operacionales (conexión caída) e interface (pool vacío).
+    Decorador que aplica DB_RETRY_POLICY: reintentos con jitter dentro del plazo
+    de la petición y circuit breaker. Si la base no responde lanza DatabaseUnavailable.
+    'retries'/'delay' permiten ajustar la política para una función concreta.
     """
+    policy = DB_RETRY_POLICY
+    if retries is not None or delay is not None:
+        policy = resilience.RetryPolicy(
+            attempts=retries if retries is not None else DB_RETRY_POLICY.attempts,
+            base_delay=delay if delay is not None else DB_RETRY_POLICY.base_delay,
+            max_delay=DB_RETRY_POLICY.max_delay,
+            max_elapsed=DB_RETRY_POLICY.max_elapsed,
+        )
+
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            for attempt in range(retries):
-                try:
-                    return f(*args, **kwargs)
-                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
-                    log.warning(f"Error de conexión/pool en {f.__name__} (intento {attempt + 1}/{retries}): {e}")
-                    if attempt + 1 == retries:
-                        log.error(f"Error de conexión final en {f.__name__} después de {retries} intentos.")
-                        raise # Re-lanza la última excepción
-                    # Espera exponencial (1s, 2s, 4s...)
-                    time.sleep(delay * (2 ** attempt))
+            try:
+                with metrics.db_call(f.__name__), tracing.span(f"db.{f.__name__}"):
+                    return resilience.call_with_retry(
+                        lambda: f(*args, **kwargs), 'postgres', policy, DB_BREAKER, classify_db_error
+                    )
+            except resilience.CircuitOpenError as e:
+                raise DatabaseUnavailable(str(e), retry_after=e.retry_after) from e
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if classify_db_error(e) is None:
+                    raise
+                if isinstance(e, PoolExhausted):
+                    log.warning(f"Sin conexiones libres tras reintentar {f.__name__}: {e}")
+                    raise DatabaseUnavailable(f"Servidor saturado: {e}", retry_after=1) from e
+                log.error(f"Error de conexión final en {f.__name__}: {e}")
+                raise DatabaseUnavailable(f"Base de datos no disponible: {e}") from e
         return wrapper
     return decorator
 
-# --- ¡NUEVO! GESTOR DE CONTEXTO CON REINTENTO ---
 @contextmanager
 def get_db_connection_context():
     """
     Gestor de contexto para obtener y liberar una conexión del pool.
-    Reintenta automáticamente si falla al *obtener* la conexión.
+    Dentro de una función @read_only usa la réplica si hay y está sana; si falla,
+    vuelve al primario. No reintenta: de eso se encarga retry_on_connection_error.
+    Las conexiones rotas se cierran en lugar de devolverse al pool.
     """
+    pool = _replica_for_this_call()
     conn = None
-    retries = 3
-    delay = 1
-    for attempt in range(retries):
+    wait_started = time.perf_counter()
+    with tracing.span('db.pool_wait') as wait_span:
+        if pool is not None:
+            try:
+                conn = pool.getconn()
+            except PoolExhausted:
+                # Réplica sana pero con todas las conexiones en uso: esta lectura va al primario
+                pool = None
+            except psycopg2.OperationalError as e:
+                log.warning(f"Réplica de lectura no disponible, se usa el primario: {e}")
+                REPLICA_BREAKER.record_failure()
+                pool = None
+        if conn is None:
+            pool = primary_pool
+            conn = pool.getconn()
+        if conn is None:
+            raise psycopg2.OperationalError("No se pudo obtener una conexión del pool (None).")
+        if wait_span is not None:
+            wait_span.attributes['db.pool'] = pool.name
+    metrics.observe_pool_wait(pool.name, time.perf_counter() - wait_started)
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        if pool is replica_pool and conn.closed:
+            # El reintento de retry_on_connection_error irá al primario
+            REPLICA_BREAKER.record_failure()
+        raise
+    finally:
+        pool.putconn(conn)
+
+# --- SENTENCIAS PREPARADAS ---
+# Las consultas más frecuentes se preparan (PREPARE) una vez por conexión del pool
+# y después se ejecutan por nombre (EXECUTE), sin volver a analizarlas ni a
+# planificarlas en cada petición. Con un pooler en modo transacción (pgbouncer)
+# las sentencias no sobreviven entre transacciones: DB_PREPARED_STATEMENTS=0.
+DB_PREPARED_STATEMENTS = os.getenv('DB_PREPARED_STATEMENTS', '1') != '0'
+
+class PreparedStatements:
+    """
+    Registro de sentencias con nombre. Recuerda qué sentencias están preparadas
+    en cada conexión (y en qué sesión del servidor): si la conexión se
+    restablece o el servidor las descarta, se vuelven a preparar.
+    En SQLite se ejecuta el SQL tal cual (sqlite3 ya cachea sus sentencias).
+    """
+
+    def __init__(self):
+        self._sql = {}
+        self._server_sql = {}
+        self._params = {}
+        # conexión -> (pid del backend, nombres preparados); las conexiones cerradas desaparecen solas
+        self._prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.prepares = 0
+        self.executions = 0
+
+    def register(self, name: str, sql: str) -> str:
+        """Registra 'sql' (con placeholders %s) bajo 'name' y devuelve el nombre."""
+        count = 0
+        def positional(match):
+            nonlocal count
+            if match.group(0) == '%%':
+                return '%'
+            count += 1
+            return f"${count}"
+        self._sql[name] = sql
+        self._server_sql[name] = re.sub(r"%s|%%", positional, sql)
+        self._params[name] = count
+        return name
+
+    def sql(self, name: str) -> str:
+        return self._sql[name]
+
+    def names(self) -> list[str]:
+        return list(self._sql)
+
+    def _prepared_on(self, conn) -> set:
+        backend_pid = conn.get_backend_pid()
+        with self._lock:
+            entry = self._prepared.get(conn)
+            if entry is None or entry[0] != backend_pid:
+                # Conexión nueva o restablecida: su sesión no tiene nada preparado
+                entry = (backend_pid, set())
+                self._prepared[conn] = entry
+            return entry[1]
+
+    def forget(self, conn):
+        with self._lock:
+            self._prepared.pop(conn, None)
+
+    def execute(self, cursor, name: str, params: tuple = ()):
+        """
+        Ejecuta la sentencia 'name' en el cursor (preparándola si hace falta).
+        Solo para lecturas: si el servidor ya no la tiene (o cambió el esquema de
+        una tabla que usa), se deshace la transacción en curso y se repite la
+        consulta tras preparar de nuevo las sentencias de la conexión.
+        """
+        if DB_BACKEND == 'sqlite' or not DB_PREPARED_STATEMENTS:
+            cursor.execute(self._sql[name], params)
+            return
         try:
-            conn = get_db_connection()
-            if conn is None:
-                raise psycopg2.OperationalError("No se pudo obtener una conexión del pool (None).")
-            
-            yield conn # Proporciona la conexión al bloque 'with'
-            
-            # Si salimos del 'yield' sin error, rompemos el bucle
-            break 
-            
-        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
-            log.warning(f"Error al obtener conexión del pool (intento {attempt + 1}/{retries}): {e}")
-            if conn:
-                # Si obtuvimos una conexión pero falló antes del yield
-                release_db_connection(conn)
-                conn = None # Para que no se libere en el finally
-            
-            if attempt + 1 == retries:
-                log.error(f"Error final al obtener conexión del pool después de {retries} intentos.")
-                raise # Re-lanza la última excepción
-            time.sleep(delay * (2 ** attempt)) # Espera exponencial
-        
-        except Exception as e:
-            log.error(f"Error inesperado en el gestor de contexto de la DB: {e}")
-            raise # Re-lanza la excepción
-        finally:
-            if conn:
-                # Esto se ejecuta si el 'yield' fue exitoso
-                release_db_connection(conn)
+            self._execute(cursor, name, params)
+        except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported) as e:
+            log.warning(f"Sentencia preparada '{name}' no válida en el servidor ({e.pgcode}); se prepara de nuevo.")
+            cursor.connection.rollback()
+            cursor.execute("DEALLOCATE ALL")
+            self.forget(cursor.connection)
+            self._execute(cursor, name, params)
+
+    def _execute(self, cursor, name: str, params: tuple):
+        prepared = self._prepared_on(cursor.connection)
+        if name not in prepared:
+            cursor.execute(f"PREPARE {name} AS {self._server_sql[name]}")
+            prepared.add(name)
+            self.prepares += 1
+        self.executions += 1
+        if self._params[name]:
+            cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * self._params[name])})", params)
+        else:
+            cursor.execute(f"EXECUTE {name}")
+
+    def snapshot(self) -> dict:
+        return {'enabled': DB_PREPARED_STATEMENTS and DB_BACKEND != 'sqlite',
+                'statements': len(self._sql), 'prepares': self.prepares, 'executions': self.executions}
+
+PREPARED_STATEMENTS = PreparedStatements()
 
 # --- ¡NUEVO! FUNCIONES DE MONITOREO Y CIERRE ---
 def check_pool_health():
@@ -179,12 +471,10 @@ def check_pool_health():
         return False
 
 def close_pool():
-    """Cierra todas las conexiones en el pool."""
-    global db_pool
-    if db_pool:
-        log.info("Cerrando el pool de conexiones de la base de datos...")
-        db_pool.closeall()
-        db_pool = None
+    """Cierra todas las conexiones en los pools."""
+    primary_pool.close()
+    if replica_pool is not None:
+        replica_pool.close()
 
 # ¡NUEVO! Registra la función de cierre para que se ejecute al salir de la app
 atexit.register(close_pool)
@@ -193,7 +483,15 @@ atexit.register(close_pool)
 # --- Inicialización de la Base de Datos ---
 # No aplicamos reintento a la inicialización, si esto falla, la app no debe iniciar.
 def initialize_database():
-    """Crea o actualiza las tablas necesarias en PostgreSQL."""
+    """Crea o actualiza las tablas necesarias en PostgreSQL (o aplica schema_sqlite.sql en SQLite)."""
+    if DB_BACKEND == 'sqlite':
+        try:
+            with get_db_connection_context() as conn:
+                sqlite_backend.initialize(conn)
+            log.info(f"Base de datos SQLite inicializada en {primary_pool.path}.")
+        except Exception as e:
+            log.error(f"ERROR: No se pudo inicializar la DB. {e}")
+        return
     try:
         with get_db_connection_context() as conn:
             with conn: # Gestor de transacción (commit/rollback)
@@ -232,6 +530,86 @@ def initialize_database():
                 except (psycopg2.errors.DuplicateObject, psycopg2.errors.DuplicateTable):
                     conn.rollback()
 
+                # Búsqueda de ingredientes por nombre sin distinguir mayúsculas (actualizaciones en bloque)
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_ingredients_user_lower_name ON user_ingredients (user_id, lower(name));')
+                conn.commit()
+
+                # Revisión de la fórmula: aumenta con cada cambio de líneas (control de
+                # concurrencia optimista de /api/formula/<id>/lines)
+                cursor.execute('ALTER TABLE formulas ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 0;')
+                conn.commit()
+
+                # Índices "where-used": de ingrediente a fórmulas y de fórmula a líneas
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_formula_ingredients_ingredient_id ON formula_ingredients (ingredient_id);')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_formula_ingredients_formula_id ON formula_ingredients (formula_id);')
+                conn.commit()
+
+                # Sin esta FK, delete_user_ingredient dejaba líneas huérfanas. Se crea
+                # NOT VALID (protege las filas nuevas sin recorrer la tabla) y se valida
+                # aparte solo si no quedan huérfanas de antes.
+                try:
+                    cursor.execute('ALTER TABLE formula_ingredients ADD CONSTRAINT formula_ingredients_ingredient_id_fkey '
+                                   'FOREIGN KEY (ingredient_id) REFERENCES user_ingredients(id) ON DELETE RESTRICT NOT VALID;')
+                    conn.commit()
+                except psycopg2.errors.DuplicateObject:
+                    conn.rollback()
+                cursor.execute("SELECT convalidated FROM pg_constraint WHERE conname = 'formula_ingredients_ingredient_id_fkey';")
+                row = cursor.fetchone()
+                if row and not row[0]:
+                    cursor.execute('''
+                        SELECT COUNT(*) FROM formula_ingredients fi
+                        WHERE fi.ingredient_id IS NOT NULL
+                          AND NOT EXISTS (SELECT 1 FROM user_ingredients ui WHERE ui.id = fi.ingredient_id);
+                    ''')
+                    orphans = cursor.fetchone()[0]
+                    if orphans:
+                        log.warning(f"formula_ingredients tiene {orphans} línea(s) con ingredient_id inexistente; "
+                                    "la FK formula_ingredients_ingredient_id_fkey queda sin validar (NOT VALID).")
+                    else:
+                        cursor.execute('ALTER TABLE formula_ingredients VALIDATE CONSTRAINT formula_ingredients_ingredient_id_fkey;')
+                conn.commit()
+
+                # Sub-fórmulas (premezclas, salmueras): una línea apunta a un
+                # ingrediente O a otra fórmula del usuario, nunca a ambos.
+                try:
+                    cursor.execute('ALTER TABLE formula_ingredients ADD COLUMN sub_formula_id INTEGER '
+                                   'REFERENCES formulas(id) ON DELETE RESTRICT;')
+                    conn.commit()
+                except psycopg2.errors.DuplicateColumn:
+                    conn.rollback()
+                cursor.execute('ALTER TABLE formula_ingredients ALTER COLUMN ingredient_id DROP NOT NULL;')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_formula_ingredients_sub_formula_id ON formula_ingredients (sub_formula_id);')
+                conn.commit()
+                try:
+                    cursor.execute('ALTER TABLE formula_ingredients ADD CONSTRAINT formula_ingredients_line_target_check '
+                                   'CHECK ((ingredient_id IS NULL) <> (sub_formula_id IS NULL));')
+                    conn.commit()
+                except psycopg2.errors.DuplicateObject:
+                    conn.rollback()
+
+                # Índice de búsqueda por composición: totales por fórmula y % por línea
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS formula_search_index (
+                        formula_id INTEGER PRIMARY KEY REFERENCES formulas(id) ON DELETE CASCADE,
+                        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                        total_kg REAL, protein_perc REAL, fat_perc REAL, water_perc REAL,
+                        costo_total REAL, costo_por_kg REAL, updated_at TIMESTAMP DEFAULT NOW()
+                    );
+                ''')
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS formula_line_search_index (
+                        formula_id INTEGER NOT NULL REFERENCES formulas(id) ON DELETE CASCADE,
+                        user_id INTEGER NOT NULL,
+                        ingredient_name TEXT NOT NULL,
+                        percentage REAL NOT NULL
+                    );
+                ''')
+                for column in SEARCH_INDEX_ATTRIBUTES:
+                    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_formula_search_{column} ON formula_search_index (user_id, {column});')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_formula_line_search_name ON formula_line_search_index (user_id, lower(ingredient_name), percentage);')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_formula_line_search_formula ON formula_line_search_index (formula_id);')
+                conn.commit()
+
                 cursor.close()
                 log.info("Base de datos PostgreSQL inicializada y actualizada para multi-usuario.")
             
@@ -261,6 +639,8 @@ def add_user(username: str, password: str, full_name: str) -> bool:
     except psycopg2.IntegrityError:
         log.warning(f"Error de integridad al añadir usuario {username}. Ya existe.")
         return None
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error inesperado en add_user: {e}")
         return None
@@ -275,20 +655,25 @@ def get_user_by_username(username: str) -> dict | None:
                 cursor.execute(sql, (username,))
                 user = cursor.fetchone()
                 return dict(user) if user else None
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en get_user_by_username: {e}")
         return None
 
+PREPARED_STATEMENTS.register('get_user_by_id', "SELECT * FROM users WHERE id = %s")
+
 @retry_on_connection_error()
 def get_user_by_id(user_id: int) -> dict | None:
     """Busca un usuario por su ID."""
-    sql = "SELECT * FROM users WHERE id = %s"
     try:
         with get_db_connection_context() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-                cursor.execute(sql, (user_id,))
+                PREPARED_STATEMENTS.execute(cursor, 'get_user_by_id', (user_id,))
                 user = cursor.fetchone()
                 return dict(user) if user else None
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en get_user_by_id: {e}")
         return None
@@ -302,6 +687,8 @@ def verify_user(username: str) -> bool:
                 with conn.cursor() as cursor:
                     cursor.execute(sql, (username,))
                     return cursor.rowcount > 0
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"ERROR al verificar usuario: {e}")
         return False
@@ -317,6 +704,8 @@ def get_user_credits(user_id: int) -> int:
                 cursor.execute(sql, (user_id,))
                 result = cursor.fetchone()
                 return result[0] if result and result[0] is not None else 0
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"ERROR obteniendo créditos: {e}")
         return 0
@@ -336,9 +725,14 @@ def add_user_credits(user_id: int, amount: int) -> bool:
                         "UPDATE users SET credits = %s, credits_expiry_date = %s WHERE id = %s",
                         (new_total_credits, new_expiry_date, user_id)
                     )
-                    return cursor.rowcount > 0
+                    added = cursor.rowcount > 0
+        metrics.credit_operation('add', added, amount)
+        return added
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"ERROR añadiendo créditos: {e}")
+        metrics.credit_operation('add', False)
         return False
 
 @retry_on_connection_error()
@@ -349,9 +743,14 @@ def decrement_user_credits(user_id: int, amount: int) -> bool:
             with conn: # Gestor de transacción
                 with conn.cursor() as cursor:
                     cursor.execute(sql, (amount, user_id, amount))
-                    return cursor.rowcount > 0
+                    decremented = cursor.rowcount > 0
+        metrics.credit_operation('decrement', decremented, amount)
+        return decremented
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"ERROR descontando créditos: {e}")
+        metrics.credit_operation('decrement', False)
         return False
 
 @retry_on_connection_error()
@@ -370,14 +769,18 @@ def check_and_handle_credit_expiration(user_id: int) -> int:
                     if ahora_utc > expiry_date:
                         log.info(f"Créditos expirados para el usuario {user_id}. Reseteando.")
                         cursor.execute("UPDATE users SET credits = 0, credits_expiry_date = NULL WHERE id = %s", (user_id,))
+                        metrics.credit_operation('expire', True, current_credits or 0)
                         return 0 
                     return current_credits if current_credits is not None else 0
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error manejando la expiración de créditos: {e}")
         return 0
 
 # --- Funciones para Fórmulas ---
 @retry_on_connection_error()
+@read_only
 def get_all_formulas(user_id: int) -> list[dict]:
     sql = "SELECT id, product_name, creation_date FROM formulas WHERE user_id = %s ORDER BY product_name"
     try:
@@ -386,35 +789,60 @@ def get_all_formulas(user_id: int) -> list[dict]:
                 cursor.execute(sql, (user_id,))
                 formulas = [dict(row) for row in cursor.fetchall()]
                 return formulas
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"ERROR obteniendo todas las fórmulas: {e}")
         return []
 
+# Columnas de una línea de ingrediente, en el orden de los campos de records.FormulaLine
+FORMULA_LINE_COLUMNS = """
+    fi.id AS formula_ingredient_id, fi.formula_id, fi.ingredient_id,
+    fi.quantity, fi.unit, i.name AS ingredient_name, i.protein_percent,
+    i.fat_percent, i.water_percent, i.ve_protein_percent, i.notes,
+    i.water_retention_factor, i.min_usage_percent, i.max_usage_percent,
+    i.precio_por_kg, i.categoria
+"""
+
+def _fetch_dicts(cursor) -> list[dict]:
+    """Filas de un cursor de tuplas como dicts (para filas con columnas variables)."""
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+PREPARED_STATEMENTS.register('formula_by_id', "SELECT * FROM formulas WHERE id = %s AND user_id = %s")
+PREPARED_STATEMENTS.register('formula_ingredient_lines', f"""
+    SELECT {FORMULA_LINE_COLUMNS}
+    FROM formula_ingredients fi
+    JOIN user_ingredients i ON fi.ingredient_id = i.id
+    WHERE fi.formula_id = %s AND i.user_id = %s
+""")
+PREPARED_STATEMENTS.register('formula_sub_formula_lines', """
+    SELECT
+        fi.id AS formula_ingredient_id, fi.formula_id, fi.sub_formula_id,
+        fi.quantity, fi.unit, sf.product_name AS ingredient_name
+    FROM formula_ingredients fi
+    JOIN formulas sf ON fi.sub_formula_id = sf.id
+    WHERE fi.formula_id = %s AND sf.user_id = %s
+""")
+
 @retry_on_connection_error()
+@read_only
 def get_formula_by_id(formula_id: int, user_id: int) -> dict | None:
-    sql_formula = "SELECT * FROM formulas WHERE id = %s AND user_id = %s"
-    sql_ingredients = """
-        SELECT
-            fi.id AS formula_ingredient_id, fi.formula_id, fi.ingredient_id,
-            fi.quantity, fi.unit, i.name AS ingredient_name, i.protein_percent,
-            i.fat_percent, i.water_percent, i.ve_protein_percent, i.notes,
-            i.water_retention_factor, i.min_usage_percent, i.max_usage_percent,
-            i.precio_por_kg, i.categoria
-        FROM formula_ingredients fi
-        JOIN user_ingredients i ON fi.ingredient_id = i.id
-        WHERE fi.formula_id = %s AND i.user_id = %s
-    """
     try:
         with get_db_connection_context() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-                cursor.execute(sql_formula, (formula_id, user_id))
-                formula_row = cursor.fetchone()
-                if not formula_row: return None
-                formula_data = dict(formula_row)
-                cursor.execute(sql_ingredients, (formula_id, user_id))
-                ingredient_rows = cursor.fetchall()
-                formula_data['ingredients'] = [dict(row) for row in ingredient_rows]
+            with conn.cursor() as cursor:
+                PREPARED_STATEMENTS.execute(cursor, 'formula_by_id', (formula_id, user_id))
+                formula_rows = _fetch_dicts(cursor)
+                if not formula_rows: return None
+                formula_data = formula_rows[0]
+                PREPARED_STATEMENTS.execute(cursor, 'formula_ingredient_lines', (formula_id, user_id))
+                formula_data['ingredients'] = records.formula_lines(cursor.fetchall())
+                # Líneas que son otra fórmula; su composición la calcula subformulas.py
+                PREPARED_STATEMENTS.execute(cursor, 'formula_sub_formula_lines', (formula_id, user_id))
+                formula_data['sub_formulas'] = _fetch_dicts(cursor)
                 return formula_data
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en get_formula_by_id: {e}")
         return None
@@ -433,6 +861,8 @@ def add_formula(product_name: str, user_id: int, description: str = "") -> int |
     except psycopg2.IntegrityError:
         log.warning(f"Error de integridad al añadir fórmula. ¿Duplicada? user_id={user_id}, name={product_name}")
         return None
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error inesperado en add_formula: {e}")
         return None
@@ -446,6 +876,8 @@ def delete_formula(formula_id: int, user_id: int) -> bool:
                 with conn.cursor() as cursor:
                     cursor.execute(sql, (formula_id, user_id))
                     return cursor.rowcount > 0
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"ERROR eliminando fórmula: {e}")
         return False
@@ -459,6 +891,8 @@ def update_formula_name(formula_id: int, new_name: str, user_id: int) -> bool:
                 with conn.cursor() as cursor:
                     cursor.execute(sql, (new_name, formula_id, user_id))
                     return cursor.rowcount > 0
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error actualizando nombre de fórmula: {e}")
         return False
@@ -545,6 +979,10 @@ def _get_or_create_user_ingredient_id_by_name(cursor, ingredient_name: str, user
         log.error(f"ERROR CRÍTICO: No se encontró el ingrediente '{ingredient_name}' después del INSERT ON CONFLICT.")
         return None
 
+def _bump_formula_revision(cursor, formula_id: int):
+    """Marca un cambio en las líneas de la fórmula (ver apply_formula_line_operations)."""
+    cursor.execute("UPDATE formulas SET revision = revision + 1 WHERE id = %s", (formula_id,))
+
 @retry_on_connection_error()
 def add_ingredient_to_formula(formula_id: int, ingredient_name: str, quantity: float, unit: str, user_id: int):
     sql = "INSERT INTO formula_ingredients (formula_id, ingredient_id, quantity, unit) VALUES (%s, %s, %s, %s)"
@@ -555,56 +993,458 @@ def add_ingredient_to_formula(formula_id: int, ingredient_name: str, quantity: f
                     ingredient_id = _get_or_create_user_ingredient_id_by_name(cursor, ingredient_name, user_id)
                     if ingredient_id:
                         cursor.execute(sql, (formula_id, ingredient_id, quantity, unit))
+                        _bump_formula_revision(cursor, formula_id)
                         log.info(f"Ingrediente '{ingredient_name}' (ID: {ingredient_id}) añadido exitosamente a la fórmula {formula_id}.")
                     else:
                         log.error(f"Error FATAL: Ingrediente '{ingredient_name}' no fue encontrado.")
                         raise Exception(f"Ingrediente no encontrado: {ingredient_name}") # Forzar rollback
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"ERROR en add_ingredient_to_formula: {e}")
 
 @retry_on_connection_error()
 def delete_ingredient(formula_ingredient_id: int):
-    sql = "DELETE FROM formula_ingredients WHERE id = %s"
+    sql = "DELETE FROM formula_ingredients WHERE id = %s RETURNING formula_id"
     try:
         with get_db_connection_context() as conn:
             with conn: # Gestor de transacción
                 with conn.cursor() as cursor:
                     cursor.execute(sql, (formula_ingredient_id,))
+                    deleted = cursor.fetchone()
+                    if deleted:
+                        _bump_formula_revision(cursor, deleted[0])
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en delete_ingredient: {e}")
 
+PREPARED_STATEMENTS.register('formula_id_for_ingredient', "SELECT formula_id FROM formula_ingredients WHERE id = %s")
+
 @retry_on_connection_error()
+@read_only
 def get_formula_id_for_ingredient(formula_ingredient_id: int) -> int | None:
-    sql = "SELECT formula_id FROM formula_ingredients WHERE id = %s"
     try:
         with get_db_connection_context() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-                cursor.execute(sql, (formula_ingredient_id,))
+                PREPARED_STATEMENTS.execute(cursor, 'formula_id_for_ingredient', (formula_ingredient_id,))
                 result = cursor.fetchone()
                 return result['formula_id'] if result else None
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en get_formula_id_for_ingredient: {e}")
         return None
 
 @retry_on_connection_error()
 def update_ingredient(formula_ingredient_id: int, new_name: str, new_quantity: float, new_unit: str, user_id: int) -> bool:
-    sql_update = "UPDATE formula_ingredients SET ingredient_id = %s, quantity = %s, unit = %s WHERE id = %s"
+    sql_update = "UPDATE formula_ingredients SET ingredient_id = %s, sub_formula_id = NULL, quantity = %s, unit = %s WHERE id = %s RETURNING formula_id"
+    sql_sub_line = """
+        SELECT sf.product_name FROM formula_ingredients fi
+        JOIN formulas sf ON fi.sub_formula_id = sf.id
+        WHERE fi.id = %s AND sf.user_id = %s
+    """
+    sql_update_qty = "UPDATE formula_ingredients SET quantity = %s, unit = %s WHERE id = %s RETURNING formula_id"
     try:
         with get_db_connection_context() as conn:
             with conn: # Gestor de transacción
                 with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-                    new_ingredient_id = _get_or_create_user_ingredient_id_by_name(cursor, new_name, user_id)
-                    if not new_ingredient_id:
-                        log.error(f"ERROR: No se pudo encontrar o crear el ID para el ingrediente '{new_name}'")
-                        return False
-                    cursor.execute(sql_update, (new_ingredient_id, new_quantity, new_unit, formula_ingredient_id))
-                    return cursor.rowcount > 0 
+                    # Línea de sub-fórmula con el mismo nombre: solo cambia cantidad/unidad
+                    cursor.execute(sql_sub_line, (formula_ingredient_id, user_id))
+                    sub_line = cursor.fetchone()
+                    if sub_line and sub_line['product_name'].lower() == new_name.lower():
+                        cursor.execute(sql_update_qty, (new_quantity, new_unit, formula_ingredient_id))
+                    else:
+                        new_ingredient_id = _get_or_create_user_ingredient_id_by_name(cursor, new_name, user_id)
+                        if not new_ingredient_id:
+                            log.error(f"ERROR: No se pudo encontrar o crear el ID para el ingrediente '{new_name}'")
+                            return False
+                        cursor.execute(sql_update, (new_ingredient_id, new_quantity, new_unit, formula_ingredient_id))
+                    updated = cursor.fetchone()
+                    if updated:
+                        _bump_formula_revision(cursor, updated['formula_id'])
+                    return updated is not None
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"ERROR en update_ingredient: {e}")
         return False
 
+class _LineOperationsRejected(Exception):
+    """Aborta (rollback) apply_formula_line_operations con un estado para la API."""
+
+    def __init__(self, status: str, message: str):
+        super().__init__(message)
+        self.status = status
+
+@retry_on_connection_error()
+def apply_formula_line_operations(formula_id: int, user_id: int, operations: list[dict],
+                                  expected_revision: int | None = None) -> dict:
+    """
+    Aplica varias operaciones de línea en una sola transacción y con sentencias en bloque.
+    'operations' son dicts {'op': 'add'|'update'|'delete', 'id', 'name', 'quantity', 'unit'}
+    (en 'update' los campos ausentes no cambian; un nombre igual al de la sub-fórmula la conserva).
+    Si 'expected_revision' no coincide con la revisión actual, no se aplica nada.
+    Devuelve {'status': 'success'|'not_found'|'conflict'|'invalid'|'error', 'revision', 'error'}.
+    """
+    sql_lock = "SELECT revision FROM formulas WHERE id = %s AND user_id = %s FOR UPDATE"
+    sql_lines = """
+        SELECT fi.id, sf.product_name AS sub_formula_name
+        FROM formula_ingredients fi
+        LEFT JOIN formulas sf ON fi.sub_formula_id = sf.id
+        WHERE fi.formula_id = %s AND fi.id = ANY(%s)
+    """
+    sql_names = "SELECT id, lower(name) AS name_key FROM user_ingredients WHERE user_id = %s AND lower(name) = ANY(%s)"
+    sql_delete = "DELETE FROM formula_ingredients WHERE formula_id = %s AND id = ANY(%s)"
+    # ingredient_id NULL en los valores = conservar el destino actual de la línea
+    sql_update = """
+        UPDATE formula_ingredients AS fi SET
+            ingredient_id = COALESCE(v.ingredient_id, fi.ingredient_id),
+            sub_formula_id = CASE WHEN v.ingredient_id IS NULL THEN fi.sub_formula_id END,
+            quantity = COALESCE(v.quantity, fi.quantity),
+            unit = COALESCE(v.unit, fi.unit)
+        FROM (VALUES %s) AS v(id, formula_id, ingredient_id, quantity, unit)
+        WHERE fi.id = v.id AND fi.formula_id = v.formula_id
+    """
+    sql_insert = "INSERT INTO formula_ingredients (formula_id, ingredient_id, quantity, unit) VALUES %s"
+    sql_bump = "UPDATE formulas SET revision = revision + 1 WHERE id = %s RETURNING revision"
+
+    deletes = [op['id'] for op in operations if op['op'] == 'delete']
+    updates = [op for op in operations if op['op'] == 'update']
+    adds = [op for op in operations if op['op'] == 'add']
+    try:
+        with get_db_connection_context() as conn:
+            with conn: # Gestor de transacción
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    # Bloquea la fórmula: dos editores concurrentes se serializan aquí
+                    cursor.execute(sql_lock, (formula_id, user_id))
+                    row = cursor.fetchone()
+                    if not row:
+                        return {'status': 'not_found', 'revision': None}
+                    if expected_revision is not None and row['revision'] != expected_revision:
+                        return {'status': 'conflict', 'revision': row['revision'],
+                                'error': 'La fórmula fue modificada por otra sesión.'}
+
+                    line_ids = deletes + [op['id'] for op in updates]
+                    cursor.execute(sql_lines, (formula_id, line_ids))
+                    sub_names = {r['id']: r['sub_formula_name'] for r in cursor.fetchall()}
+                    missing = set(line_ids) - set(sub_names)
+                    if missing:
+                        raise _LineOperationsRejected('invalid', f"Líneas que no pertenecen a la fórmula: {sorted(missing)}")
+
+                    # Un nombre por ingrediente: las líneas de sub-fórmula con su propio nombre no cambian de destino
+                    def keeps_target(op):
+                        sub_name = sub_names.get(op.get('id'))
+                        return not op.get('name') or (sub_name is not None and sub_name.lower() == op['name'].lower())
+                    names = {op['name'].lower(): op['name'] for op in adds + updates if not keeps_target(op)}
+                    ingredient_ids = {}
+                    if names:
+                        cursor.execute(sql_names, (user_id, list(names)))
+                        ingredient_ids = {r['name_key']: r['id'] for r in cursor.fetchall()}
+                        for key in names.keys() - ingredient_ids.keys():
+                            # Copia desde el catálogo base (raro: un ingrediente nuevo para el usuario)
+                            ingredient_ids[key] = _get_or_create_user_ingredient_id_by_name(cursor, names[key], user_id)
+                        unknown = [names[key] for key, ing_id in ingredient_ids.items() if not ing_id]
+                        if unknown:
+                            raise _LineOperationsRejected('invalid', f"Ingredientes no encontrados: {', '.join(unknown)}")
+
+                    if deletes:
+                        cursor.execute(sql_delete, (formula_id, deletes))
+                    if updates:
+                        update_rows = [
+                            (op['id'], formula_id,
+                             None if keeps_target(op) else ingredient_ids[op['name'].lower()],
+                             op.get('quantity'), op.get('unit'))
+                            for op in updates
+                        ]
+                        _execute_values(
+                            cursor, sql_update, update_rows,
+                            template="(%s::integer, %s::integer, %s::integer, %s::real, %s::text)"
+                        )
+                    if adds:
+                        insert_rows = [
+                            (formula_id, ingredient_ids[op['name'].lower()], op['quantity'], op['unit'])
+                            for op in adds
+                        ]
+                        _execute_values(cursor, sql_insert, insert_rows)
+
+                    cursor.execute(sql_bump, (formula_id,))
+                    revision = cursor.fetchone()['revision']
+                    log.info(f"Fórmula {formula_id}: {len(adds)} altas, {len(updates)} cambios, "
+                             f"{len(deletes)} bajas (revisión {revision}).")
+                    return {'status': 'success', 'revision': revision}
+    except _LineOperationsRejected as e:
+        return {'status': e.status, 'revision': None, 'error': str(e)}
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en apply_formula_line_operations: {e}")
+        return {'status': 'error', 'revision': None}
+
+@retry_on_connection_error()
+@read_only
+def get_formulas_bulk(formula_ids: list[int], user_id: int) -> dict[int, dict]:
+    """
+    Como get_formula_by_id pero para varias fórmulas con tres consultas en total.
+    Devuelve {formula_id: formula_data} con 'ingredients' y 'sub_formulas'.
+    """
+    if not formula_ids:
+        return {}
+    sql_formulas = "SELECT * FROM formulas WHERE id = ANY(%s) AND user_id = %s"
+    sql_ingredients = f"""
+        SELECT {FORMULA_LINE_COLUMNS}
+        FROM formula_ingredients fi
+        JOIN user_ingredients i ON fi.ingredient_id = i.id
+        WHERE fi.formula_id = ANY(%s) AND i.user_id = %s
+    """
+    sql_sub_formulas = """
+        SELECT
+            fi.id AS formula_ingredient_id, fi.formula_id, fi.sub_formula_id,
+            fi.quantity, fi.unit, sf.product_name AS ingredient_name
+        FROM formula_ingredients fi
+        JOIN formulas sf ON fi.sub_formula_id = sf.id
+        WHERE fi.formula_id = ANY(%s) AND sf.user_id = %s
+    """
+    try:
+        with get_db_connection_context() as conn:
+            with conn.cursor() as cursor:
+                ids = list(formula_ids)
+                cursor.execute(sql_formulas, (ids, user_id))
+                formulas = {row['id']: {**row, 'ingredients': [], 'sub_formulas': []} for row in _fetch_dicts(cursor)}
+                cursor.execute(sql_ingredients, (ids, user_id))
+                for line in records.formula_lines(cursor.fetchall()):
+                    if line.formula_id in formulas:
+                        formulas[line.formula_id]['ingredients'].append(line)
+                cursor.execute(sql_sub_formulas, (ids, user_id))
+                for row in _fetch_dicts(cursor):
+                    if row['formula_id'] in formulas:
+                        formulas[row['formula_id']]['sub_formulas'].append(row)
+                return formulas
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en get_formulas_bulk: {e}")
+        return {}
+
+# --- Índice de búsqueda por composición ---
+SEARCH_INDEX_ATTRIBUTES = ('total_kg', 'protein_perc', 'fat_perc', 'water_perc', 'costo_total', 'costo_por_kg')
+
+@retry_on_connection_error()
+def upsert_formula_search_index(user_id: int, entries: list[dict]) -> bool:
+    """
+    Guarda los totales y los % por línea de varias fórmulas en una transacción.
+    Cada entrada: {'formula_id', <SEARCH_INDEX_ATTRIBUTES>, 'lines': [(ingredient_name, percentage)]}.
+    """
+    if not entries:
+        return True
+    columns = ', '.join(SEARCH_INDEX_ATTRIBUTES)
+    updates = ', '.join(f"{c} = EXCLUDED.{c}" for c in SEARCH_INDEX_ATTRIBUTES)
+    sql_totals = f"""
+        INSERT INTO formula_search_index (formula_id, user_id, {columns})
+        VALUES %s
+        ON CONFLICT (formula_id) DO UPDATE SET {updates}, updated_at = NOW()
+    """
+    sql_delete_lines = "DELETE FROM formula_line_search_index WHERE formula_id = ANY(%s)"
+    sql_lines = "INSERT INTO formula_line_search_index (formula_id, user_id, ingredient_name, percentage) VALUES %s"
+    totals_rows = [
+        (e['formula_id'], user_id, *(e.get(c, 0) for c in SEARCH_INDEX_ATTRIBUTES)) for e in entries
+    ]
+    line_rows = [
+        (e['formula_id'], user_id, name, percentage) for e in entries for name, percentage in e.get('lines', [])
+    ]
+    try:
+        with get_db_connection_context() as conn:
+            with conn: # Gestor de transacción
+                with conn.cursor() as cursor:
+                    _execute_values(cursor, sql_totals, totals_rows)
+                    cursor.execute(sql_delete_lines, ([e['formula_id'] for e in entries],))
+                    if line_rows:
+                        _execute_values(cursor, sql_lines, line_rows)
+                    return True
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en upsert_formula_search_index: {e}")
+        return False
+
+@retry_on_connection_error()
+def get_unindexed_formula_ids() -> dict[int, list[int]]:
+    """{user_id: [formula_id]} de las fórmulas que aún no están en formula_search_index."""
+    sql = """
+        SELECT f.user_id, f.id FROM formulas f
+        LEFT JOIN formula_search_index s ON s.formula_id = f.id
+        WHERE s.formula_id IS NULL
+        ORDER BY f.user_id, f.id
+    """
+    try:
+        with get_db_connection_context() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql)
+                missing = {}
+                for user_id, formula_id in cursor.fetchall():
+                    missing.setdefault(user_id, []).append(formula_id)
+                return missing
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en get_unindexed_formula_ids: {e}")
+        return {}
+
+@retry_on_connection_error()
+@read_only
+def search_formulas(user_id: int, ranges: dict | None = None, ingredient_filters: list | None = None,
+                    sort: str = 'product_name', descending: bool = False, limit: int = 100) -> list[dict]:
+    """
+    Busca fórmulas por rangos de sus totales y por % de ingredientes.
+    ranges: {atributo: (min, max)} con atributos de SEARCH_INDEX_ATTRIBUTES (None = abierto).
+    ingredient_filters: [(nombre, min_pct, max_pct)]; cada filtro debe cumplirse.
+    Lanza ValueError si el atributo o el orden no son válidos.
+    """
+    where = ["s.user_id = %s"]
+    params = [user_id]
+    for attribute, (low, high) in (ranges or {}).items():
+        if attribute not in SEARCH_INDEX_ATTRIBUTES:
+            raise ValueError(f"Atributo no válido: {attribute}")
+        if low is not None:
+            where.append(f"s.{attribute} >= %s")
+            params.append(low)
+        if high is not None:
+            where.append(f"s.{attribute} <= %s")
+            params.append(high)
+    for name, low, high in ingredient_filters or []:
+        clause = "EXISTS (SELECT 1 FROM formula_line_search_index l WHERE l.formula_id = s.formula_id AND l.user_id = s.user_id AND lower(l.ingredient_name) = lower(%s)"
+        params.append(name)
+        if low is not None:
+            clause += " AND l.percentage >= %s"
+            params.append(low)
+        if high is not None:
+            clause += " AND l.percentage <= %s"
+            params.append(high)
+        where.append(clause + ")")
+
+    if sort == 'product_name':
+        order_by = "f.product_name"
+    elif sort in SEARCH_INDEX_ATTRIBUTES:
+        order_by = f"s.{sort}"
+    else:
+        raise ValueError(f"Orden no válido: {sort}")
+    direction = "DESC" if descending else "ASC"
+    params.append(max(1, min(int(limit), PAGE_MAX_LIMIT)))
+
+    sql = f"""
+        SELECT f.id, f.product_name, {', '.join('s.' + c for c in SEARCH_INDEX_ATTRIBUTES)}
+        FROM formula_search_index s
+        JOIN formulas f ON f.id = s.formula_id
+        WHERE {' AND '.join(where)}
+        ORDER BY {order_by} {direction}, f.id
+        LIMIT %s
+    """
+    try:
+        with get_db_connection_context() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(sql, tuple(params))
+                return [dict(row) for row in cursor.fetchall()]
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en search_formulas: {e}")
+        return []
+
+# --- Funciones de Sub-fórmulas ---
+@retry_on_connection_error()
+def add_sub_formula_to_formula(formula_id: int, sub_formula_id: int, quantity: float, unit: str, user_id: int) -> str:
+    """
+    Añade otra fórmula del usuario como línea de 'formula_id'.
+    Devuelve 'success', 'not_found' o 'cycle' (si formula_id ya está dentro de sub_formula_id).
+    """
+    # Bloquea las dos fórmulas (en orden de id, sin interbloqueos) hasta el INSERT:
+    # dos altas cruzadas A->B y B->A a la vez se serializan y la segunda ve el ciclo.
+    sql_owned = "SELECT id FROM formulas WHERE id IN (%s, %s) AND user_id = %s ORDER BY id FOR UPDATE"
+    # Todas las fórmulas contenidas (directa o indirectamente) en sub_formula_id
+    sql_descendants = """
+        WITH RECURSIVE descendants(id) AS (
+            SELECT %s
+            UNION
+            SELECT fi.sub_formula_id
+            FROM formula_ingredients fi
+            JOIN descendants d ON fi.formula_id = d.id
+            WHERE fi.sub_formula_id IS NOT NULL
+        )
+        SELECT 1 FROM descendants WHERE id = %s
+    """
+    sql_insert = "INSERT INTO formula_ingredients (formula_id, sub_formula_id, quantity, unit) VALUES (%s, %s, %s, %s)"
+    try:
+        with get_db_connection_context() as conn:
+            with conn: # Gestor de transacción
+                with conn.cursor() as cursor:
+                    cursor.execute(sql_owned, (formula_id, sub_formula_id, user_id))
+                    expected = 1 if formula_id == sub_formula_id else 2
+                    if len(cursor.fetchall()) != expected:
+                        return 'not_found'
+                    cursor.execute(sql_descendants, (sub_formula_id, formula_id))
+                    if cursor.fetchone():
+                        log.warning(f"Ciclo detectado: la fórmula {formula_id} ya contiene o es {sub_formula_id}.")
+                        return 'cycle'
+                    cursor.execute(sql_insert, (formula_id, sub_formula_id, quantity, unit))
+                    _bump_formula_revision(cursor, formula_id)
+                    return 'success'
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en add_sub_formula_to_formula: {e}")
+        return 'error'
+
+@retry_on_connection_error()
+@read_only
+def get_formula_ancestors(formula_ids: list[int]) -> set[int]:
+    """Fórmulas que contienen (directa o indirectamente) alguna de 'formula_ids'."""
+    if not formula_ids:
+        return set()
+    sql = """
+        WITH RECURSIVE ancestors(id) AS (
+            SELECT fi.formula_id FROM formula_ingredients fi WHERE fi.sub_formula_id = ANY(%s)
+            UNION
+            SELECT fi.formula_id
+            FROM formula_ingredients fi
+            JOIN ancestors a ON fi.sub_formula_id = a.id
+        )
+        SELECT id FROM ancestors
+    """
+    try:
+        with get_db_connection_context() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, (list(formula_ids),))
+                return {row[0] for row in cursor.fetchall()}
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en get_formula_ancestors: {e}")
+        return set()
+
+@retry_on_connection_error()
+@read_only
+def get_sub_formula_ids(user_id: int) -> set[int]:
+    """Fórmulas del usuario que se usan como sub-fórmula (premezclas, salmueras) en otra."""
+    sql = """
+        SELECT DISTINCT fi.sub_formula_id
+        FROM formula_ingredients fi
+        JOIN formulas f ON f.id = fi.formula_id
+        WHERE f.user_id = %s AND fi.sub_formula_id IS NOT NULL
+    """
+    try:
+        with get_db_connection_context() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, (user_id,))
+                return {row[0] for row in cursor.fetchall()}
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en get_sub_formula_ids: {e}")
+        return set()
+
 # --- Funciones de Ingredientes de Usuario ---
 @retry_on_connection_error()
+@read_only
 def get_user_ingredients(user_id: int) -> list[dict]:
     sql = "SELECT * FROM user_ingredients WHERE user_id = %s ORDER BY name"
     try:
@@ -613,11 +1453,95 @@ def get_user_ingredients(user_id: int) -> list[dict]:
                 cursor.execute(sql, (user_id,))
                 results = [dict(row) for row in cursor.fetchall()]
                 return results
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en get_user_ingredients: {e}")
         return []
 
+# --- Paginación por cursor (keyset) y proyecciones ---
+# Columnas que los listados pueden pedir. Sirve de lista blanca: los nombres
+# se interpolan en el SQL, así que nunca se acepta nada fuera de aquí.
+USER_INGREDIENT_COLUMNS = (
+    'id', 'name', 'protein_percent', 'fat_percent', 'water_percent', 've_protein_percent',
+    'notes', 'water_retention_factor', 'min_usage_percent', 'max_usage_percent',
+    'precio_por_kg', 'categoria'
+)
+BIBLIOGRAFIA_COLUMNS = ('id', 'titulo', 'tipo', 'contenido')
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 500
+
+def encode_cursor(values: list) -> str:
+    """Codifica las claves de orden del último elemento en un cursor opaco."""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Decodifica un cursor de encode_cursor. Lanza ValueError si es inválido."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError("Cursor inválido.")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Cursor inválido.")
+    return values
+
+def _projection(columns, allowed: tuple, required: tuple) -> list[str]:
+    """Valida las columnas pedidas y añade las necesarias para el cursor."""
+    if not columns:
+        return list(allowed)
+    unknown = [c for c in columns if c not in allowed]
+    if unknown:
+        raise ValueError(f"Columnas no permitidas: {', '.join(unknown)}")
+    selected = list(required)
+    selected += [c for c in columns if c not in selected]
+    return selected
+
+def _clamp_limit(limit) -> int:
+    if not limit:
+        return PAGE_DEFAULT_LIMIT
+    return max(1, min(int(limit), PAGE_MAX_LIMIT))
+
+@retry_on_connection_error()
+@read_only
+def get_user_ingredients_page(user_id: int, columns: list[str] | None = None,
+                              after: str | None = None, limit: int | None = None) -> dict:
+    """
+    Devuelve una página de ingredientes del usuario ordenada por nombre.
+    'name' es único por usuario, así que basta como clave del cursor.
+    Lanza ValueError si el cursor o las columnas no son válidos.
+    """
+    selected = _projection(columns, USER_INGREDIENT_COLUMNS, ('id', 'name'))
+    limit = _clamp_limit(limit)
+    params = [user_id]
+    where = "user_id = %s"
+    if after:
+        (last_name,) = decode_cursor(after, 1)
+        where += " AND name > %s"
+        params.append(last_name)
+    params.append(limit + 1)
+    sql = f"SELECT {', '.join(selected)} FROM user_ingredients WHERE {where} ORDER BY name LIMIT %s"
+    try:
+        with get_db_connection_context() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(sql, tuple(params))
+                rows = [convert_row_to_dict(row) for row in cursor.fetchall()]
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en get_user_ingredients_page: {e}")
+        return {'items': [], 'next_cursor': None}
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['name']])
+    return {'items': rows, 'next_cursor': next_cursor}
+
+@cache.cached('base_ingredients', key_func=lambda: 'all')
 @retry_on_connection_error()
+@read_only
 def get_master_ingredients() -> list[dict]:
     sql = "SELECT * FROM base_ingredients ORDER BY name"
     results = []
@@ -628,6 +1552,8 @@ def get_master_ingredients() -> list[dict]:
                 for row in cursor.fetchall():
                     results.append(convert_row_to_dict(row))
         return results
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"ERROR al consultar base_ingredients en get_master_ingredients: {e}")
         return []
@@ -655,6 +1581,8 @@ def add_user_ingredient(details: dict, user_id: int) -> int | None:
     except psycopg2.IntegrityError: 
         log.warning(f"Error de integridad al añadir ingrediente de usuario. ¿Duplicado? name={details.get('name')}")
         return None
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error inesperado en add_user_ingredient: {e}")
         return None
@@ -682,56 +1610,215 @@ def update_user_ingredient(ingredient_id: int, details: dict, user_id: int) -> b
     except psycopg2.IntegrityError:
         log.warning(f"Error de integridad al actualizar ingrediente de usuario. ¿Nombre duplicado? id={ingredient_id}")
         return False
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error inesperado en update_user_ingredient: {e}")
         return False
 
+# Columnas que admite la actualización masiva del catálogo, con su tipo en la tabla de staging
+CATALOG_UPDATE_COLUMNS = {
+    'precio_por_kg': 'REAL', 'protein_percent': 'REAL', 'fat_percent': 'REAL', 'water_percent': 'REAL',
+    'water_retention_factor': 'REAL', 'min_usage_percent': 'REAL', 'max_usage_percent': 'REAL',
+    'categoria': 'TEXT',
+}
+
+@retry_on_connection_error()
+def bulk_update_user_ingredients(user_id: int, rows: list[dict], dry_run: bool = False) -> dict | None:
+    """
+    Cruza una lista de proveedor [{'name', <campos>}] con el catálogo del usuario
+    (por nombre, sin distinguir mayúsculas) y actualiza solo los valores que cambian.
+    Las filas se cargan en una tabla temporal y se aplican con un único UPDATE ... FROM.
+    Con dry_run=True se calcula el informe y se deshace todo.
+    Devuelve {'updated': [{'id', 'name', 'changes': {campo: {'before', 'after'}}}],
+    'unchanged': n, 'not_found': [nombres]} o None si falla.
+    """
+    columns = list(CATALOG_UPDATE_COLUMNS)
+    staging_columns = ', '.join(f"{c} {t}" for c, t in CATALOG_UPDATE_COLUMNS.items())
+    sql_staging = f"""
+        CREATE TEMP TABLE ingredient_update_staging (
+            name_key TEXT PRIMARY KEY, name TEXT NOT NULL, {staging_columns}
+        ) ON COMMIT DROP
+    """
+    sql_load = f"INSERT INTO ingredient_update_staging (name_key, name, {', '.join(columns)}) VALUES %s"
+    # Un NULL en la lista significa "sin cambio"; solo se tocan las filas con alguna diferencia
+    set_clause = ', '.join(f"{c} = COALESCE(s.{c}, u.{c})" for c in columns)
+    changed = ' OR '.join(f"(s.{c} IS NOT NULL AND s.{c} IS DISTINCT FROM u.{c})" for c in columns)
+    sql_changes = f"""
+        SELECT u.id, u.name,
+               {', '.join(f'u.{c} AS old_{c}, COALESCE(s.{c}, u.{c}) AS new_{c}' for c in columns)}
+        FROM user_ingredients u
+        JOIN ingredient_update_staging s ON lower(u.name) = s.name_key
+        WHERE u.user_id = %s AND ({changed})
+        ORDER BY u.name
+        FOR UPDATE OF u
+    """
+    sql_apply = f"""
+        UPDATE user_ingredients AS u SET {set_clause}
+        FROM ingredient_update_staging s
+        WHERE u.user_id = %s AND lower(u.name) = s.name_key AND ({changed})
+    """
+    sql_not_found = """
+        SELECT s.name FROM ingredient_update_staging s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM user_ingredients u WHERE u.user_id = %s AND lower(u.name) = s.name_key
+        )
+        ORDER BY s.name
+    """
+    staged = {}
+    for row in rows:
+        staged[row['name'].strip().lower()] = (row['name'].strip().lower(), row['name'].strip(),
+                                               *(row.get(c) for c in columns))
+    try:
+        with get_db_connection_context() as conn:
+            with conn: # Gestor de transacción
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.execute(sql_staging)
+                    if staged:
+                        _execute_values(cursor, sql_load, list(staged.values()))
+                    # El informe se lee antes del UPDATE (con las filas bloqueadas) para no
+                    # depender de un CTE que modifica datos, que SQLite no admite
+                    cursor.execute(sql_changes, (user_id,))
+                    updated = []
+                    for r in cursor.fetchall():
+                        changes = {
+                            c: {'before': r[f'old_{c}'], 'after': r[f'new_{c}']}
+                            for c in columns if r[f'old_{c}'] != r[f'new_{c}']
+                        }
+                        updated.append({'id': r['id'], 'name': r['name'], 'changes': changes})
+                    if updated:
+                        cursor.execute(sql_apply, (user_id,))
+                    cursor.execute(sql_not_found, (user_id,))
+                    not_found = [r['name'] for r in cursor.fetchall()]
+
+                    if dry_run:
+                        conn.rollback()
+                    updated_keys = {u['name'].lower() for u in updated}
+                    log.info(f"Actualización masiva de catálogo (user {user_id}, dry_run={dry_run}): "
+                             f"{len(updated)} cambiados, {len(not_found)} sin coincidencia.")
+                    return {
+                        'updated': updated,
+                        'unchanged': len(staged) - len(not_found) - len(updated_keys & staged.keys()),
+                        'not_found': not_found,
+                    }
+    except psycopg2.IntegrityError as e:
+        log.warning(f"Error de integridad en bulk_update_user_ingredients: {e}")
+        return None
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error inesperado en bulk_update_user_ingredients: {e}")
+        return None
+
 @retry_on_connection_error()
 def delete_user_ingredient(ingredient_id: int, user_id: int) -> str:
+    # Comprobamos el uso explícitamente: en bases antiguas no existe la FK
+    # y el IntegrityError nunca llegaría.
+    sql_in_use = """
+        SELECT 1 FROM formula_ingredients fi
+        JOIN formulas f ON f.id = fi.formula_id
+        WHERE fi.ingredient_id = %s AND f.user_id = %s
+        LIMIT 1
+    """
     sql = "DELETE FROM user_ingredients WHERE id = %s AND user_id = %s"
     try:
         with get_db_connection_context() as conn:
             with conn: # Gestor de transacción
                 with conn.cursor() as cursor:
+                    cursor.execute(sql_in_use, (ingredient_id, user_id))
+                    if cursor.fetchone():
+                        log.warning(f"No se pudo eliminar ingrediente {ingredient_id}, está en uso.")
+                        return 'in_use'
                     cursor.execute(sql, (ingredient_id, user_id))
                     return 'success' if cursor.rowcount > 0 else 'not_found'
     except psycopg2.IntegrityError: 
         log.warning(f"No se pudo eliminar ingrediente {ingredient_id}, está en uso.")
         return 'in_use'
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error inesperado en delete_user_ingredient: {e}")
         return 'error'
 
+# --- Índice "where-used" (ingrediente -> fórmulas) ---
 @retry_on_connection_error()
+@read_only
+def get_formulas_using_ingredients(ingredient_ids: list[int], user_id: int) -> dict[int, list[dict]]:
+    """
+    Devuelve {ingredient_id: [{'id', 'product_name'}, ...]} con las fórmulas
+    del usuario que usan cada ingrediente. Una sola consulta para todos los IDs.
+    """
+    if not ingredient_ids:
+        return {}
+    sql = """
+        SELECT DISTINCT fi.ingredient_id, f.id, f.product_name
+        FROM formula_ingredients fi
+        JOIN formulas f ON f.id = fi.formula_id
+        WHERE fi.ingredient_id = ANY(%s) AND f.user_id = %s
+        ORDER BY f.product_name
+    """
+    try:
+        with get_db_connection_context() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(sql, (list(ingredient_ids), user_id))
+                where_used = {}
+                for row in cursor.fetchall():
+                    where_used.setdefault(row['ingredient_id'], []).append(
+                        {'id': row['id'], 'product_name': row['product_name']}
+                    )
+                return where_used
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en get_formulas_using_ingredients: {e}")
+        return {}
+
+PREPARED_STATEMENTS.register(
+    'search_user_ingredient_names',
+    "SELECT name FROM user_ingredients WHERE name ILIKE %s AND user_id = %s ORDER BY name LIMIT 10"
+)
+
+@retry_on_connection_error()
+@read_only
 def search_user_ingredient_names(query: str, user_id: int) -> list[str]:
-    sql = "SELECT name FROM user_ingredients WHERE name ILIKE %s AND user_id = %s ORDER BY name LIMIT 10"
     search_term = f"%{query}%"
     try:
         with get_db_connection_context() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(sql, (search_term, user_id))
+                PREPARED_STATEMENTS.execute(cursor, 'search_user_ingredient_names', (search_term, user_id))
                 results = [row[0] for row in cursor.fetchall()]
                 return results
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en search_user_ingredient_names: {e}")
         return []
 
+PREPARED_STATEMENTS.register(
+    'search_base_ingredient_names', "SELECT name FROM base_ingredients WHERE name ILIKE %s ORDER BY name LIMIT 10"
+)
+
+@cache.cached('base_ingredients', key_func=lambda query: f"search:{query.lower()}", ttl=600)
 @retry_on_connection_error()
+@read_only
 def search_base_ingredient_names(query: str) -> list[str]:
-    sql = "SELECT name FROM base_ingredients WHERE name ILIKE %s ORDER BY name LIMIT 10"
     search_term = f"%{query}%"
     try:
         with get_db_connection_context() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(sql, (search_term,))
+                PREPARED_STATEMENTS.execute(cursor, 'search_base_ingredient_names', (search_term,))
                 results = [row[0] for row in cursor.fetchall()]
                 return results
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"ERROR en search_base_ingredient_names: {e}")
         return []
         
 # --- Funciones de Bibliografía ---
+@cache.cached('bibliografia', key_func=lambda: 'all', shared_only=True)
 @retry_on_connection_error()
+@read_only
 def get_all_bibliografia() -> list[dict]:
     sql = "SELECT * FROM bibliografia ORDER BY titulo"
     try:
@@ -740,10 +1827,76 @@ def get_all_bibliografia() -> list[dict]:
                 cursor.execute(sql)
                 results = [dict(row) for row in cursor.fetchall()]
                 return results
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en get_all_bibliografia: {e}")
         return []
 
+@cache.cached('bibliografia', shared_only=True)
+@retry_on_connection_error()
+@read_only
+def get_bibliografia_page(columns: list[str] | None = None,
+                          after: str | None = None, limit: int | None = None,
+                          q: str | None = None) -> dict:
+    """
+    Devuelve una página de la bibliografía ordenada por (titulo, id).
+    Por defecto NO incluye 'contenido': se carga por entrada con get_bibliografia_entry.
+    Con 'q' solo devuelve las entradas cuyo título, tipo o contenido lo contienen.
+    Lanza ValueError si el cursor o las columnas no son válidos.
+    """
+    if not columns:
+        columns = ['id', 'titulo', 'tipo']
+    selected = _projection(columns, BIBLIOGRAFIA_COLUMNS, ('id', 'titulo'))
+    limit = _clamp_limit(limit)
+    params = []
+    conditions = []
+    if q:
+        pattern = f"%{q}%"
+        conditions.append("(titulo ILIKE %s OR tipo ILIKE %s OR contenido ILIKE %s)")
+        params += [pattern, pattern, pattern]
+    if after:
+        last_titulo, last_id = decode_cursor(after, 2)
+        conditions.append("(titulo, id) > (%s, %s)")
+        params += [last_titulo, last_id]
+    params.append(limit + 1)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"SELECT {', '.join(selected)} FROM bibliografia {where} ORDER BY titulo, id LIMIT %s"
+    try:
+        with get_db_connection_context() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(sql, tuple(params))
+                rows = [dict(row) for row in cursor.fetchall()]
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en get_bibliografia_page: {e}")
+        return {'items': [], 'next_cursor': None}
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['titulo'], rows[-1]['id']])
+    return {'items': rows, 'next_cursor': next_cursor}
+
+@cache.cached('bibliografia', key_func=lambda entry_id: f"entry:{entry_id}", shared_only=True)
+@retry_on_connection_error()
+@read_only
+def get_bibliografia_entry(entry_id: int) -> dict | None:
+    """Devuelve una entrada completa de la bibliografía (incluido 'contenido')."""
+    sql = "SELECT id, titulo, tipo, contenido FROM bibliografia WHERE id = %s"
+    try:
+        with get_db_connection_context() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(sql, (entry_id,))
+                row = cursor.fetchone()
+                return dict(row) if row else None
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        log.error(f"Error en get_bibliografia_entry: {e}")
+        return None
+
 @retry_on_connection_error()
 def add_bibliografia_entry(titulo: str, tipo: str, contenido: str) -> int | None:
     sql = "INSERT INTO bibliografia (titulo, tipo, contenido) VALUES (%s, %s, %s) RETURNING id"
@@ -753,7 +1906,10 @@ def add_bibliografia_entry(titulo: str, tipo: str, contenido: str) -> int | None
                 with conn.cursor() as cursor:
                     cursor.execute(sql, (titulo, tipo, contenido))
                     new_id = cursor.fetchone()[0]
-                    return new_id
+            cache.invalidate('bibliografia')
+            return new_id
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en add_bibliografia_entry: {e}")
         return None
@@ -766,7 +1922,11 @@ def update_bibliografia_entry(entry_id: int, titulo: str, tipo: str, contenido:
             with conn: # Gestor de transacción
                 with conn.cursor() as cursor:
                     cursor.execute(sql, (titulo, tipo, contenido, entry_id))
-                    return cursor.rowcount > 0
+                    updated = cursor.rowcount > 0
+            cache.invalidate('bibliografia')
+            return updated
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en update_bibliografia_entry: {e}")
         return False
@@ -779,7 +1939,11 @@ def delete_bibliografia_entry(entry_id: int) -> bool:
             with conn: # Gestor de transacción
                 with conn.cursor() as cursor:
                     cursor.execute(sql, (entry_id,))
-                    return cursor.rowcount > 0
+                    deleted = cursor.rowcount > 0
+            cache.invalidate('bibliografia')
+            return deleted
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error en delete_bibliografia_entry: {e}")
         return False
@@ -872,6 +2036,8 @@ def update_session_token(user_id, token):
                 with conn.cursor() as cursor:
                     cursor.execute(sql, (token, user_id))
                     return True
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error updating session token: {e}")
         return False
@@ -886,6 +2052,8 @@ def get_session_token_for_user(user_id):
                 result = cursor.fetchone()
                 token = result['session_token'] if result else None
                 return token
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error getting session token: {e}")
         return None
@@ -974,10 +2142,14 @@ def seed_initial_ingredients(user_id):
                         # Commit automático del 'with conn'
                         log.info("Seed exitoso con 'Ve_Protein_Percent'.")
                         return True
+        except PASSTHROUGH_ERRORS:
+            raise
         except Exception as e_fb:
             log.error(f"Error en el reintento de seed_initial_ingredients (fallback): {e_fb}")
             return False
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         log.error(f"Error general en seed_initial_ingredients: {e}")
         return False
\ No newline at end of file
@@ -0,0 +1,82 @@
+# fast_json.py
+"""
+Proveedor JSON de Flask basado en orjson (si está instalado).
+
+Produce el mismo JSON que el proveedor por defecto de Flask para lo que
+consume el front end: claves ordenadas, fechas en formato HTTP, Decimal y
+UUID como texto, dataclasses (records.py) como objetos. Los floats salen con
+la representación más corta que conserva el valor, igual que json.dumps
+(solo cambia la notación del exponente, p. ej. 1e-05 -> 1e-5, que JSON.parse
+lee igual). NaN e infinito salen como null: json.dumps los emitía como NaN /
+Infinity, que no es JSON válido y JSON.parse rechaza.
+
+Sin orjson, o si orjson no puede serializar un valor (p. ej. enteros de más
+de 64 bits), se usa el proveedor por defecto.
+"""
+import dataclasses
+import datetime
+import decimal
+import uuid
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # Dependencia opcional: sin ella se usa json de la biblioteca estándar
+    orjson = None
+
+
+def _default(value):
+    """Tipos que orjson no serializa por sí solo, convertidos como lo hace Flask."""
+    if isinstance(value, datetime.date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    if hasattr(value, 'item'):  # Escalares de NumPy
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider con orjson para dumps/loads y para las respuestas de jsonify."""
+
+    def _options(self, pretty: bool) -> int:
+        # Las fechas pasan por _default para mantener el formato HTTP de Flask
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def _dumps_bytes(self, obj, pretty: bool = False) -> bytes | None:
+        try:
+            return orjson.dumps(obj, default=_default, option=self._options(pretty))
+        except orjson.JSONEncodeError:
+            return None
+
+    def dumps(self, obj, **kwargs) -> str:
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        data = self._dumps_bytes(obj)
+        return data.decode() if data is not None else super().dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        data = self._dumps_bytes(obj, pretty)
+        if data is None:
+            return super().response(obj)
+        return self._app.response_class(data + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,133 @@
+# formula_arrays.py
+"""
+Representación columnar (NumPy) de las líneas de muchas fórmulas a la vez.
+Replica la matemática de calculations.py para poder evaluar lotes de fórmulas
+con operaciones de arreglos en lugar de bucles por línea.
+"""
+import numpy as np
+
+from calculations import CATEGORY_ORDER, DEFAULT_CATEGORY
+
+CATEGORIES = list(CATEGORY_ORDER)
+
+
+def _as_float(value) -> float:
+    """None / valores no numéricos -> 0.0, como el '... or 0' de calculations.py."""
+    return float(value) if isinstance(value, (int, float)) else 0.0
+
+
+def _as_limit(value) -> float:
+    """None -> NaN: un límite no definido nunca se incumple."""
+    return float(value) if isinstance(value, (int, float)) else np.nan
+
+
+class FormulaArrays:
+    """
+    Líneas de varias fórmulas aplanadas en arreglos paralelos.
+    'formula_idx' indica a qué fórmula (posición en 'formula_ids') pertenece cada línea.
+    """
+
+    def __init__(self, lines_by_formula: dict[int, list[dict]]):
+        self.formula_ids = list(lines_by_formula)
+        self.lines = [line for fid in self.formula_ids for line in lines_by_formula[fid]]
+        n_lines = len(self.lines)
+
+        # Las líneas de cada fórmula quedan contiguas: permite usar reduceat
+        counts = np.array([len(lines_by_formula[fid]) for fid in self.formula_ids], dtype=np.intp)
+        self.formula_idx = np.repeat(np.arange(len(self.formula_ids)), counts).astype(np.intp)
+        self._starts = (np.cumsum(counts) - counts)[counts > 0]
+        self._non_empty = counts > 0
+
+        quantity = np.empty(n_lines)
+        is_grams = np.empty(n_lines, dtype=bool)
+        self.protein = np.empty(n_lines)
+        self.fat = np.empty(n_lines)
+        self.water = np.empty(n_lines)
+        self.retention = np.empty(n_lines)
+        self.price = np.empty(n_lines)
+        self.min_usage = np.empty(n_lines)
+        self.max_usage = np.empty(n_lines)
+        self.category_idx = np.empty(n_lines, dtype=np.intp)
+        default_category = CATEGORIES.index(DEFAULT_CATEGORY)
+
+        for i, line in enumerate(self.lines):
+            quantity[i] = _as_float(line.get('quantity'))
+            unit = line.get('unit')
+            is_grams[i] = isinstance(unit, str) and unit.lower() == 'g'
+            self.protein[i] = _as_float(line.get('protein_percent'))
+            self.fat[i] = _as_float(line.get('fat_percent'))
+            self.water[i] = _as_float(line.get('water_percent'))
+            self.retention[i] = _as_float(line.get('water_retention_factor'))
+            self.price[i] = _as_float(line.get('precio_por_kg'))
+            self.min_usage[i] = _as_limit(line.get('min_usage_percent'))
+            self.max_usage[i] = _as_limit(line.get('max_usage_percent'))
+            categoria = line.get('categoria', DEFAULT_CATEGORY)
+            self.category_idx[i] = CATEGORIES.index(categoria) if categoria in CATEGORY_ORDER else default_category
+
+        self.quantity = quantity
+        self.is_grams = is_grams
+        # Mismo criterio que calculations.convert_to_kg
+        self.kg = np.where(is_grams, quantity / 1000.0, quantity)
+
+    @property
+    def n_formulas(self) -> int:
+        return len(self.formula_ids)
+
+    def per_formula_sum(self, values: np.ndarray) -> np.ndarray:
+        """Suma 'values' (uno por línea) agrupando por fórmula."""
+        return np.bincount(self.formula_idx, weights=values, minlength=self.n_formulas)
+
+    def totals(self, kg: np.ndarray | None = None,
+               protein: np.ndarray | None = None, fat: np.ndarray | None = None,
+               water: np.ndarray | None = None) -> dict[str, np.ndarray]:
+        """
+        Equivalente vectorizado de calculate_formula_totals para todas las fórmulas.
+        Los argumentos permiten sustituir columnas (p. ej. escenarios simulados);
+        admiten una dimensión extra al inicio para evaluar varios escenarios.
+        """
+        kg = self.kg if kg is None else kg
+        protein = self.protein if protein is None else protein
+        fat = self.fat if fat is None else fat
+        water = self.water if water is None else water
+
+        total_kg = self._group_sum(kg)
+        protein_kg = self._group_sum(kg * protein / 100.0)
+        fat_kg = self._group_sum(kg * fat / 100.0)
+        water_kg = self._group_sum(kg * water / 100.0)
+        costo_total = self._group_sum(kg * self.price)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            safe = total_kg > 0
+            protein_perc = np.where(safe, protein_kg / total_kg * 100.0, 0.0)
+            fat_perc = np.where(safe, fat_kg / total_kg * 100.0, 0.0)
+            water_perc = np.where(safe, water_kg / total_kg * 100.0, 0.0)
+            costo_por_kg = np.where(safe, costo_total / total_kg, 0.0)
+            water_protein = np.where(protein_perc > 0, water_perc / protein_perc, np.inf)
+            fat_protein = np.where(protein_perc > 0, fat_perc / protein_perc, np.inf)
+
+        return {
+            'total_kg': total_kg,
+            'protein_perc': protein_perc,
+            'fat_perc': fat_perc,
+            'water_perc': water_perc,
+            'costo_total': costo_total,
+            'costo_por_kg': costo_por_kg,
+            'aw_fp_ratio': water_protein,
+            'af_fp_ratio': fat_protein,
+        }
+
+    def line_percentages(self, kg: np.ndarray | None = None) -> np.ndarray:
+        """% de cada línea sobre el peso total de su fórmula."""
+        kg = self.kg if kg is None else kg
+        total_kg = self._group_sum(kg)
+        line_total = total_kg[..., self.formula_idx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(line_total > 0, kg / line_total * 100.0, 0.0)
+
+    def _group_sum(self, values: np.ndarray) -> np.ndarray:
+        """Como per_formula_sum, pero acepta dimensiones extra de escenarios al inicio."""
+        values = np.asarray(values, dtype=float)
+        out = np.zeros(values.shape[:-1] + (self.n_formulas,))
+        if len(self._starts):
+            out[..., self._non_empty] = np.add.reduceat(values, self._starts, axis=-1)
+        return out
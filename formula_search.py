@@ -0,0 +1,49 @@
+# formula_search.py
+"""
+Mantenimiento y consulta del índice de búsqueda por composición de fórmulas.
+Las tablas viven en la base de datos (formula_search_index y
+formula_line_search_index); aquí se calculan las entradas y se interpretan
+los filtros de la API.
+"""
+import calculations
+import subformulas
+
+# Fórmulas por lote al rellenar un índice incompleto (reindex_formulas.py)
+BACKFILL_BATCH = 500
+
+
+def build_entries(formulas: dict[int, dict], user_id: int, loader) -> list[dict]:
+    """
+    Calcula las entradas del índice para {formula_id: formula_data}.
+    'loader' resuelve las sub-fórmulas que no estén en 'formulas'.
+    """
+    entries = []
+    for formula_id, lines in subformulas.expand_bulk(formulas, user_id, loader).items():
+        processed = calculations.process_ingredients_for_display(lines)
+        totals = calculations.calculate_formula_totals(processed)
+        entry = {key: totals.get(key, 0) for key in calculations.COST_SUMMARY_KEYS}
+        entry['formula_id'] = formula_id
+        entry['lines'] = [(line['ingredient_name'], line['percentage']) for line in processed]
+        entries.append(entry)
+    return entries
+
+
+def parse_range(value: str) -> tuple[float | None, float | None]:
+    """
+    Interpreta 'min..max', 'min..' o '..max' (también un número solo = igualdad).
+    Lanza ValueError si el formato no es válido.
+    """
+    if '..' not in value:
+        number = float(value)
+        return number, number
+    low, high = value.split('..', 1)
+    return (float(low) if low.strip() else None, float(high) if high.strip() else None)
+
+
+def parse_ingredient_filter(value: str) -> tuple[str, float | None, float | None]:
+    """Interpreta 'Nombre:min..max' (el rango es opcional: 'Nombre' = la usa en cualquier %)."""
+    name, _, pct_range = value.rpartition(':') if ':' in value else (value, '', '')
+    if not name.strip():
+        raise ValueError(f"Filtro de ingrediente no válido: {value}")
+    low, high = parse_range(pct_range) if pct_range else (None, None)
+    return name.strip(), low, high
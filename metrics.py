@@ -0,0 +1,225 @@
+# metrics.py
+"""
+Métricas Prometheus de la aplicación (GET /metrics).
+
+Instrumentación:
+  - latencia por ruta (http_request_duration_seconds)
+  - llamadas, latencia y errores por función de database.py (db_call_*)
+  - espera para obtener conexión y conexiones en uso/libres por pool (db_pool_*)
+  - llamadas, reintentos y rechazos de retry_on_connection_error / OpenAI (resilience_*)
+  - latencia, tokens y errores de OpenAI (openai_*)
+  - operaciones de créditos (credit_operations_total, credits_total)
+
+Los contadores que ya llevan otros módulos (resilience.stats, cache, compresión,
+pools) se leen en cada scrape en lugar de duplicarse. Con varios workers de
+gunicorn hay que definir PROMETHEUS_MULTIPROC_DIR (directorio vacío al
+arrancar) para que /metrics sume los de todos los procesos, y llamar a
+prometheus_client.multiprocess.mark_process_dead(worker.pid) en el hook
+child_exit de gunicorn. Los contadores leídos en el scrape son los del worker
+que responde (llevan la etiqueta 'pid').
+
+Si prometheus_client no está instalado, la instrumentación no hace nada y
+/metrics responde 503.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Histogram
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:  # Dependencia opcional: sin ella no hay métricas
+    prometheus_client = None
+
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+# Si está definido, /metrics exige 'Authorization: Bearer <METRICS_TOKEN>'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+DB_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+AI_BUCKETS = (.25, .5, 1, 2, 4, 8, 15, 30, 60)
+
+
+class _NoopMetric:
+    """Sustituto de una métrica cuando prometheus_client no está instalado."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+
+def _metric(kind: str, name: str, documentation: str, labels: tuple, **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    cls = {'counter': Counter, 'histogram': Histogram}[kind]
+    return cls(name, documentation, labels, **kwargs)
+
+
+HTTP_REQUEST_DURATION = _metric('histogram', 'http_request_duration_seconds',
+                                "Duración de las peticiones HTTP por ruta", ('method', 'route', 'status'))
+DB_CALL_DURATION = _metric('histogram', 'db_call_duration_seconds',
+                           "Duración de las funciones de database.py (con reintentos)", ('function',),
+                           buckets=DB_BUCKETS)
+DB_CALL_ERRORS = _metric('counter', 'db_call_errors_total',
+                         "Funciones de database.py que terminaron con excepción", ('function', 'error'))
+DB_POOL_WAIT = _metric('histogram', 'db_pool_wait_seconds',
+                       "Espera para obtener una conexión del pool", ('pool',), buckets=DB_BUCKETS)
+AI_REQUEST_DURATION = _metric('histogram', 'openai_request_duration_seconds',
+                              "Duración de las llamadas a OpenAI (con reintentos)", ('model', 'outcome'),
+                              buckets=AI_BUCKETS)
+AI_TOKENS = _metric('counter', 'openai_tokens_total', "Tokens consumidos en OpenAI", ('model', 'kind'))
+AI_ERRORS = _metric('counter', 'openai_errors_total', "Llamadas a OpenAI fallidas", ('model', 'error'))
+CREDIT_OPERATIONS = _metric('counter', 'credit_operations_total',
+                            "Operaciones de créditos", ('operation', 'outcome'))
+CREDITS = _metric('counter', 'credits_total', "Créditos añadidos, descontados o expirados", ('operation',))
+
+
+def enabled() -> bool:
+    return prometheus_client is not None
+
+
+@contextmanager
+def db_call(function: str):
+    """Mide una llamada a una función de database.py."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        DB_CALL_ERRORS.labels(function, type(e).__name__).inc()
+        raise
+    finally:
+        DB_CALL_DURATION.labels(function).observe(time.perf_counter() - started)
+
+
+def observe_pool_wait(pool: str, seconds: float):
+    DB_POOL_WAIT.labels(pool).observe(seconds)
+
+
+class _AICall:
+    __slots__ = ('usage',)
+
+    def __init__(self):
+        self.usage = None
+
+
+@contextmanager
+def ai_call(model: str):
+    """Mide una llamada a OpenAI; quien llama asigna call.usage con el uso de tokens de la respuesta."""
+    call = _AICall()
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        AI_REQUEST_DURATION.labels(model, 'error').observe(time.perf_counter() - started)
+        AI_ERRORS.labels(model, type(e).__name__).inc()
+        raise
+    AI_REQUEST_DURATION.labels(model, 'ok').observe(time.perf_counter() - started)
+    if call.usage is not None:
+        AI_TOKENS.labels(model, 'prompt').inc(getattr(call.usage, 'prompt_tokens', 0) or 0)
+        AI_TOKENS.labels(model, 'completion').inc(getattr(call.usage, 'completion_tokens', 0) or 0)
+
+
+def credit_operation(operation: str, ok: bool, amount: int = 0):
+    CREDIT_OPERATIONS.labels(operation, 'ok' if ok else 'failed').inc()
+    if ok and amount:
+        CREDITS.labels(operation).inc(amount)
+
+
+class _SnapshotCollector:
+    """Expone en cada scrape los contadores que mantienen otros módulos."""
+
+    def collect(self):
+        import cache
+        import compression
+        import database
+        import resilience
+        pid = str(os.getpid())
+
+        pools = GaugeMetricFamily('db_pool_connections', "Conexiones del pool por estado",
+                                  labels=('pool', 'state', 'pid'))
+        for pool in database.pools():
+            for state, value in pool.stats().items():
+                pools.add_metric((pool.name, state, pid), value)
+        yield pools
+
+        events = CounterMetricFamily('resilience_events', "Llamadas, reintentos, agotados y rechazos por dependencia",
+                                     labels=('dependency', 'event', 'pid'))
+        for dependency, counts in resilience.stats.snapshot().items():
+            for event, value in counts.items():
+                events.add_metric((dependency, event, pid), value)
+        yield events
+
+        breakers = GaugeMetricFamily('circuit_breaker_open', "1 si el circuito está abierto",
+                                     labels=('breaker', 'pid'))
+        for name, snapshot in resilience.breakers_snapshot().items():
+            breakers.add_metric((name, pid), 1 if snapshot['state'] == 'open' else 0)
+        yield breakers
+
+        lookups = CounterMetricFamily('cache_lookups', "Consultas a la caché por resultado",
+                                      labels=('namespace', 'result', 'pid'))
+        for namespace, counts in cache.get_cache().stats.snapshot().items():
+            lookups.add_metric((namespace, 'hit', pid), counts['hits'])
+            lookups.add_metric((namespace, 'miss', pid), counts['misses'])
+        yield lookups
+
+        compressed = CounterMetricFamily('compressed_bytes', "Bytes de respuesta antes y después de comprimir",
+                                         labels=('encoding', 'stage', 'pid'))
+        for encoding, counts in compression.stats.snapshot().items():
+            compressed.add_metric((encoding, 'in', pid), counts['bytes_in'])
+            compressed.add_metric((encoding, 'out', pid), counts['bytes_out'])
+        yield compressed
+
+
+def render() -> tuple[bytes, str]:
+    """Cuerpo y Content-Type de la respuesta de /metrics."""
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_SnapshotCollector())
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def authorized(request) -> bool:
+    return not METRICS_TOKEN or request.headers.get('Authorization') == f"Bearer {METRICS_TOKEN}"
+
+
+def init_app(app):
+    """
+    Mide la latencia de cada petición por regla de ruta (no por URL, para no
+    crear una serie por id). Registrarla antes que compression.init_app para
+    que el tiempo de compresión quede incluido.
+    """
+    from flask import g, request
+
+    if prometheus_client is None:
+        return
+    if not MULTIPROCESS:
+        prometheus_client.REGISTRY.register(_SnapshotCollector())
+
+    def observe(status: int):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_DURATION.labels(request.method, route, str(status)).observe(time.perf_counter() - started)
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_response(response):
+        observe(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _observe_exception(exc):
+        if exc is not None:
+            observe(500)
@@ -0,0 +1,245 @@
+# profiling.py
+"""
+Perfilado bajo demanda de peticiones concretas, sin redesplegar.
+
+Una petición se perfila si:
+  - lleva 'X-Profile: sample' o 'X-Profile: cprofile' (o ?_profile=sample|cprofile)
+    y viene de un administrador: encabezado X-Profile-Token igual a
+    PROFILING_TOKEN, o sesión de un usuario listado en ADMIN_USERS; o
+  - su ruta está en PROFILE_ROUTES, p. ej.
+    PROFILE_ROUTES="/api/formula/<int:formula_id>=5,/api/formulas=1"
+    (porcentaje de peticiones de esa regla de ruta, con PROFILE_ROUTES_MODE).
+
+Modos:
+  sample    muestreo de la pila del hilo cada PROFILE_SAMPLE_INTERVAL_MS; se
+            guarda en formato 'folded' (flamegraph.pl, speedscope, inferno);
+            casi no añade coste, pero en peticiones de pocos milisegundos
+            apenas recoge muestras
+  cprofile  perfilado determinista con cProfile; se guarda como .pstats
+            (snakeviz, gprof2dot, flameprof)
+
+Los perfiles se guardan en PROFILE_DIR, que conserva los PROFILE_KEEP más
+recientes; la respuesta lleva el nombre del archivo en X-Profile-Id. Con
+'X-Profile-Output: inline' (o ?_profile_output=inline) la respuesta es el
+perfil en lugar del contenido normal; solo para administradores: en las
+peticiones muestreadas por PROFILE_ROUTES el resto recibe la respuesta normal.
+Como mucho PROFILE_MAX_CONCURRENT peticiones se perfilan a la vez en cada
+proceso; las demás se atienden sin perfilar (X-Profile-Skipped: busy).
+"""
+import collections
+import cProfile
+import datetime
+import logging
+import marshal
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+
+log = logging.getLogger(__name__)
+
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN')
+ADMIN_USERS = {u.strip().lower() for u in os.getenv('ADMIN_USERS', '').split(',') if u.strip()}
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join('/tmp', 'formulador-profiles'))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '200'))
+PROFILE_MAX_CONCURRENT = int(os.getenv('PROFILE_MAX_CONCURRENT', '1'))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '1'))
+PROFILE_ROUTES_MODE = os.getenv('PROFILE_ROUTES_MODE', 'sample')
+MODES = ('sample', 'cprofile')
+EXTENSIONS = {'sample': 'folded', 'cprofile': 'pstats'}
+
+
+def _parse_routes(text: str) -> dict:
+    """'/ruta=5,/otra=0.5' -> {'/ruta': 0.05, '/otra': 0.005}"""
+    routes = {}
+    for part in text.split(','):
+        rule, _, percent = part.strip().rpartition('=')
+        if rule:
+            routes[rule] = max(0.0, min(100.0, float(percent))) / 100.0
+    return routes
+
+
+PROFILE_ROUTES = _parse_routes(os.getenv('PROFILE_ROUTES', ''))
+_slots = threading.BoundedSemaphore(PROFILE_MAX_CONCURRENT)
+
+
+class StackSampler:
+    """Muestrea la pila de un hilo desde otro hilo y cuenta las pilas iguales."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def folded(self) -> bytes:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.counts.most_common()).encode()
+
+
+class Profile:
+    """Un perfil en curso: se inicia y se detiene en el mismo hilo de la petición."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.started = datetime.datetime.now()
+        if mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL_MS / 1000.0)
+            self._profiler.start()
+
+    def stop(self) -> bytes:
+        if self.mode == 'cprofile':
+            self._profiler.disable()
+            self._profiler.create_stats()
+            # Mismo formato que cProfile.Profile.dump_stats (lo lee pstats.Stats)
+            return marshal.dumps(self._profiler.stats)
+        self._profiler.stop()
+        return self._profiler.folded()
+
+
+def try_start(mode: str) -> Profile | None:
+    """Perfil nuevo, o None si ya hay PROFILE_MAX_CONCURRENT en curso en este proceso."""
+    if not _slots.acquire(blocking=False):
+        return None
+    try:
+        return Profile(mode)
+    except Exception:
+        _slots.release()
+        raise
+
+
+def finish(profile: Profile, label: str) -> str | None:
+    """Detiene el perfil, lo guarda en PROFILE_DIR y devuelve el nombre del archivo."""
+    try:
+        data = profile.stop()
+    finally:
+        _slots.release()
+    return save(data, profile, label)
+
+
+def save(data: bytes, profile: Profile, label: str) -> str | None:
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_')[:80]
+    name = f"{profile.started:%Y%m%d-%H%M%S-%f}-{os.getpid()}-{slug}.{EXTENSIONS[profile.mode]}"
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, name), 'wb') as f:
+            f.write(data)
+        _rotate()
+    except OSError as e:
+        log.error(f"No se pudo guardar el perfil {name}: {e}")
+        return None
+    return name
+
+
+def _rotate():
+    profiles = list_profiles()
+    for name in profiles[PROFILE_KEEP:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
+
+
+def list_profiles() -> list[str]:
+    """Perfiles guardados, del más reciente al más antiguo."""
+    try:
+        names = [n for n in os.listdir(PROFILE_DIR) if n.rsplit('.', 1)[-1] in EXTENSIONS.values()]
+    except FileNotFoundError:
+        return []
+    return sorted(names, reverse=True)
+
+
+def is_admin(request, user) -> bool:
+    token = request.headers.get('X-Profile-Token')
+    if PROFILING_TOKEN and token and secrets.compare_digest(token, PROFILING_TOKEN):
+        return True
+    return bool(ADMIN_USERS) and getattr(user, 'is_authenticated', False) and \
+        (getattr(user, 'username', '') or '').lower() in ADMIN_USERS
+
+
+def _requested_mode(request) -> str | None:
+    mode = (request.headers.get('X-Profile') or request.args.get('_profile') or '').strip().lower()
+    if not mode:
+        return None
+    return mode if mode in MODES else 'sample'
+
+
+def _inline(request) -> bool:
+    return (request.headers.get('X-Profile-Output') or request.args.get('_profile_output')) == 'inline'
+
+
+def init_app(app):
+    """Arranca el perfil en before_request y lo cierra en after_request (o en teardown si hubo excepción)."""
+    from flask import g, request
+    from flask_login import current_user
+
+    @app.before_request
+    def _start_profile():
+        mode = _requested_mode(request)
+        if mode is not None and not is_admin(request, current_user):
+            mode = None
+        if mode is None and request.url_rule is not None:
+            rate = PROFILE_ROUTES.get(request.url_rule.rule)
+            if rate and random.random() < rate:
+                mode = PROFILE_ROUTES_MODE if PROFILE_ROUTES_MODE in MODES else 'sample'
+        if mode is None:
+            return
+        profile = try_start(mode)
+        if profile is None:
+            g._profile_skipped = True
+            return
+        g._profile = profile
+
+    @app.after_request
+    def _finish_profile(response):
+        if g.pop('_profile_skipped', False):
+            response.headers['X-Profile-Skipped'] = 'busy'
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return response
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        name = finish(profile, f"{request.method} {rule}")
+        if name is None:
+            return response
+        response.headers['X-Profile-Id'] = name
+        # El perfil expone rutas de módulos y nombres de funciones: solo para administradores
+        if _inline(request) and is_admin(request, current_user):
+            with open(os.path.join(PROFILE_DIR, name), 'rb') as f:
+                data = f.read()
+            mimetype = 'text/plain' if profile.mode == 'sample' else 'application/octet-stream'
+            inline = app.response_class(data, mimetype=mimetype)
+            inline.headers['X-Profile-Id'] = name
+            inline.headers['X-Profiled-Status'] = str(response.status_code)
+            inline.headers['Content-Disposition'] = f'attachment; filename="{name}"'
+            return inline
+        return response
+
+    @app.teardown_request
+    def _abort_profile(exc):
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            rule = request.url_rule.rule if request.url_rule is not None else request.path
+            finish(profile, f"{request.method} {rule} error")
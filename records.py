@@ -0,0 +1,112 @@
+# records.py
+"""
+Registros compactos para las líneas y totales de fórmula.
+
+Son dataclasses con __slots__ (sin un dict por instancia) que se construyen
+directamente desde las tuplas del cursor. Para no obligar a cambiar todo el
+código que ya los recibe como dicts, admiten también la lectura estilo
+mapping (r['campo'], r.get('campo'), dict(r), {**r}). Se convierten a JSON
+solo al responder: Flask serializa las dataclasses y cache.py también.
+"""
+from dataclasses import dataclass, fields
+
+
+class _MappingAccess:
+    """Lectura de solo lectura tipo dict sobre los campos de la dataclass."""
+
+    __slots__ = ()
+
+    @classmethod
+    def keys(cls) -> tuple[str, ...]:
+        return cls.FIELDS
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __contains__(self, key) -> bool:
+        return key in self.FIELDS
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in self.FIELDS else default
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.FIELDS]
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+def _with_field_names(cls):
+    cls.FIELDS = tuple(f.name for f in fields(cls))
+    return cls
+
+
+@_with_field_names
+@dataclass(slots=True)
+class FormulaLine(_MappingAccess):
+    """
+    Línea de ingrediente de una fórmula con los datos del ingrediente.
+    El orden de los campos es el de database.FORMULA_LINE_COLUMNS.
+    """
+    formula_ingredient_id: int
+    formula_id: int
+    ingredient_id: int | None
+    quantity: float
+    unit: str
+    ingredient_name: str
+    protein_percent: float | None = None
+    fat_percent: float | None = None
+    water_percent: float | None = None
+    ve_protein_percent: float | None = None
+    notes: str | None = None
+    water_retention_factor: float | None = None
+    min_usage_percent: float | None = None
+    max_usage_percent: float | None = None
+    precio_por_kg: float | None = None
+    categoria: str | None = None
+    sub_formula_id: int | None = None
+
+
+@_with_field_names
+@dataclass(slots=True)
+class ProcessedLine(_MappingAccess):
+    """Línea calculada por calculations.process_ingredients_for_display."""
+    formula_ingredient_id: int
+    sub_formula_id: int | None
+    ingredient_name: str
+    original_qty_display: str
+    original_unit: str
+    kg_total: float
+    percentage: float
+    kg_protein: float
+    kg_fat: float
+    kg_water: float
+    water_retention_factor: float
+    costo_linea: float
+    sort_order: int
+
+
+@_with_field_names
+@dataclass(slots=True)
+class FormulaTotals(_MappingAccess):
+    """Totales de una fórmula (calculations.calculate_formula_totals)."""
+    total_kg: float = 0
+    total_protein_kg: float = 0
+    total_fat_kg: float = 0
+    total_water_kg: float = 0
+    total_retained_water_kg: float = 0
+    protein_perc: float = 0
+    fat_perc: float = 0
+    water_perc: float = 0
+    costo_total: float = 0
+    costo_por_kg: float = 0
+    aw_fp_ratio_str: str = 'N/A'
+    af_fp_ratio_str: str = 'N/A'
+
+
+def formula_lines(rows) -> list[FormulaLine]:
+    """Construye las líneas desde filas-tupla en el orden de FORMULA_LINE_COLUMNS."""
+    return [FormulaLine(*row) for row in rows]
@@ -0,0 +1,36 @@
+# reindex_formulas.py
+"""
+Rellena el índice de búsqueda por composición con las fórmulas que aún no
+están en él (las creadas antes de que existiera el índice). Las rutas que
+modifican fórmulas ya mantienen el índice al día; este script solo hace falta
+una vez tras la migración. Se puede repetir sin riesgo.
+
+    python reindex_formulas.py
+"""
+import database
+import formula_search
+
+
+def run_backfill():
+    print("--- RELLENANDO EL ÍNDICE DE BÚSQUEDA DE FÓRMULAS ---")
+    database.initialize_database()
+    missing = database.get_unindexed_formula_ids()
+    total = 0
+    for user_id, formula_ids in missing.items():
+        for start in range(0, len(formula_ids), formula_search.BACKFILL_BATCH):
+            batch = formula_ids[start:start + formula_search.BACKFILL_BATCH]
+            formulas = database.get_formulas_bulk(batch, user_id)
+            try:
+                entries = formula_search.build_entries(formulas, user_id, database.get_formula_by_id)
+            except ValueError as e:  # p. ej. un ciclo de sub-fórmulas
+                print(f"No se pudo indexar un lote del usuario {user_id}: {e}")
+                continue
+            if not database.upsert_formula_search_index(user_id, entries):
+                print(f"No se pudo indexar un lote de {len(batch)} fórmulas del usuario {user_id}.")
+                continue
+            total += len(entries)
+    print(f"\n¡ÍNDICE COMPLETO! {total} fórmulas indexadas de {len(missing)} usuarios.")
+
+
+if __name__ == "__main__":
+    run_backfill()
@@ -0,0 +1,284 @@
+# resilience.py
+"""
+Política única de reintentos para dependencias externas (PostgreSQL, OpenAI).
+
+  - Presupuesto por petición: cada petición HTTP tiene un plazo (deadline);
+    ningún reintento espera más allá de él.
+  - Espera exponencial con jitter completo, para que los workers no reintenten
+    todos a la vez tras un corte.
+  - Clasificación de errores: solo se reintenta lo transitorio.
+  - Circuit breaker: tras varios fallos seguidos se deja de intentar durante
+    un tiempo y se falla al instante (CircuitOpenError).
+  - Bulkhead: tope de llamadas concurrentes a una dependencia lenta.
+  - Contadores de intentos, reintentos y rechazos por dependencia.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Clasificación de un error para call_with_retry
+TRANSIENT = 'transient'    # Se reintenta y cuenta como fallo de la dependencia (conexión caída)
+CONTENTION = 'contention'  # Se reintenta pero la dependencia está sana (deadlock, serialización)
+
+_deadline = ContextVar('resilience_deadline', default=None)
+_retry_scopes = ContextVar('resilience_retry_scopes', default=frozenset())
+
+
+class CircuitOpenError(Exception):
+    """La dependencia está marcada como caída; no se intenta la llamada."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito '{name}' abierto; reintentar en {retry_after:.1f}s.")
+        self.name = name
+        self.retry_after = retry_after
+
+
+# --- Plazo por petición ---
+
+def set_deadline(seconds: float | None):
+    """Fija el plazo de la petición actual (None = sin plazo)."""
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def clear_deadline():
+    _deadline.set(None)
+
+
+def remaining() -> float | None:
+    """Segundos que quedan del plazo actual, o None si no hay plazo."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    """
+    closed -> open tras 'failure_threshold' fallos seguidos; open -> half_open
+    pasados 'reset_timeout' segundos; en half_open se deja pasar una llamada de
+    prueba: si funciona se cierra, si falla vuelve a abrirse.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 15.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = 'half_open'
+            self._probe_in_flight = False
+        return self._state
+
+    def before_call(self):
+        """Lanza CircuitOpenError si la llamada no debe intentarse."""
+        with self._lock:
+            state = self._current_state()
+            if state == 'closed':
+                return
+            if state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            retry_after = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self._state = 'closed'
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == 'half_open' or self._failures >= self.failure_threshold:
+                if self._state != 'open':
+                    self.times_opened += 1
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        """Segundos hasta la próxima llamada de prueba (0 si el circuito no está abierto)."""
+        with self._lock:
+            if self._current_state() != 'open':
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            state = self._current_state()
+            snapshot = {'state': state, 'consecutive_failures': self._failures, 'times_opened': self.times_opened}
+        snapshot['retry_after'] = round(self.retry_after(), 1) if state == 'open' else 0.0
+        return snapshot
+
+
+# --- Bulkhead ---
+
+class BulkheadFullError(Exception):
+    """No quedan plazas libres para llamar a la dependencia."""
+
+    def __init__(self, name: str):
+        super().__init__(f"Límite de llamadas concurrentes a '{name}' alcanzado.")
+        self.name = name
+
+
+class Bulkhead:
+    """
+    Limita las llamadas concurrentes a una dependencia lenta para que no ocupe
+    todos los hilos del worker. Si no hay plaza en 'max_wait' segundos, falla.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_wait: float = 0.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._rejected = 0
+
+    @contextmanager
+    def slot(self):
+        """Ocupa una plaza durante el bloque 'with'; lanza BulkheadFullError si no la hay."""
+        if self.max_wait > 0:
+            acquired = self._semaphore.acquire(timeout=self.max_wait)
+        else:
+            acquired = self._semaphore.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                self._rejected += 1
+            raise BulkheadFullError(self.name)
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'max_concurrent': self.max_concurrent, 'in_use': self._in_use, 'rejected': self._rejected}
+
+
+# --- Política de reintentos ---
+
+class RetryPolicy:
+    """Parámetros de reintento: intentos, espera base/máxima y tope de tiempo total."""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.1, max_delay: float = 2.0,
+                 max_elapsed: float = 10.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+
+    def backoff(self, attempt: int) -> float:
+        """Espera antes del reintento 'attempt' (0, 1, ...) con jitter completo."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class RetryStats:
+    """Contadores por dependencia: llamadas, reintentos, agotados y rechazos del breaker."""
+
+    FIELDS = ('calls', 'retries', 'exhausted', 'rejected')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def add(self, name: str, field: str, amount: int = 1):
+        with self._lock:
+            counts = self._counts.setdefault(name, dict.fromkeys(self.FIELDS, 0))
+            counts[field] += amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+
+stats = RetryStats()
+_breakers = {}
+
+
+def register_breaker(breaker: CircuitBreaker) -> CircuitBreaker:
+    _breakers[breaker.name] = breaker
+    return breaker
+
+
+def breakers_snapshot() -> dict:
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
+
+
+@contextmanager
+def _retry_scope(name: str):
+    token = _retry_scopes.set(_retry_scopes.get() | {name})
+    try:
+        yield
+    finally:
+        _retry_scopes.reset(token)
+
+
+def call_with_retry(func, name: str, policy: RetryPolicy, breaker: CircuitBreaker | None, classify):
+    """
+    Ejecuta func() con la política. 'classify(exc)' devuelve TRANSIENT, CONTENTION o
+    None (no reintentable). Las llamadas anidadas a la misma dependencia no reintentan
+    por su cuenta: solo la más externa, para que los reintentos no se multipliquen.
+    Lanza la última excepción al agotar intentos/plazo, o CircuitOpenError.
+    """
+    if name in _retry_scopes.get():
+        return func()
+
+    stats.add(name, 'calls')
+    started = time.monotonic()
+    attempt = 0
+    with _retry_scope(name):
+        while True:
+            if breaker is not None:
+                try:
+                    breaker.before_call()
+                except CircuitOpenError:
+                    stats.add(name, 'rejected')
+                    raise
+            try:
+                result = func()
+            except Exception as e:
+                kind = classify(e)
+                if breaker is not None:
+                    # Un error no transitorio significa que la dependencia respondió
+                    if kind == TRANSIENT:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                if kind is None:
+                    raise
+                delay = policy.backoff(attempt)
+                attempt += 1
+                budget = remaining()
+                elapsed = time.monotonic() - started
+                if (attempt >= policy.attempts
+                        or elapsed + delay > policy.max_elapsed
+                        or (budget is not None and delay >= budget)):
+                    stats.add(name, 'exhausted')
+                    raise
+                stats.add(name, 'retries')
+                time.sleep(delay)
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
@@ -0,0 +1,182 @@
+# rules.py
+"""
+Reglas de formulación declarativas evaluadas en lote con NumPy.
+
+Tres niveles de reglas:
+  - Por ingrediente: min_usage_percent / max_usage_percent guardados en cada ingrediente.
+  - Por categoría (CATEGORY_ORDER): % total mínimo/máximo de la categoría en la fórmula.
+  - Por tipo de producto: límites de proteína, grasa y ratios agua/proteína y grasa/proteína.
+
+Las premezclas y salmueras (tipo 'premezcla') no son producto terminado: no
+llevan cárnico ni proteína por diseño, así que para ellas no se evalúa ninguno
+de los tres niveles.
+"""
+import numpy as np
+
+import tracing
+from formula_arrays import FormulaArrays, CATEGORIES
+
+# % de la fórmula que puede ocupar cada categoría. Ausente = sin límite.
+# Un tipo de producto puede sustituirlas con su propia clave 'category_rules'.
+CATEGORY_RULES = {
+    "Cárnico": {'min_percent': 40.0},
+    "Agua/Hielo": {'max_percent': 35.0},
+    "Retenedor/No Cárnico": {'max_percent': 15.0},
+    "Condimento/Aditivo": {'max_percent': 5.0},
+    "Colorante": {'max_percent': 0.5},
+}
+
+# El tipo se deduce del nombre del producto (primera coincidencia de 'keywords').
+# 'general' no tiene palabras clave y se usa cuando no coincide ninguno.
+# Una fórmula usada como sub-fórmula de otra es siempre 'premezcla'.
+PREMIX_TYPE = 'premezcla'
+PRODUCT_TYPE_RULES = {
+    PREMIX_TYPE: {
+        'keywords': ('salmuera', 'premezcla', 'premix', 'marinada', 'inyección', 'inyeccion'),
+        'category_rules': {},
+        'ingredient_usage': False,
+    },
+    'salchicha': {
+        'keywords': ('salchicha', 'hot dog', 'frankfurt', 'viena'),
+        'protein_min': 10.0, 'fat_max': 30.0, 'water_protein_max': 5.0, 'fat_protein_max': 3.0,
+    },
+    'mortadela': {
+        'keywords': ('mortadela', 'bologna'),
+        'protein_min': 10.0, 'fat_max': 30.0, 'water_protein_max': 5.5, 'fat_protein_max': 3.0,
+    },
+    'jamon': {
+        'keywords': ('jamón', 'jamon'),
+        'protein_min': 14.0, 'fat_max': 12.0, 'water_protein_max': 4.5, 'fat_protein_max': 1.0,
+    },
+    'chorizo': {
+        'keywords': ('chorizo', 'longaniza'),
+        'protein_min': 12.0, 'fat_max': 35.0, 'water_protein_max': 4.5, 'fat_protein_max': 3.0,
+    },
+    'general': {
+        'keywords': (),
+        'protein_min': 8.0, 'fat_max': 35.0, 'water_protein_max': 6.0, 'fat_protein_max': 3.5,
+    },
+}
+
+PRODUCT_LIMIT_KEYS = ('protein_min', 'fat_max', 'water_protein_max', 'fat_protein_max')
+
+
+def product_type_for(product_name: str | None) -> str:
+    """Deduce el tipo de producto a partir de su nombre."""
+    name = (product_name or '').lower()
+    for product_type, rule in PRODUCT_TYPE_RULES.items():
+        if any(keyword in name for keyword in rule['keywords']):
+            return product_type
+    return 'general'
+
+
+def _category_limits(types: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Límites por categoría de cada fórmula según su tipo, de forma (fórmulas, categorías)."""
+    def limits(product_type, key):
+        category_rules = PRODUCT_TYPE_RULES[product_type].get('category_rules', CATEGORY_RULES)
+        return [category_rules.get(c, {}).get(key, np.nan) for c in CATEGORIES]
+
+    mins = np.array([limits(t, 'min_percent') for t in types], dtype=float).reshape(len(types), len(CATEGORIES))
+    maxs = np.array([limits(t, 'max_percent') for t in types], dtype=float).reshape(len(types), len(CATEGORIES))
+    return mins, maxs
+
+
+def evaluate_formulas(lines_by_formula: dict[int, list[dict]],
+                      product_names: dict[int, str] | None = None,
+                      premix_ids: set[int] | None = None) -> dict[int, list[dict]]:
+    """
+    Evalúa todas las reglas sobre un lote de fórmulas.
+    'premix_ids': fórmulas usadas como sub-fórmula, que se evalúan como 'premezcla'.
+    Devuelve {formula_id: [violaciones]}; una fórmula sin problemas tiene lista vacía.
+    Cada violación es {'rule', 'target', 'value', 'limit', 'message'}.
+    """
+    product_names = product_names or {}
+    premix_ids = premix_ids or set()
+    arrays = FormulaArrays(lines_by_formula)
+    n = arrays.n_formulas
+    violations = {fid: [] for fid in arrays.formula_ids}
+    if n == 0:
+        return violations
+
+    totals = arrays.totals()
+    line_pct = arrays.line_percentages()
+    has_weight = totals['total_kg'] > 0
+    types = [PREMIX_TYPE if fid in premix_ids else product_type_for(product_names.get(fid))
+             for fid in arrays.formula_ids]
+
+    # --- Reglas por ingrediente (uso mínimo/máximo) ---
+    checks_usage = np.array([PRODUCT_TYPE_RULES[t].get('ingredient_usage', True) for t in types], dtype=bool)
+    line_has_weight = (has_weight & checks_usage)[arrays.formula_idx]
+    with np.errstate(invalid='ignore'):
+        below = line_has_weight & (line_pct < arrays.min_usage)
+        above = line_has_weight & (line_pct > arrays.max_usage)
+    for i in np.flatnonzero(below):
+        _add(violations, arrays, arrays.formula_idx[i], 'ingredient_min_usage',
+             arrays.lines[i].get('ingredient_name'), line_pct[i], arrays.min_usage[i],
+             "{target}: {value:.2f}% por debajo del uso mínimo ({limit:.2f}%)")
+    for i in np.flatnonzero(above):
+        _add(violations, arrays, arrays.formula_idx[i], 'ingredient_max_usage',
+             arrays.lines[i].get('ingredient_name'), line_pct[i], arrays.max_usage[i],
+             "{target}: {value:.2f}% supera el uso máximo ({limit:.2f}%)")
+
+    # --- Reglas por categoría ---
+    n_cat = len(CATEGORIES)
+    category_pct = np.bincount(
+        arrays.formula_idx * n_cat + arrays.category_idx, weights=line_pct, minlength=n * n_cat
+    ).reshape(n, n_cat)
+    cat_min, cat_max = _category_limits(types)
+    with np.errstate(invalid='ignore'):
+        cat_below = has_weight[:, None] & (category_pct < cat_min)
+        cat_above = has_weight[:, None] & (category_pct > cat_max)
+    for f, c in zip(*np.nonzero(cat_below)):
+        _add(violations, arrays, f, 'category_min', CATEGORIES[c], category_pct[f, c], cat_min[f, c],
+             "Categoría {target}: {value:.2f}% por debajo del mínimo ({limit:.2f}%)")
+    for f, c in zip(*np.nonzero(cat_above)):
+        _add(violations, arrays, f, 'category_max', CATEGORIES[c], category_pct[f, c], cat_max[f, c],
+             "Categoría {target}: {value:.2f}% supera el máximo ({limit:.2f}%)")
+
+    # --- Reglas por tipo de producto ---
+    limits = {
+        key: np.array([PRODUCT_TYPE_RULES[t].get(key, np.nan) for t in types])
+        for key in PRODUCT_LIMIT_KEYS
+    }
+    checks = (
+        ('protein_min', totals['protein_perc'], totals['protein_perc'] < limits['protein_min'],
+         "Proteína {value:.2f}% por debajo del mínimo ({limit:.2f}%) para {target}"),
+        ('fat_max', totals['fat_perc'], totals['fat_perc'] > limits['fat_max'],
+         "Grasa {value:.2f}% supera el máximo ({limit:.2f}%) para {target}"),
+        ('water_protein_max', totals['aw_fp_ratio'], totals['aw_fp_ratio'] > limits['water_protein_max'],
+         "Ratio agua/proteína {value:.2f} supera el máximo ({limit:.2f}) para {target}"),
+        ('fat_protein_max', totals['af_fp_ratio'], totals['af_fp_ratio'] > limits['fat_protein_max'],
+         "Ratio grasa/proteína {value:.2f} supera el máximo ({limit:.2f}) para {target}"),
+    )
+    for rule, values, mask, message in checks:
+        # Sin proteína los ratios son infinitos: ya lo reporta 'protein_min'
+        for f in np.flatnonzero(mask & has_weight & np.isfinite(values)):
+            _add(violations, arrays, f, rule, types[f], values[f], limits[rule][f], message)
+
+    return violations
+
+
+@tracing.traced('calc.validate_formula')
+def validate_formula(formula_data: dict, is_premix: bool = False) -> list[dict]:
+    """Valida una sola fórmula (formato de database.get_formula_by_id); is_premix si se usa como sub-fórmula."""
+    formula_id = formula_data.get('id')
+    result = evaluate_formulas(
+        {formula_id: formula_data.get('ingredients', [])},
+        {formula_id: formula_data.get('product_name')},
+        {formula_id} if is_premix else None,
+    )
+    return result[formula_id]
+
+
+def _add(violations, arrays, f, rule, target, value, limit, message):
+    value = float(value)
+    limit = float(limit)
+    violations[arrays.formula_ids[f]].append({
+        'rule': rule,
+        'target': target,
+        'value': value,
+        'limit': limit,
+        'message': message.format(target=target, value=value, limit=limit),
+    })
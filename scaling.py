@@ -0,0 +1,112 @@
+# scaling.py
+"""
+Escalado de fórmulas a tamaños de lote reales (mezcladora, cutter).
+Calcula las cantidades redondeadas de cada línea para uno o varios pesos de
+lote a la vez, con arreglos NumPy de forma (lotes, líneas).
+"""
+import math
+
+import numpy as np
+
+from calculations import convert_to_kg
+
+# Paso de redondeo por defecto, expresado en la unidad de la línea
+DEFAULT_STEPS = {'g': 1.0, 'kg': 0.01}
+MAX_BATCHES = 200
+
+
+def _line_rounding(line: dict, rounding: dict) -> tuple[str, float]:
+    """Unidad y paso de redondeo de una línea: regla propia > 'default' > unidad original."""
+    rule = rounding.get(str(line.get('formula_ingredient_id'))) or rounding.get('default') or {}
+    if not isinstance(rule, dict):
+        raise ValueError("Cada regla de redondeo debe ser un objeto con 'unit' y/o 'step'.")
+    unit = rule.get('unit') or line.get('original_unit') or 'kg'
+    if not isinstance(unit, str):
+        raise ValueError("La unidad de redondeo debe ser un texto.")
+    unit = unit.lower()
+    if unit not in DEFAULT_STEPS:
+        raise ValueError(f"Unidad no soportada: {unit}")
+    step = float(rule.get('step', DEFAULT_STEPS[unit]))
+    if not math.isfinite(step):
+        raise ValueError("El paso de redondeo debe ser un número finito.")
+    if step <= 0:
+        raise ValueError("El paso de redondeo debe ser mayor que cero.")
+    return unit, step
+
+
+def scale_formula(processed_ingredients: list[dict], batch_weights_kg: list[float],
+                  rounding: dict | None = None) -> list[dict]:
+    """
+    Escala las líneas (formato de process_ingredients_for_display) a cada peso de lote.
+
+    Cada línea se redondea hacia abajo a su paso y el peso que falta se reparte,
+    un paso cada vez, entre las líneas con mayor resto (método del mayor resto).
+    Así el total queda lo más cerca posible del lote pedido y los porcentajes
+    lo más cerca posible de los originales.
+    """
+    rounding = rounding or {}
+    if not isinstance(rounding, dict):
+        raise ValueError("'rounding' debe ser un objeto {formula_ingredient_id | 'default': regla}.")
+    targets = np.asarray(batch_weights_kg, dtype=float)
+    if targets.ndim != 1 or len(targets) == 0:
+        raise ValueError("Se requiere al menos un peso de lote.")
+    if len(targets) > MAX_BATCHES:
+        raise ValueError(f"Máximo {MAX_BATCHES} lotes por solicitud.")
+    if not np.all(np.isfinite(targets)):
+        raise ValueError("Los pesos de lote deben ser números finitos.")
+    if np.any(targets <= 0):
+        raise ValueError("Los pesos de lote deben ser mayores que cero.")
+
+    line_kg = np.array([line.get('kg_total', 0) or 0 for line in processed_ingredients], dtype=float)
+    total_kg = line_kg.sum()
+    if total_kg <= 0:
+        raise ValueError("La fórmula no tiene peso para escalar.")
+
+    units, steps = zip(*(_line_rounding(line, rounding) for line in processed_ingredients))
+    step_kg = np.array([convert_to_kg(step, unit) for unit, step in zip(units, steps)])
+    share = line_kg / total_kg
+
+    # (lotes, líneas)
+    exact = targets[:, None] * share[None, :]
+    steps_down = np.floor(exact / step_kg + 1e-9)
+    floored = steps_down * step_kg
+    deficit = targets - floored.sum(axis=1)
+
+    # Orden de prioridad: mayor fracción de paso pendiente primero
+    fraction = (exact - floored) / step_kg
+    order = np.argsort(-fraction, axis=1, kind='stable')
+    sorted_steps = step_kg[order]
+    added = np.concatenate([np.zeros((len(targets), 1)), np.cumsum(sorted_steps, axis=1)], axis=1)
+    # Número de líneas a subir un paso: el que deja el total más cerca del objetivo
+    k = np.abs(deficit[:, None] - added).argmin(axis=1)
+    rank = np.argsort(order, axis=1)
+    rounded_kg = floored + (rank < k[:, None]) * step_kg
+
+    rounded_total = rounded_kg.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rounded_pct = np.where(rounded_total[:, None] > 0, rounded_kg / rounded_total[:, None] * 100.0, 0.0)
+    original_pct = share * 100.0
+    deviation = rounded_pct - original_pct[None, :]
+    # Cantidad en la unidad de cada línea
+    in_grams = np.array([unit == 'g' for unit in units])
+    display_qty = np.where(in_grams[None, :], rounded_kg * 1000.0, rounded_kg)
+
+    batches = []
+    for b, target in enumerate(targets):
+        batches.append({
+            'batch_kg': float(target),
+            'total_kg': float(rounded_total[b]),
+            'max_deviation_pct': float(np.abs(deviation[b]).max()),
+            'lines': [
+                {
+                    'formula_ingredient_id': line.get('formula_ingredient_id'),
+                    'ingredient_name': line.get('ingredient_name'),
+                    'quantity': round(float(display_qty[b, i]), 6),
+                    'unit': units[i],
+                    'percentage': float(rounded_pct[b, i]),
+                    'original_percentage': float(original_pct[i]),
+                }
+                for i, line in enumerate(processed_ingredients)
+            ],
+        })
+    return batches
@@ -97,14 +97,49 @@ ALTER SEQUENCE public.bibliografia_id_seq OWNED BY public.bibliografia.id;
 CREATE TABLE public.formula_ingredients (
     id integer NOT NULL,
     formula_id integer NOT NULL,
-    ingredient_id integer NOT NULL,
+    ingredient_id integer,
     quantity real NOT NULL,
-    unit text NOT NULL
+    unit text NOT NULL,
+    sub_formula_id integer,
+    CONSTRAINT formula_ingredients_line_target_check CHECK (((ingredient_id IS NULL) <> (sub_formula_id IS NULL)))
 );
 
 
 ALTER TABLE public.formula_ingredients OWNER TO formulador_db_user;
 
+--
+-- Name: formula_line_search_index; Type: TABLE; Schema: public; Owner: formulador_db_user
+--
+
+CREATE TABLE public.formula_line_search_index (
+    formula_id integer NOT NULL,
+    user_id integer NOT NULL,
+    ingredient_name text NOT NULL,
+    percentage real NOT NULL
+);
+
+
+ALTER TABLE public.formula_line_search_index OWNER TO formulador_db_user;
+
+--
+-- Name: formula_search_index; Type: TABLE; Schema: public; Owner: formulador_db_user
+--
+
+CREATE TABLE public.formula_search_index (
+    formula_id integer NOT NULL,
+    user_id integer NOT NULL,
+    total_kg real,
+    protein_perc real,
+    fat_perc real,
+    water_perc real,
+    costo_total real,
+    costo_por_kg real,
+    updated_at timestamp without time zone DEFAULT now()
+);
+
+
+ALTER TABLE public.formula_search_index OWNER TO formulador_db_user;
+
 --
 -- Name: formula_ingredients_id_seq; Type: SEQUENCE; Schema: public; Owner: formulador_db_user
 --
@@ -136,7 +171,8 @@ CREATE TABLE public.formulas (
     product_name text NOT NULL,
     description text,
     creation_date text NOT NULL,
-    user_id integer
+    user_id integer,
+    revision integer DEFAULT 0 NOT NULL
 );
 
 
@@ -329,6 +365,14 @@ ALTER TABLE ONLY public.formula_ingredients
     ADD CONSTRAINT formula_ingredients_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: formula_search_index formula_search_index_pkey; Type: CONSTRAINT; Schema: public; Owner: formulador_db_user
+--
+
+ALTER TABLE ONLY public.formula_search_index
+    ADD CONSTRAINT formula_search_index_pkey PRIMARY KEY (formula_id);
+
+
 --
 -- Name: formulas formulas_pkey; Type: CONSTRAINT; Schema: public; Owner: formulador_db_user
 --
@@ -393,6 +437,90 @@ ALTER TABLE ONLY public.users
     ADD CONSTRAINT users_username_key UNIQUE (username);
 
 
+--
+-- Name: idx_formula_ingredients_formula_id; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_ingredients_formula_id ON public.formula_ingredients USING btree (formula_id);
+
+
+--
+-- Name: idx_formula_ingredients_ingredient_id; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_ingredients_ingredient_id ON public.formula_ingredients USING btree (ingredient_id);
+
+
+--
+-- Name: idx_formula_ingredients_sub_formula_id; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_ingredients_sub_formula_id ON public.formula_ingredients USING btree (sub_formula_id);
+
+
+--
+-- Name: idx_user_ingredients_user_lower_name; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_user_ingredients_user_lower_name ON public.user_ingredients USING btree (user_id, lower(name));
+
+
+--
+-- Name: idx_formula_line_search_formula; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_line_search_formula ON public.formula_line_search_index USING btree (formula_id);
+
+
+--
+-- Name: idx_formula_line_search_name; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_line_search_name ON public.formula_line_search_index USING btree (user_id, lower(ingredient_name), percentage);
+
+
+--
+-- Name: idx_formula_search_costo_por_kg; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_search_costo_por_kg ON public.formula_search_index USING btree (user_id, costo_por_kg);
+
+
+--
+-- Name: idx_formula_search_costo_total; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_search_costo_total ON public.formula_search_index USING btree (user_id, costo_total);
+
+
+--
+-- Name: idx_formula_search_fat_perc; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_search_fat_perc ON public.formula_search_index USING btree (user_id, fat_perc);
+
+
+--
+-- Name: idx_formula_search_protein_perc; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_search_protein_perc ON public.formula_search_index USING btree (user_id, protein_perc);
+
+
+--
+-- Name: idx_formula_search_total_kg; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_search_total_kg ON public.formula_search_index USING btree (user_id, total_kg);
+
+
+--
+-- Name: idx_formula_search_water_perc; Type: INDEX; Schema: public; Owner: formulador_db_user
+--
+
+CREATE INDEX idx_formula_search_water_perc ON public.formula_search_index USING btree (user_id, water_perc);
+
+
 --
 -- Name: formula_ingredients formula_ingredients_formula_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: formulador_db_user
 --
@@ -401,6 +529,46 @@ ALTER TABLE ONLY public.formula_ingredients
     ADD CONSTRAINT formula_ingredients_formula_id_fkey FOREIGN KEY (formula_id) REFERENCES public.formulas(id) ON DELETE CASCADE;
 
 
+--
+-- Name: formula_ingredients formula_ingredients_ingredient_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: formulador_db_user
+--
+
+ALTER TABLE ONLY public.formula_ingredients
+    ADD CONSTRAINT formula_ingredients_ingredient_id_fkey FOREIGN KEY (ingredient_id) REFERENCES public.user_ingredients(id) ON DELETE RESTRICT;
+
+
+--
+-- Name: formula_ingredients formula_ingredients_sub_formula_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: formulador_db_user
+--
+
+ALTER TABLE ONLY public.formula_ingredients
+    ADD CONSTRAINT formula_ingredients_sub_formula_id_fkey FOREIGN KEY (sub_formula_id) REFERENCES public.formulas(id) ON DELETE RESTRICT;
+
+
+--
+-- Name: formula_line_search_index formula_line_search_index_formula_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: formulador_db_user
+--
+
+ALTER TABLE ONLY public.formula_line_search_index
+    ADD CONSTRAINT formula_line_search_index_formula_id_fkey FOREIGN KEY (formula_id) REFERENCES public.formulas(id) ON DELETE CASCADE;
+
+
+--
+-- Name: formula_search_index formula_search_index_formula_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: formulador_db_user
+--
+
+ALTER TABLE ONLY public.formula_search_index
+    ADD CONSTRAINT formula_search_index_formula_id_fkey FOREIGN KEY (formula_id) REFERENCES public.formulas(id) ON DELETE CASCADE;
+
+
+--
+-- Name: formula_search_index formula_search_index_user_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: formulador_db_user
+--
+
+ALTER TABLE ONLY public.formula_search_index
+    ADD CONSTRAINT formula_search_index_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id) ON DELETE CASCADE;
+
+
 --
 -- Name: formulas formulas_user_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: formulador_db_user
 --
@@ -0,0 +1,107 @@
+-- schema_sqlite.sql
+-- Mismo esquema que schema.sql para el backend SQLite (DATABASE_URL=sqlite:///ruta.db).
+-- Se aplica completo en initialize_database(); todas las sentencias son idempotentes.
+
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    full_name TEXT,
+    is_verified BOOLEAN DEFAULT TRUE,
+    verification_code VARCHAR(6),
+    code_expiry TIMESTAMP,
+    session_token VARCHAR(64),
+    credits INTEGER DEFAULT 0,
+    credits_expiry_date TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS base_ingredients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    protein_percent REAL,
+    fat_percent REAL,
+    water_percent REAL,
+    "Ve_Protein_Percent" REAL,
+    notes TEXT,
+    water_retention_factor REAL,
+    min_usage_percent REAL,
+    max_usage_percent REAL,
+    precio_por_kg REAL,
+    categoria TEXT
+);
+
+CREATE TABLE IF NOT EXISTS user_ingredients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    protein_percent REAL,
+    fat_percent REAL,
+    water_percent REAL,
+    ve_protein_percent REAL,
+    notes TEXT,
+    water_retention_factor REAL,
+    min_usage_percent REAL,
+    max_usage_percent REAL,
+    precio_por_kg REAL,
+    categoria TEXT,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    UNIQUE (user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS formulas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_name TEXT NOT NULL,
+    description TEXT,
+    creation_date TEXT NOT NULL,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    revision INTEGER NOT NULL DEFAULT 0,
+    CONSTRAINT unique_user_product UNIQUE (user_id, product_name)
+);
+
+CREATE TABLE IF NOT EXISTS formula_ingredients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    formula_id INTEGER NOT NULL REFERENCES formulas(id) ON DELETE CASCADE,
+    ingredient_id INTEGER REFERENCES user_ingredients(id) ON DELETE RESTRICT,
+    quantity REAL NOT NULL,
+    unit TEXT NOT NULL,
+    sub_formula_id INTEGER REFERENCES formulas(id) ON DELETE RESTRICT,
+    CONSTRAINT formula_ingredients_line_target_check CHECK ((ingredient_id IS NULL) <> (sub_formula_id IS NULL))
+);
+
+CREATE TABLE IF NOT EXISTS bibliografia (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    titulo TEXT NOT NULL,
+    tipo TEXT,
+    contenido TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS formula_search_index (
+    formula_id INTEGER PRIMARY KEY REFERENCES formulas(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    total_kg REAL,
+    protein_perc REAL,
+    fat_perc REAL,
+    water_perc REAL,
+    costo_total REAL,
+    costo_por_kg REAL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS formula_line_search_index (
+    formula_id INTEGER NOT NULL REFERENCES formulas(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL,
+    ingredient_name TEXT NOT NULL,
+    percentage REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_formula_ingredients_formula_id ON formula_ingredients (formula_id);
+CREATE INDEX IF NOT EXISTS idx_formula_ingredients_ingredient_id ON formula_ingredients (ingredient_id);
+CREATE INDEX IF NOT EXISTS idx_formula_ingredients_sub_formula_id ON formula_ingredients (sub_formula_id);
+CREATE INDEX IF NOT EXISTS idx_user_ingredients_user_lower_name ON user_ingredients (user_id, lower(name));
+CREATE INDEX IF NOT EXISTS idx_formula_line_search_formula ON formula_line_search_index (formula_id);
+CREATE INDEX IF NOT EXISTS idx_formula_line_search_name ON formula_line_search_index (user_id, lower(ingredient_name), percentage);
+CREATE INDEX IF NOT EXISTS idx_formula_search_total_kg ON formula_search_index (user_id, total_kg);
+CREATE INDEX IF NOT EXISTS idx_formula_search_protein_perc ON formula_search_index (user_id, protein_perc);
+CREATE INDEX IF NOT EXISTS idx_formula_search_fat_perc ON formula_search_index (user_id, fat_perc);
+CREATE INDEX IF NOT EXISTS idx_formula_search_water_perc ON formula_search_index (user_id, water_perc);
+CREATE INDEX IF NOT EXISTS idx_formula_search_costo_total ON formula_search_index (user_id, costo_total);
+CREATE INDEX IF NOT EXISTS idx_formula_search_costo_por_kg ON formula_search_index (user_id, costo_por_kg);
@@ -0,0 +1,324 @@
+# sqlite_backend.py
+"""
+Backend SQLite para database.py (DATABASE_URL=sqlite:///ruta/al/archivo.db).
+
+Expone conexiones y cursores con la interfaz de psycopg2 que usa database.py
+(placeholders %s, 'with conn' transaccional, cursores como gestores de
+contexto, filas tipo dict con cursor_factory, execute_values), de modo que
+las mismas consultas sirven para los dos motores. Las pocas construcciones
+propias de PostgreSQL se traducen al vuelo:
+
+  = ANY(%s)        -> IN (?, ?, ...)
+  ILIKE            -> LIKE (SQLite ya compara sin distinguir mayúsculas ASCII)
+  NOW()            -> CURRENT_TIMESTAMP
+  %s::tipo         -> ?
+  ... FOR UPDATE   -> BEGIN IMMEDIATE (bloquea la base para escribir)
+  ON COMMIT DROP   -> la tabla temporal se borra antes de crearla
+
+Cada conexión abre la base en modo WAL con pragmas para un único servidor.
+"""
+import datetime
+import functools
+import os
+import re
+import sqlite3
+import threading
+
+# Pragmas por conexión: WAL permite lecturas concurrentes con una escritura,
+# synchronous=NORMAL es seguro en WAL y evita un fsync por transacción.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('foreign_keys', 'ON'),
+    ('busy_timeout', '5000'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', '-32000'),      # 32 MB
+    ('mmap_size', '134217728'),    # 128 MB
+)
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema_sqlite.sql')
+# SQLite admite hasta 32766 parámetros por sentencia
+MAX_PARAMS = 32000
+
+_PLACEHOLDER = re.compile(r"=\s*ANY\(%s\)|%s|%%", re.IGNORECASE)
+_VALUES_ALIAS = re.compile(r"\(\s*VALUES\s+%s\s*\)\s+AS\s+(\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+_VALUES = re.compile(r"VALUES\s+%s", re.IGNORECASE)
+_CAST = re.compile(r"::\w+")
+_TEMP_TABLE = re.compile(r"CREATE\s+TEMP(?:ORARY)?\s+TABLE\s+(\w+)", re.IGNORECASE)
+
+
+def is_sqlite_url(url: str | None) -> bool:
+    return bool(url) and url.startswith('sqlite://')
+
+
+def path_from_url(url: str) -> str:
+    """sqlite:///datos/app.db -> datos/app.db ; sqlite:////srv/app.db -> /srv/app.db"""
+    path = url[len('sqlite://'):]
+    return path[1:] if path.startswith('/') else path
+
+
+def _register_types():
+    sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(sep=' '))
+    sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+    sqlite3.register_converter('TIMESTAMP', lambda raw: datetime.datetime.fromisoformat(raw.decode()))
+    sqlite3.register_converter('BOOLEAN', lambda raw: raw not in (b'0', b'', b'false', b'FALSE'))
+
+
+_register_types()
+
+
+@functools.lru_cache(maxsize=512)
+def _rewrite(sql: str) -> tuple[str, bool, str | None]:
+    """Reescrituras que no dependen de los parámetros (cacheadas por texto de la consulta)."""
+    lock = bool(re.search(r"\bFOR\s+UPDATE\b", sql, re.IGNORECASE))
+    sql = re.sub(r"\s+FOR\s+UPDATE\b(\s+OF\s+\w+)?", "", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bILIKE\b", "LIKE", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bNOW\(\)", "CURRENT_TIMESTAMP", sql, flags=re.IGNORECASE)
+    sql = _CAST.sub("", sql)
+    temp_table = None
+    if re.search(r"\bON\s+COMMIT\s+DROP\b", sql, re.IGNORECASE):
+        sql = re.sub(r"\s*\bON\s+COMMIT\s+DROP\b", "", sql, flags=re.IGNORECASE)
+        match = _TEMP_TABLE.search(sql)
+        temp_table = match.group(1) if match else None
+    return sql, lock, temp_table
+
+
+def translate(sql: str, params=None) -> tuple[str, list, bool, str | None]:
+    """Traduce una consulta de estilo psycopg2 a SQLite: (sql, parámetros, bloquear, tabla_temporal)."""
+    sql, lock, temp_table = _rewrite(sql)
+    if params is None:
+        return sql, [], lock, temp_table
+
+    params = list(params)
+    parts, values, index, pos = [], [], 0, 0
+    for match in _PLACEHOLDER.finditer(sql):
+        parts.append(sql[pos:match.start()])
+        pos = match.end()
+        token = match.group(0)
+        if token == '%%':
+            parts.append('%')
+        elif token == '%s':
+            parts.append('?')
+            values.append(params[index])
+            index += 1
+        else:
+            items = list(params[index])
+            index += 1
+            parts.append('IN (' + ', '.join('?' * len(items)) + ')')
+            values.extend(items)
+    parts.append(sql[pos:])
+    return ''.join(parts), values, lock, temp_table
+
+
+class Row(dict):
+    """Fila accesible por nombre y por posición, como psycopg2.extras.DictRow."""
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return dict.__getitem__(self, key)
+
+
+class Cursor:
+    """Cursor con la interfaz de psycopg2 sobre sqlite3."""
+
+    def __init__(self, connection: 'Connection', dict_rows: bool):
+        self.connection = connection
+        self._cursor = connection.raw.cursor()
+        self._dict_rows = dict_rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+    def execute(self, sql: str, params=None):
+        sql, values, lock, temp_table = translate(sql, params)
+        try:
+            if lock and not self.connection.raw.in_transaction:
+                self._cursor.execute("BEGIN IMMEDIATE")
+            if temp_table:
+                self._cursor.execute(f"DROP TABLE IF EXISTS temp.{temp_table}")
+            self._cursor.execute(sql, values)
+        except sqlite3.Error as e:
+            raise self.connection.translate_error(e) from e
+        return self
+
+    def executemany(self, sql: str, seq_of_params):
+        for params in seq_of_params:
+            self.execute(sql, params)
+
+    def execute_values(self, sql: str, rows: list, template: str | None = None, page_size: int = 500):
+        """Equivalente a psycopg2.extras.execute_values (sin 'fetch')."""
+        rows = [tuple(row) for row in rows]
+        if not rows:
+            return
+        width = len(rows[0])
+        row_template = _CAST.sub("", template) if template else '(' + ', '.join(['%s'] * width) + ')'
+        page_size = max(1, min(page_size, MAX_PARAMS // width))
+
+        alias = _VALUES_ALIAS.search(sql)
+        for start in range(0, len(rows), page_size):
+            page = rows[start:start + page_size]
+            if alias:
+                # SQLite no admite alias de columnas en (VALUES ...) AS v(a, b): se usa un SELECT con nombres
+                columns = [c.strip() for c in alias.group(2).split(',')]
+                first = 'SELECT ' + ', '.join(f"%s AS {c}" for c in columns)
+                rest = ' UNION ALL SELECT ' + ', '.join(['%s'] * width)
+                values_sql = f"({first}{rest * (len(page) - 1)}) AS {alias.group(1)}"
+                page_sql = sql[:alias.start()] + values_sql + sql[alias.end():]
+            else:
+                match = _VALUES.search(sql)
+                page_sql = sql[:match.start()] + 'VALUES ' + ', '.join([row_template] * len(page)) + sql[match.end():]
+            self.execute(page_sql, [value for row in page for value in row])
+
+    def _row(self, raw):
+        if raw is None or not self._dict_rows:
+            return raw
+        return Row(zip([d[0] for d in self._cursor.description], raw))
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size: int = 1):
+        return [self._row(r) for r in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cursor.fetchall()]
+
+
+class Connection:
+    """
+    Conexión con la semántica de psycopg2: 'with conn' confirma o deshace la
+    transacción pero no cierra la conexión.
+    """
+
+    def __init__(self, raw: sqlite3.Connection, translate_error):
+        self.raw = raw
+        self.translate_error = translate_error
+        self._closed = 0
+
+    @property
+    def closed(self) -> int:
+        return self._closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def cursor(self, cursor_factory=None) -> Cursor:
+        return Cursor(self, dict_rows=cursor_factory is not None)
+
+    def execute(self, sql: str, params=None) -> Cursor:
+        return self.cursor(cursor_factory=True).execute(sql, params)
+
+    def commit(self):
+        try:
+            self.raw.commit()
+        except sqlite3.Error as e:
+            raise self.translate_error(e) from e
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        if not self._closed:
+            self.raw.close()
+            self._closed = 1
+
+
+class SQLitePool:
+    """Conexiones reutilizables a un archivo SQLite, propias de cada proceso."""
+
+    def __init__(self, url: str, maxconn: int = 10, translate_error=None):
+        self.name = 'sqlite'
+        self.path = path_from_url(url)
+        self.maxconn = maxconn
+        self.translate_error = translate_error or (lambda e: e)
+        self._idle = []
+        self._in_use = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        raw = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False,
+                              detect_types=sqlite3.PARSE_DECLTYPES)
+        for pragma, value in PRAGMAS:
+            raw.execute(f"PRAGMA {pragma} = {value}")
+        return Connection(raw, self.translate_error)
+
+    def ensure(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Las conexiones SQLite no deben cruzar un fork: se abandonan sin usarlas
+                self._idle, self._in_use, self._pid = [], 0, os.getpid()
+
+    def getconn(self) -> Connection:
+        self.ensure()
+        with self._lock:
+            if self._idle:
+                self._in_use += 1
+                return self._idle.pop()
+            if self._in_use >= self.maxconn:
+                raise self.translate_error(sqlite3.OperationalError("connection pool exhausted"))
+            self._in_use += 1
+        try:
+            return self._connect()
+        except sqlite3.Error as e:
+            with self._lock:
+                self._in_use -= 1
+            raise self.translate_error(e) from e
+
+    def putconn(self, conn: Connection):
+        if conn is None:
+            return
+        if conn.raw.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use = max(0, self._in_use - 1)
+            if not conn.closed and self._pid == os.getpid():
+                self._idle.append(conn)
+
+    def stats(self) -> dict:
+        """Conexiones en uso, libres y máximo de este proceso."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return {'in_use': 0, 'idle': 0, 'max': self.maxconn}
+            return {'in_use': self._in_use, 'idle': len(self._idle), 'max': self.maxconn}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def initialize(conn: Connection):
+    """Crea las tablas e índices de schema_sqlite.sql (idempotente)."""
+    with open(SCHEMA_FILE, encoding='utf-8') as schema:
+        conn.raw.executescript(schema.read())
+    conn.commit()
@@ -0,0 +1,121 @@
+# subformulas.py
+"""
+Composición de fórmulas que usan otras fórmulas (premezclas, salmueras) como ingrediente.
+
+La composición por kg de cada sub-fórmula se calcula una vez y se memoriza;
+al cambiar una fórmula o un ingrediente solo se invalidan ella y las fórmulas
+que la contienen (sus ancestros en el grafo de sub-fórmulas).
+"""
+import cache
+import calculations
+
+# Espacio de caché: "<user_id>:<formula_id>" -> composición por kg como si fuera un ingrediente.
+# Como los detalles de fórmula, solo se memoriza con un backend compartido entre workers.
+ROLLUP_NAMESPACE = 'formula_rollup'
+
+
+class SubFormulaCycleError(ValueError):
+    """La fórmula se contiene a sí misma a través de sus sub-fórmulas."""
+
+
+def _composition(lines: list[dict]) -> dict:
+    """Convierte los totales de una fórmula en los campos de un ingrediente equivalente."""
+    processed = calculations.process_ingredients_for_display(lines)
+    totals = calculations.calculate_formula_totals(processed)
+    total_kg = totals.get('total_kg', 0)
+
+    # La categoría de la premezcla es la de su mayor peso (p. ej. una salmuera es Agua/Hielo)
+    weight_by_category = {}
+    for line in lines:
+        categoria = line.get('categoria') or calculations.DEFAULT_CATEGORY
+        kg = calculations.convert_to_kg(line.get('quantity', 0), line.get('unit', ''))
+        weight_by_category[categoria] = weight_by_category.get(categoria, 0) + kg
+    categoria = max(weight_by_category, key=weight_by_category.get) if weight_by_category else calculations.DEFAULT_CATEGORY
+
+    return {
+        'protein_percent': totals.get('protein_perc', 0),
+        'fat_percent': totals.get('fat_perc', 0),
+        'water_percent': totals.get('water_perc', 0),
+        'water_retention_factor': (totals.get('total_retained_water_kg', 0) / total_kg) if total_kg > 0 else 0,
+        'precio_por_kg': totals.get('costo_por_kg', 0),
+        'categoria': categoria,
+    }
+
+
+def rollup(formula_id: int, user_id: int, loader, _path: tuple = ()) -> dict | None:
+    """
+    Composición por kg de la fórmula, memorizada.
+    'loader(formula_id, user_id)' devuelve la fórmula en el formato de database.get_formula_by_id.
+    """
+    if formula_id in _path:
+        raise SubFormulaCycleError(f"Ciclo de sub-fórmulas: {' -> '.join(map(str, _path + (formula_id,)))}")
+
+    key = f"{user_id}:{formula_id}"
+    use_cache = cache.is_shared()
+    cached = cache.get_cache().get(ROLLUP_NAMESPACE, key) if use_cache else None
+    if cached is not None:
+        return cached
+
+    formula_data = loader(formula_id, user_id)
+    if not formula_data:
+        return None
+    composition = _composition(expand_lines(formula_data, user_id, loader, _path + (formula_id,)))
+    if use_cache:
+        cache.get_cache().set(ROLLUP_NAMESPACE, key, composition)
+    return composition
+
+
+def expand_lines(formula_data: dict, user_id: int, loader, _path: tuple | None = None) -> list[dict]:
+    """
+    Devuelve las líneas de la fórmula listas para calculations: las de ingredientes
+    tal cual y cada sub-fórmula como un ingrediente con su composición acumulada.
+    """
+    lines = list(formula_data.get('ingredients', []))
+    sub_lines = formula_data.get('sub_formulas') or []
+    if not sub_lines:
+        return lines
+
+    path = _path if _path is not None else (formula_data.get('id'),)
+    for sub in sub_lines:
+        composition = rollup(sub['sub_formula_id'], user_id, loader, path)
+        if composition is None:
+            continue
+        lines.append({
+            **sub,
+            'ingredient_id': None,
+            'min_usage_percent': None,
+            'max_usage_percent': None,
+            **composition,
+        })
+    return lines
+
+
+def expand_bulk(formulas: dict[int, dict], user_id: int, loader) -> dict[int, list[dict]]:
+    """
+    expand_lines para {formula_id: formula_data} (database.get_formulas_bulk).
+    Las sub-fórmulas que ya están en 'formulas' no se vuelven a cargar con 'loader'.
+    """
+    def bulk_loader(formula_id, uid):
+        return formulas.get(formula_id) or loader(formula_id, uid)
+
+    return {
+        formula_id: expand_lines(formula_data, user_id, bulk_loader)
+        for formula_id, formula_data in formulas.items()
+    }
+
+
+def invalidate(user_id: int, formula_ids: list[int], ancestors_loader=None) -> set[int]:
+    """
+    Invalida la composición memorizada de 'formula_ids' y de las fórmulas que las contienen.
+    'ancestors_loader(formula_ids)' devuelve esos ancestros (database.get_formula_ancestors).
+    Devuelve el conjunto de fórmulas afectadas.
+    """
+    formula_ids = [fid for fid in formula_ids if fid is not None]
+    if not formula_ids:
+        return set()
+    affected = set(formula_ids)
+    if ancestors_loader is not None:
+        affected |= set(ancestors_loader(formula_ids))
+    for fid in affected:
+        cache.invalidate(ROLLUP_NAMESPACE, f"{user_id}:{fid}")
+    return affected
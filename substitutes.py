@@ -0,0 +1,126 @@
+# substitutes.py
+"""
+Búsqueda de ingredientes sustitutos por vecinos más cercanos.
+Cada ingrediente es un vector (proteína, grasa, agua, retención, precio)
+normalizado; se indexa en un KD-tree por categoría para consultas rápidas.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import cache
+
+FEATURES = ('protein_percent', 'fat_percent', 'water_percent', 'water_retention_factor', 'precio_por_kg')
+ALL_CATEGORIES = '*'
+CACHE_NAMESPACE = 'substitutes'
+# Los índices (KD-trees) no se pueden guardar en Redis: cada proceso guarda los
+# suyos, con un tope de usuarios (LRU) y de antigüedad, y los valida en cada
+# lectura contra la versión del espacio de nombres en la capa de caché.
+INDEX_MAX_USERS = int(os.getenv('SUBSTITUTES_MAX_INDEXES', '64'))
+INDEX_TTL = float(os.getenv('SUBSTITUTES_INDEX_TTL', '300'))
+
+_index_cache = OrderedDict()  # user_id -> (versión, construido en, índice)
+_index_lock = threading.Lock()
+
+
+class IngredientIndex:
+    """KD-trees sobre el catálogo de un usuario más los ingredientes base que no tiene."""
+
+    def __init__(self, user_ingredients: list[dict], base_ingredients: list[dict]):
+        user_names = {(ing.get('name') or '').lower() for ing in user_ingredients}
+        self.items = [{**ing, 'source': 'user'} for ing in user_ingredients]
+        self.items += [
+            {**ing, 'source': 'base'} for ing in base_ingredients
+            if (ing.get('name') or '').lower() not in user_names
+        ]
+        raw = np.array([[_as_float(item.get(f)) for f in FEATURES] for item in self.items], dtype=float)
+        raw = raw.reshape(len(self.items), len(FEATURES))
+        # Escala por desviación estándar para que el precio no domine a los porcentajes
+        scale = raw.std(axis=0) if len(raw) else np.ones(len(FEATURES))
+        self.scale = np.where(scale > 0, scale, 1.0)
+        self.vectors = raw / self.scale
+
+        from scipy.spatial import cKDTree  # scipy tarda ~0.4 s en importarse; solo lo usa este índice
+
+        self.by_user_id = {item['id']: i for i, item in enumerate(self.items) if item['source'] == 'user'}
+        self.trees = {}
+        groups = {ALL_CATEGORIES: np.arange(len(self.items))}
+        for i, item in enumerate(self.items):
+            groups.setdefault(item.get('categoria'), []).append(i)
+        for categoria, positions in groups.items():
+            positions = np.asarray(positions, dtype=np.intp)
+            if len(positions):
+                self.trees[categoria] = (cKDTree(self.vectors[positions]), positions)
+
+    def nearest(self, user_ingredient_id: int, k: int = 5, same_category: bool = False) -> list[dict]:
+        """Devuelve los k ingredientes más cercanos (excluido el propio) con su distancia."""
+        pos = self.by_user_id.get(user_ingredient_id)
+        if pos is None:
+            return []
+        key = self.items[pos].get('categoria') if same_category else ALL_CATEGORIES
+        tree, positions = self.trees[key]
+        n = min(k + 1, len(positions))
+        distances, idx = tree.query(self.vectors[pos], k=n)
+        distances, idx = np.atleast_1d(distances), np.atleast_1d(idx)
+
+        results = []
+        for distance, i in zip(distances, idx):
+            item_pos = positions[i]
+            if item_pos == pos:
+                continue
+            results.append({**self.items[item_pos], 'distance': float(distance)})
+        return results[:k]
+
+    def get(self, user_ingredient_id: int) -> dict | None:
+        pos = self.by_user_id.get(user_ingredient_id)
+        return self.items[pos] if pos is not None else None
+
+
+def _namespace(user_id: int) -> str:
+    return f"{CACHE_NAMESPACE}:{user_id}"
+
+
+def _version(user_id: int) -> tuple:
+    return cache.version(CACHE_NAMESPACE), cache.version(_namespace(user_id))
+
+
+def get_index(user_id: int, loader) -> IngredientIndex:
+    """
+    Devuelve el índice del usuario, construyéndolo con loader() -> (user_ings, base_ings)
+    si no está en caché, si caducó o si otro worker lo invalidó. Se invalida con
+    invalidate() al modificar el catálogo.
+    """
+    version = _version(user_id)
+    now = time.monotonic()
+    with _index_lock:
+        entry = _index_cache.get(user_id)
+        if entry is not None and entry[0] == version and now - entry[1] < INDEX_TTL:
+            _index_cache.move_to_end(user_id)
+            return entry[2]
+    index = IngredientIndex(*loader())
+    with _index_lock:
+        _index_cache[user_id] = (version, now, index)
+        _index_cache.move_to_end(user_id)
+        while len(_index_cache) > INDEX_MAX_USERS:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def invalidate(user_id: int | None = None):
+    """
+    Descarta el índice de un usuario (o todos si user_id es None) en este proceso
+    y sube la versión en la capa de caché para que los demás workers lo reconstruyan.
+    """
+    with _index_lock:
+        if user_id is None:
+            _index_cache.clear()
+        else:
+            _index_cache.pop(user_id, None)
+    cache.invalidate(CACHE_NAMESPACE if user_id is None else _namespace(user_id))
+
+
+def _as_float(value) -> float:
+    return float(value) if isinstance(value, (int, float)) else 0.0
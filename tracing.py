@@ -0,0 +1,301 @@
+# tracing.py
+"""
+Trazas ligeras por petición.
+
+Cada petición abre una traza con un span raíz; dentro se anotan spans para
+las funciones de database.py (y la espera del pool), los pasos de cálculo y
+las llamadas externas (OpenAI, Stripe). Fuera de una petición, span() no hace
+nada, así que las funciones instrumentadas se pueden llamar desde scripts.
+
+Las peticiones que tardan más de SLOW_REQUEST_MS se registran con el árbol de
+spans y su duración, para ver si el tiempo se fue en esperar conexión, en una
+consulta, en los cálculos o en un servicio externo.
+
+Con TRACE_EXPORT las trazas se exportan en formato OTLP/JSON:
+  TRACE_EXPORT=file:/var/log/formulador/traces.jsonl    una traza por línea
+  TRACE_EXPORT=http://localhost:4318/v1/traces          colector OTLP/HTTP
+La exportación va en un hilo aparte con una cola acotada (si se llena, se
+descartan trazas en lugar de frenar las peticiones). TRACE_SAMPLE_RATE
+limita la fracción de trazas exportadas; las lentas se exportan siempre.
+El encabezado W3C 'traceparent' entrante se respeta para enlazar con el
+proxy o el cliente; la respuesta lleva el id de la traza en X-Trace-Id.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+log = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv('TRACING', '1') != '0'
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '1000'))
+TRACE_EXPORT = os.getenv('TRACE_EXPORT', '').strip()
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'formulador')
+# Tope de spans por traza: una petición con miles de consultas no debe crecer sin límite
+MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '500'))
+EXPORT_QUEUE_SIZE = 1000
+EXPORT_BATCH_SIZE = 50
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_current = ContextVar('tracing_current', default=None)
+
+
+class Span:
+    __slots__ = ('span_id', 'parent_id', 'name', 'start_ns', 'end_ns', 'attributes', 'error', 'depth')
+
+    def __init__(self, name: str, parent_id: str | None, depth: int, attributes: dict | None = None):
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+        self.depth = depth
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class Trace:
+    """Spans de una petición. Solo la usa el hilo (o contexto) que atiende la petición."""
+
+    def __init__(self, trace_id: str | None = None):
+        self.trace_id = trace_id or f"{random.getrandbits(128):032x}"
+        self.spans = []
+        self.dropped = 0
+
+    def open(self, name: str, parent: Span | None, attributes: dict | None = None) -> Span | None:
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return None
+        span = Span(name, parent.span_id if parent else None, parent.depth + 1 if parent else 0, attributes)
+        self.spans.append(span)
+        return span
+
+
+def current_trace() -> Trace | None:
+    current = _current.get()
+    return current[0] if current else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Span hijo del span activo; no hace nada si no hay traza en curso."""
+    current = _current.get()
+    if current is None:
+        yield None
+        return
+    trace, parent = current
+    child = trace.open(name, parent, attributes)
+    if child is None:
+        yield None
+        return
+    token = _current.set((trace, child))
+    try:
+        yield child
+    except Exception as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        _current.reset(token)
+
+
+def traced(name: str):
+    """Decorador: ejecuta la función dentro de un span."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return f(*args, **kwargs)
+            with span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_trace(name: str, traceparent: str | None = None, **attributes) -> tuple[Trace, Span, object]:
+    """Abre una traza con su span raíz; devuelve (traza, raíz, token para finish_trace)."""
+    match = _TRACEPARENT.match(traceparent or '')
+    trace = Trace(match.group(1) if match else None)
+    root = trace.open(name, None, attributes)
+    if match:
+        root.parent_id = match.group(2)
+    return trace, root, _current.set((trace, root))
+
+
+def finish_trace(trace: Trace, root: Span, token):
+    root.end_ns = time.time_ns()
+    _current.reset(token)
+    slow = root.duration_ms >= SLOW_REQUEST_MS
+    if slow:
+        log.warning(slow_request_report(trace, root))
+    if _exporter is not None and (slow or random.random() < TRACE_SAMPLE_RATE):
+        _exporter.submit(trace)
+
+
+def slow_request_report(trace: Trace, root: Span) -> str:
+    """Árbol de spans con su duración y el tiempo no cubierto por spans hijos."""
+    lines = [f"Petición lenta: {root.name} {root.duration_ms:.0f} ms (traza {trace.trace_id})"]
+    for s in trace.spans[1:]:
+        error = f" [{s.error}]" if s.error else ''
+        lines.append(f"{'  ' * s.depth}{s.name} {s.duration_ms:.1f} ms{error}")
+    own = root.duration_ms - sum(s.duration_ms for s in trace.spans if s.depth == 1)
+    lines.append(f"  (fuera de spans: {own:.1f} ms)")
+    if trace.dropped:
+        lines.append(f"  ({trace.dropped} spans descartados por TRACE_MAX_SPANS)")
+    return '\n'.join(lines)
+
+
+# --- Exportación OTLP/JSON ---
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def to_otlp(traces: list[Trace]) -> dict:
+    """Documento ExportTraceServiceRequest de OTLP en su codificación JSON."""
+    spans = []
+    for trace in traces:
+        for s in trace.spans:
+            if s.end_ns is None:
+                continue
+            item = {
+                'traceId': trace.trace_id,
+                'spanId': s.span_id,
+                'name': s.name,
+                'kind': 2 if s.depth == 0 else 1,  # SERVER para la raíz, INTERNAL para el resto
+                'startTimeUnixNano': str(s.start_ns),
+                'endTimeUnixNano': str(s.end_ns),
+                'attributes': [_attribute(k, v) for k, v in s.attributes.items()],
+                'status': {'code': 2, 'message': s.error} if s.error else {'code': 0},
+            }
+            if s.parent_id:
+                item['parentSpanId'] = s.parent_id
+            spans.append(item)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [_attribute('service.name', SERVICE_NAME), _attribute('process.pid', os.getpid())]},
+        'scopeSpans': [{'scope': {'name': 'formulador.tracing'}, 'spans': spans}],
+    }]}
+
+
+class Exporter:
+    """Envía trazas en segundo plano a un archivo JSONL o a un colector OTLP/HTTP."""
+
+    def __init__(self, target: str):
+        self.target = target
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Un hilo por proceso: tras un fork (workers de gunicorn) hay que arrancarlo de nuevo
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+                threading.Thread(target=self._run, name='trace-exporter', daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, trace: Trace):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        pending = self._queue
+        while True:
+            batch = [pending.get()]
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                log.warning(f"No se pudieron exportar {len(batch)} trazas a {self.target}: {e}")
+
+    def _write(self, batch: list[Trace]):
+        if self.target.startswith('file:'):
+            with open(self.target[len('file:'):], 'a', encoding='utf-8') as f:
+                for trace in batch:
+                    f.write(json.dumps(to_otlp([trace]), separators=(',', ':')) + '\n')
+            return
+        request = urllib.request.Request(
+            self.target, data=json.dumps(to_otlp(batch)).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST',
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+    def snapshot(self) -> dict:
+        return {'target': self.target, 'exported': self.exported, 'dropped': self.dropped, 'failed': self.failed}
+
+
+_exporter = Exporter(TRACE_EXPORT) if TRACE_EXPORT else None
+
+
+def exporter_snapshot() -> dict | None:
+    return _exporter.snapshot() if _exporter is not None else None
+
+
+def init_app(app):
+    """Abre una traza por petición y la cierra en teardown (también si hubo excepción)."""
+    from flask import g, request
+
+    if not TRACING_ENABLED:
+        return
+
+    @app.before_request
+    def _start_request_trace():
+        g._trace = start_trace(f"{request.method} {request.path}", request.headers.get('traceparent'),
+                               **{'http.method': request.method, 'http.target': request.path})
+
+    @app.after_request
+    def _annotate_response(response):
+        started = g.get('_trace')
+        if started is not None:
+            trace, root, _ = started
+            if request.url_rule is not None:
+                root.name = f"{request.method} {request.url_rule.rule}"
+                root.attributes['http.route'] = request.url_rule.rule
+            root.attributes['http.status_code'] = response.status_code
+            if response.status_code >= 500:
+                root.error = str(response.status_code)
+            response.headers['X-Trace-Id'] = trace.trace_id
+        return response
+
+    @app.teardown_request
+    def _finish_request_trace(exc):
+        started = g.pop('_trace', None)
+        if started is None:
+            return
+        if exc is not None:
+            started[1].error = type(exc).__name__
+        finish_trace(*started)
@@ -0,0 +1,108 @@
+# variability.py
+"""
+Simulación Monte Carlo de la variabilidad de composición de las materias primas.
+Cada sorteo perturba proteína/grasa/agua de las líneas según su dispersión y
+recalcula los totales con la misma matemática que calculate_formula_totals,
+todo de forma vectorizada con arreglos (sorteos, líneas).
+"""
+import numpy as np
+
+import rules
+from formula_arrays import FormulaArrays
+
+# Desviación estándar por defecto (puntos porcentuales) según la categoría.
+# Las materias primas cárnicas son las que más varían entre lotes.
+DEFAULT_SPREADS = {
+    "Cárnico": {'protein_sd': 1.5, 'fat_sd': 3.0, 'water_sd': 2.0},
+}
+SPREAD_KEYS = ('protein_sd', 'fat_sd', 'water_sd')
+PERCENTILES = (5, 25, 50, 75, 95)
+DEFAULT_DRAWS = 20000
+MAX_DRAWS = 100000
+# Límite de elementos por bloque (sorteos x líneas) para acotar la memoria
+MAX_BLOCK_ELEMENTS = 4_000_000
+
+
+def _line_spreads(arrays: FormulaArrays, spreads: dict) -> np.ndarray:
+    """Matriz (líneas, 3) de desviaciones: por línea > por categoría > 'default' > DEFAULT_SPREADS."""
+    result = np.zeros((len(arrays.lines), len(SPREAD_KEYS)))
+    for i, line in enumerate(arrays.lines):
+        rule = (
+            spreads.get(str(line.get('formula_ingredient_id')))
+            or spreads.get(line.get('categoria') or '')
+            or spreads.get('default')
+            or DEFAULT_SPREADS.get(line.get('categoria'), {})
+        )
+        result[i] = [float(rule.get(key, 0) or 0) for key in SPREAD_KEYS]
+    return result
+
+
+def _default_targets(product_name: str | None) -> dict:
+    limits = rules.PRODUCT_TYPE_RULES[rules.product_type_for(product_name)]
+    return {key: limits[key] for key in rules.PRODUCT_LIMIT_KEYS if key in limits}
+
+
+def _band(values: np.ndarray) -> dict:
+    finite = values[np.isfinite(values)]
+    if not len(finite):
+        return {f"p{p}": None for p in PERCENTILES} | {'mean': None}
+    band = {f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(finite, PERCENTILES))}
+    band['mean'] = float(finite.mean())
+    return band
+
+
+def simulate_formula(formula_data: dict, spreads: dict | None = None, targets: dict | None = None,
+                     draws: int = DEFAULT_DRAWS, seed: int | None = None) -> dict:
+    """
+    Simula 'draws' lotes de la fórmula (formato de get_formula_by_id).
+    'targets' admite protein_min, fat_max, water_protein_max, fat_protein_max;
+    si no se indica se usan los límites del tipo de producto de rules.py.
+    """
+    draws = max(100, min(int(draws), MAX_DRAWS))
+    targets = targets if targets is not None else _default_targets(formula_data.get('product_name'))
+    arrays = FormulaArrays({formula_data.get('id'): formula_data.get('ingredients', [])})
+    n_lines = len(arrays.lines)
+    if n_lines == 0:
+        raise ValueError("La fórmula no tiene ingredientes.")
+
+    sd = _line_spreads(arrays, spreads or {})
+    rng = np.random.default_rng(seed)
+    block = max(1, MAX_BLOCK_ELEMENTS // n_lines)
+
+    collected = {key: [] for key in ('protein_perc', 'fat_perc', 'water_perc', 'aw_fp_ratio', 'af_fp_ratio')}
+    for start in range(0, draws, block):
+        size = min(block, draws - start)
+        noise = rng.standard_normal((len(SPREAD_KEYS), size, n_lines)) * sd.T[:, None, :]
+        protein = np.clip(arrays.protein + noise[0], 0.0, 100.0)
+        fat = np.clip(arrays.fat + noise[1], 0.0, 100.0)
+        water = np.clip(arrays.water + noise[2], 0.0, 100.0)
+        totals = arrays.totals(kg=np.broadcast_to(arrays.kg, (size, n_lines)),
+                               protein=protein, fat=fat, water=water)
+        for key in collected:
+            collected[key].append(totals[key][:, 0])
+    sims = {key: np.concatenate(parts) for key, parts in collected.items()}
+
+    breach_checks = {
+        'protein_min': lambda v: sims['protein_perc'] < v,
+        'fat_max': lambda v: sims['fat_perc'] > v,
+        'water_protein_max': lambda v: sims['aw_fp_ratio'] > v,
+        'fat_protein_max': lambda v: sims['af_fp_ratio'] > v,
+    }
+    breach = {
+        key: float(check(float(targets[key])).mean())
+        for key, check in breach_checks.items() if targets.get(key) is not None
+    }
+    any_breach = np.zeros(draws, dtype=bool)
+    for key, check in breach_checks.items():
+        if targets.get(key) is not None:
+            any_breach |= check(float(targets[key]))
+
+    return {
+        'formula_id': formula_data.get('id'),
+        'product_name': formula_data.get('product_name'),
+        'draws': draws,
+        'targets': targets,
+        'bands': {key: _band(values) for key, values in sims.items()},
+        'breach_probability': breach,
+        'any_breach_probability': float(any_breach.mean()),
+    }